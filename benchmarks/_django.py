@@ -0,0 +1,54 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run against a throwaway test database created with the project's
+real migrations, so they never touch db.sqlite3 or the production database.
+"""
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "story_generator.settings")
+    import django
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    """Create a migrated test database for the duration of the block"""
+    from django.db import connection
+
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    tmpdir = None
+    if connection.vendor == "sqlite":
+        # On-disk so large seeded tables don't have to fit in memory
+        tmpdir = tempfile.TemporaryDirectory()
+        test_settings["NAME"] = os.path.join(tmpdir.name, "bench.sqlite3")
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmpdir:
+            tmpdir.cleanup()
+
+
+def timed(fn, repeat: int = 50):
+    """Run fn `repeat` times; return (median_ms, p95_ms)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
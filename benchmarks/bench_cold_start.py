@@ -0,0 +1,89 @@
+"""
+Measure instance and worker cold start.
+
+  boot    the release steps before a worker starts: collectstatic + migrate
+          as separate commands (the old startup.sh) vs one `startup_tasks`
+          run on an unchanged tree
+  worker  a fresh interpreter importing the WSGI app and serving its first
+          POST /generate/ (offline: local LLM stub, procedural images)
+  fork    the same with WSGI_PRELOAD on: the master imports and warms the
+          app, then a forked worker serves the first POST (gunicorn --preload)
+
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from _django import BASE_DIR
+
+WORKER_SCRIPT = r"""
+import os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {base!r})
+from story_generator.wsgi import application
+from django.test import Client
+imported = time.perf_counter()
+print(f"import {{(imported - start) * 1000:.1f}}", flush=True)
+if {fork}:
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        sys.exit(0)
+    imported = time.perf_counter()
+response = Client().post('/generate/', {{'prompt': 'a lighthouse keeper befriends a storm', 'fresh': '1'}})
+assert response.status_code == 200, response.status_code
+print(f"first {{(time.perf_counter() - imported) * 1000:.1f}}", flush=True)
+"""
+
+
+def run(args, env=None):
+    start = time.perf_counter()
+    result = subprocess.run(args, cwd=BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode:
+        sys.exit(f"{' '.join(args)} failed:\n{result.stderr}")
+    return (time.perf_counter() - start) * 1000, result.stdout
+
+
+def summary(samples):
+    return f"{statistics.median(samples):8.0f} ms median ({min(samples):.0f}-{max(samples):.0f})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    options = parser.parse_args()
+
+    env = dict(os.environ, LLM_ROUTING="local", IMAGE_SOURCE="procedural", LOG_LEVEL="WARNING")
+    env.setdefault("DJANGO_SETTINGS_MODULE", "story_generator.settings")
+    manage = [sys.executable, "manage.py"]
+
+    old_boot, new_boot = [], []
+    run(manage + ["startup_tasks"], env)  # settle: collect and migrate once
+    for _ in range(options.runs):
+        collect, _ = run(manage + ["collectstatic", "--noinput"], env)
+        migrate, _ = run(manage + ["migrate", "--noinput"], env)
+        old_boot.append(collect + migrate)
+        new_boot.append(run(manage + ["startup_tasks"], env)[0])
+    print(f"boot: collectstatic + migrate   {summary(old_boot)}")
+    print(f"boot: startup_tasks (no change) {summary(new_boot)}")
+
+    for preload in ("false", "true"):
+        worker_env = dict(env, WSGI_PRELOAD=preload)
+        imports, firsts = [], []
+        for _ in range(options.runs):
+            script = WORKER_SCRIPT.format(base=str(BASE_DIR), fork=preload == "true")
+            _, out = run([sys.executable, "-c", script], worker_env)
+            values = dict(line.split() for line in out.strip().splitlines())
+            imports.append(float(values["import"]))
+            firsts.append(float(values["first"]))
+        label = "preloaded master, forked worker" if preload == "true" else "fresh worker"
+        print(f"{label:>31}: import app {summary(imports)}")
+        print(f"{label:>31}: first POST {summary(firsts)}")
+
+
+if __name__ == "__main__":
+    main()
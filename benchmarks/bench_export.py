@@ -0,0 +1,75 @@
+"""
+Benchmark memory and throughput of the bulk export as the table grows.
+
+Seeds --rows stories into a throwaway database (scenes cycling through
+--scenes small files in a temporary media root, as with near-duplicate
+reuse), then exports growing prefixes of the table as NDJSON and as a ZIP
+into a counting sink. Peak RSS should stay flat as the row count grows.
+
+    python benchmarks/bench_export.py --rows 200000
+"""
+import argparse
+import resource
+import tempfile
+import time
+
+from _django import benchmark_database, setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+from django.core.files.base import ContentFile  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.test import override_settings  # noqa: E402
+
+from mainapp.export import export_ndjson, export_zip  # noqa: E402
+from mainapp.models import StoryGeneration  # noqa: E402
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(rows, scenes, batch=5000):
+    names = [default_storage.save(f"combined/bench_{i}.jpg", ContentFile(b"\xff\xd8" + bytes(20000) + b"\xff\xd9"))
+             for i in range(scenes)]
+    story = "Once upon a time " * 120
+    for start in range(0, rows, batch):
+        StoryGeneration.objects.bulk_create(
+            StoryGeneration(
+                user_prompt=f"A fox finds lantern number {i}", story=story,
+                character_description="A small fox in a red cloak", background_description="A misty harbour",
+                combined_image=names[i % scenes], storyboard=[],
+            )
+            for i in range(start, min(start + batch, rows))
+        )
+
+
+def drain(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--scenes", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), benchmark_database():
+        seed(args.rows, args.scenes)
+        baseline = peak_rss_mb()
+        print(f"{args.rows} rows seeded, {args.scenes} scene files; chunk size {settings.EXPORT_CHUNK_SIZE}")
+        print(f"{'rows':>8} {'format':>7} {'output':>10} {'rows/s':>9} {'peak RSS growth':>16}")
+        sizes = sorted({max(1, args.rows // 20), args.rows // 4, args.rows})
+        for rows in sizes:
+            queryset = StoryGeneration.objects.filter(id__lte=rows)
+            for name, export in (("ndjson", export_ndjson), ("zip", export_zip)):
+                start = time.perf_counter()
+                size = drain(export(queryset, settings.EXPORT_CHUNK_SIZE))
+                elapsed = time.perf_counter() - start
+                print(f"{rows:>8} {name:>7} {size / 1024 / 1024:>8.1f}MB {rows / elapsed:>9.0f} "
+                      f"{peak_rss_mb() - baseline:>13.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
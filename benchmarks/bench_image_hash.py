@@ -0,0 +1,119 @@
+"""
+Benchmark perceptual hashing and near-duplicate lookup.
+
+Times dhash() on procedural 512x512 images, then builds an index of
+--hashes random 64-bit hashes with --duplicates planted near-duplicates
+(a few bits flipped, as re-encoded or slightly different renders give) and
+compares lookups within IMAGE_DEDUPE_DISTANCE through the multi-index
+HashIndex against a linear scan and a BK-tree.
+
+    python benchmarks/bench_image_hash.py --hashes 50000
+"""
+import argparse
+import random
+import time
+
+from _django import setup_django, timed
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+from mainapp.phash import HASH_BITS, HashIndex, dhash, hamming  # noqa: E402
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance, for comparison"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, story_id, value):
+        node = [value, story_id, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, value, max_distance):
+        matches, stack = [], [self.root] if self.root else []
+        while stack:
+            stored, story_id, children = stack.pop()
+            distance = hamming(value, stored)
+            if distance <= max_distance:
+                matches.append((story_id, distance))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+
+def flip_bits(rng, value, bits):
+    for position in rng.sample(range(HASH_BITS), bits):
+        value ^= 1 << position
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hashes", type=int, default=50000)
+    parser.add_argument("--duplicates", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    max_distance = settings.IMAGE_DEDUPE_DISTANCE
+
+    images = [ProceduralSource.render(f"character {i}", 512, 512) for i in range(20)]
+    median, p95 = timed(lambda: [dhash(image) for image in images], repeat=20)
+    print(f"dhash 512x512:  median {median / len(images) * 1000:.0f} us, p95 {p95 / len(images) * 1000:.0f} us")
+
+    rng = random.Random(42)
+    hashes = [rng.getrandbits(HASH_BITS) for _ in range(args.hashes)]
+    for i in range(args.duplicates):
+        hashes.append(flip_bits(rng, hashes[i], rng.randint(1, max_distance)))
+    queries = [flip_bits(rng, hashes[rng.randrange(len(hashes))], rng.randint(0, max_distance))
+               for _ in range(args.queries)]
+    pairs = list(enumerate(hashes))
+
+    index, tree = HashIndex(), BKTree()
+    start = time.perf_counter()
+    for story_id, value in pairs:
+        index.add(story_id, value)
+    index_build = time.perf_counter() - start
+    start = time.perf_counter()
+    for story_id, value in pairs:
+        tree.add(story_id, value)
+    tree_build = time.perf_counter() - start
+    print(f"{len(hashes)} hashes, distance <= {max_distance}, {args.queries} queries")
+    print(f"build: multi-index {index_build * 1000:.0f} ms, BK-tree {tree_build * 1000:.0f} ms")
+
+    def linear(value):
+        matches = [(story_id, hamming(value, stored)) for story_id, stored in pairs]
+        return sorted((match for match in matches if match[1] <= max_distance), key=lambda match: match[1])
+
+    expected = [linear(value) for value in queries]
+    for label, find in (("linear scan", linear),
+                        ("BK-tree", lambda value: tree.find(value, max_distance)),
+                        ("multi-index", lambda value: index.find(value, max_distance))):
+        results = [find(value) for value in queries]
+        assert [set(r) for r in results] == [set(r) for r in expected], label
+        samples = []
+        for value in queries:
+            start = time.perf_counter()
+            find(value)
+            samples.append((time.perf_counter() - start) * 1e6)
+        samples.sort()
+        print(f"{label:<12} median {samples[len(samples) // 2]:8.0f} us, "
+              f"p95 {samples[int(len(samples) * 0.95) - 1]:8.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark ImageMerger throughput on the offline procedural image source.
+
+No network is involved: character and background images are rendered by
+ProceduralSource, so timings reflect only local CPU work.
+
+    python benchmarks/bench_image_merger.py --scenes 50
+"""
+import argparse
+import time
+
+from _django import setup_django
+
+setup_django()
+
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+from mainapp.compositing import ImageMerger  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", type=int, default=50)
+    parser.add_argument("--size", type=int, default=512, help="source image edge in pixels")
+    args = parser.parse_args()
+
+    render_s = compose_s = 0.0
+    for i in range(args.scenes):
+        start = time.perf_counter()
+        character = ProceduralSource.render(f"character {i}: a brave fox in a red cloak", args.size, args.size)
+        background = ProceduralSource.render(f"background {i}: a misty harbour town at dusk", args.size, args.size)
+        rendered = time.perf_counter()
+        scene = ImageMerger.compose_images(character, background)
+        compose_s += time.perf_counter() - rendered
+        render_s += rendered - start
+        assert scene, "composition failed"
+
+    print(f"scenes:               {args.scenes}")
+    print(f"procedural render:    {render_s / args.scenes * 1000:.1f} ms per scene (2 images)")
+    print(f"ImageMerger compose:  {compose_s / args.scenes * 1000:.1f} ms per scene")
+    print(f"compose throughput:   {args.scenes / compose_s:.1f} scenes/s per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark the logging cost a story generation puts on the request thread.
+
+"before" replays the INFO lines the generate view used to emit per request
+(f-strings formatted eagerly, basicConfig StreamHandler written inline).
+"after" replays the current calls (lazy DEBUG payloads, one structured
+summary line) through the queue handler, JSON formatter and filters that
+settings.LOGGING configures.
+Both write to a file; --write-delay-ms simulates a slow log sink.
+
+    python benchmarks/bench_logging.py --requests 2000 --write-delay-ms 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from _django import setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from mainapp.logs import DebugSampleFilter, JsonFormatter, QueueStreamHandler, RequestIdFilter  # noqa: E402
+
+RESPONSE = {
+    "id": "cmpl-1", "model": "sonar", "usage": {"prompt_tokens": 120, "completion_tokens": 480},
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": json.dumps({
+        "story": "Once upon a time " * 120,
+        "character": "A young witch in a patched green cloak",
+        "background": "A floating market at dawn",
+    })}}],
+}
+
+
+class SlowFile:
+    """File wrapper whose writes take at least `delay` seconds"""
+
+    def __init__(self, path, delay):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def before(logger, prompt, data):
+    ai_text = data["choices"][0]["message"]["content"]
+    logger.info(f"Generate story view called with method: {'POST'}")
+    logger.info(f"User prompt: {prompt[:100]}...")
+    logger.info("Building Perplexity API request...")
+    logger.info(f"Sending request to: {'https://api.perplexity.ai'}/chat/completions")
+    logger.info(f"Response status code: {200}")
+    logger.info(f"API Response type: {type(data)}")
+    logger.info(f"API Response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
+    choices = data["choices"]
+    logger.info(f"Choices type: {type(choices)}, length: {len(choices)}")
+    logger.info(f"First choice type: {type(choices[0])}")
+    logger.info(f"First choice keys: {list(choices[0].keys())}")
+    logger.info("✅ Extracted from message.content")
+    logger.info(f"Successfully extracted AI text: {ai_text[:200]}...")
+    logger.info(f"Clean text for parsing: {ai_text[:200]}...")
+    logger.info("✅ JSON parsing successful")
+    logger.info("Starting image generation...")
+    for description in ("character", "background"):
+        logger.info(f"Generating image for: {description[:50]}...")
+        logger.info(f"Generated image URL: {'https://image.pollinations.ai/prompt/' + description}...")
+    logger.info("Creating combined scene...")
+    logger.info("Rendering result template...")
+    logger.debug(f"Full response (first 500 chars): {str(data)[:500]}...")
+
+
+def after(logger, prompt, data):
+    ai_text = data["choices"][0]["message"]["content"]
+    logger.debug("User prompt: %.100s", prompt)
+    logger.debug("LLM response: %.200s", ai_text)
+    logger.info("Story generated", extra={
+        "event": "story_generated", "story_id": 42, "tier": "medium", "image_source": "pollinations",
+        "total_ms": 2315.4, "llm_ms": 1830.2, "image_fetch_ms": 402.9, "compose_ms": 71.3, "save_ms": 11.0,
+    })
+
+
+def run(name, emit, handler, requests):
+    logger = logging.getLogger(f"bench.{name}")
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    prompt = "a knight and a sleepy dragon guarding a lighthouse " * 3
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        emit(logger, prompt, RESPONSE)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-delay-ms", type=float, default=0.0, help="simulated latency per log write")
+    args = parser.parse_args()
+    delay = args.write_delay_ms / 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_stream = SlowFile(os.path.join(tmp, "before.log"), delay)
+        old_handler = logging.StreamHandler(old_stream)
+        old_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+        new_stream = SlowFile(os.path.join(tmp, "after.log"), delay)
+        new_handler = QueueStreamHandler(new_stream)
+        new_handler.setFormatter(JsonFormatter())
+        new_handler.addFilter(RequestIdFilter())
+        new_handler.addFilter(DebugSampleFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+
+        print(f"requests: {args.requests}, simulated write latency: {args.write_delay_ms} ms")
+        for name, emit, handler in (("before", before, old_handler), ("after", after, new_handler)):
+            median, p99 = run(name, emit, handler, args.requests)
+            print(f"{name:>6}: {median:8.1f} us median, {p99:8.1f} us p99 logging time per request")
+        new_handler.close()
+        print(f"after: {new_handler.dropped} records dropped on a full queue")
+        old_stream.close()
+        new_stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark inline image placeholders.
+
+Reports the size and compute time of ImageMerger.placeholder() for
+procedural character, background and composed scene images, then estimates
+when the first picture can be painted on a slow mobile link: with
+placeholders it arrives with the HTML, without them only after the full
+JPEG has been downloaded.
+
+    python benchmarks/bench_placeholders.py --kbps 400 --rtt 300
+"""
+import argparse
+
+from _django import setup_django, timed
+
+setup_django()
+
+from mainapp.compositing import ImageMerger  # noqa: E402
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kbps", type=float, default=400, help="link throughput (slow 3G is about 400)")
+    parser.add_argument("--rtt", type=float, default=300, help="round-trip time in ms")
+    parser.add_argument("--html-kb", type=float, default=20, help="result page size without placeholders")
+    args = parser.parse_args()
+
+    character = ProceduralSource.render("a brave fox in a red cloak", 512, 512)
+    background = ProceduralSource.render("a misty harbour town at dusk", 512, 512)
+    scene = ImageMerger.compose_scene(character, background)
+    images = {"character": character, "background": background, "scene": scene_image(scene)}
+
+    inline_bytes = 0
+    for name, image in images.items():
+        placeholder = ImageMerger.placeholder(image)
+        inline_bytes += len(placeholder)
+        median, p95 = timed(lambda: ImageMerger.placeholder(image), repeat=200)
+        print(f"{name:<11} {image.size[0]}x{image.size[1]}  placeholder {len(placeholder):4d} chars  "
+              f"median {median * 1000:4.0f} us, p95 {p95 * 1000:4.0f} us")
+
+    bytes_per_ms = args.kbps * 1000 / 8 / 1000
+    html = args.html_kb * 1024
+
+    def transfer(size):
+        # Request round trip plus transfer time
+        return args.rtt + size / bytes_per_ms
+
+    without = transfer(html) + transfer(len(scene))
+    with_placeholders = transfer(html + inline_bytes)
+    print(f"scene JPEG {len(scene) // 1024} KB, placeholders add {inline_bytes} bytes to the page")
+    print(f"first picture at {args.kbps:.0f} kbps, {args.rtt:.0f} ms RTT: "
+          f"{without:.0f} ms with the full scene, {with_placeholders:.0f} ms with placeholders")
+
+
+def scene_image(scene):
+    import io
+
+    from PIL import Image
+    return Image.open(io.BytesIO(scene.data)).convert("RGB")
+
+
+if __name__ == "__main__":
+    main()
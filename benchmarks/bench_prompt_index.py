@@ -0,0 +1,81 @@
+"""
+Benchmark near-duplicate prompt lookups in the in-process MinHash-LSH index.
+
+Builds the index from synthetic prompts (no database needed), then times
+lookups for exact repeats, lightly edited repeats and unseen prompts.
+
+    python benchmarks/bench_prompt_index.py --prompts 100000
+"""
+import argparse
+import random
+import time
+
+from _django import setup_django, timed
+
+setup_django()
+
+from mainapp.similarity import PromptIndex  # noqa: E402
+
+ADJECTIVES = """lonely brave tiny ancient curious clumsy forgotten silver hungry sleepy
+    mischievous gentle furious invisible wooden glowing retired young cursed shy""".split()
+SUBJECTS = """dragon knight robot astronaut wizard fox princess pirate detective whale ghost
+    baker owl gardener mermaid samurai clockmaker giant beetle librarian dog violinist
+    witch cat inventor sailor tortoise alchemist mouse queen""".split()
+ACTIONS = """discovers guards escapes builds loses finds paints chases befriends repairs
+    steals hides delivers follows awakens sells forges tames""".split()
+OBJECTS = """map crown lantern clock seed sword letter mirror key song egg compass feather
+    book door umbrella violin potion star telescope""".split()
+PLACES = """castle forest moon ocean desert library city garden volcano cave train island
+    lighthouse market swamp cathedral glacier circus village observatory canyon""".split()
+EXTRAS = ["at midnight", "during a storm", "after the war", "on a rainy day", "in winter",
+          "before sunrise", "under a red sky", "while the town sleeps", ""]
+
+
+def make_prompt(rng: random.Random) -> str:
+    return (
+        f"A {rng.choice(ADJECTIVES)} {rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} "
+        f"a {rng.choice(ADJECTIVES)} {rng.choice(OBJECTS)} in the {rng.choice(PLACES)} {rng.choice(EXTRAS)}"
+    ).strip()
+
+
+def perturb(prompt: str, rng: random.Random) -> str:
+    """Case, punctuation and small wording changes a user would make"""
+    words = prompt.split()
+    words.insert(rng.randrange(1, len(words)), rng.choice(["really", "very", "little", "strange"]))
+    text = " ".join(words)
+    return text.upper() + "!" if rng.random() < 0.3 else text + "."
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    prompts = [make_prompt(rng) for _ in range(args.prompts)]
+
+    index = PromptIndex()
+    start = time.perf_counter()
+    for story_id, prompt in enumerate(prompts, 1):
+        index.add(story_id, prompt)
+    build_s = time.perf_counter() - start
+    print(f"indexed {args.prompts:,} prompts ({len(index):,} distinct) in {build_s:.2f}s "
+          f"({build_s / args.prompts * 1e6:.1f} us/insert)")
+
+    exact = [rng.choice(prompts) for _ in range(args.queries)]
+    edited = [perturb(rng.choice(prompts), rng) for _ in range(args.queries)]
+    unseen = [f"{rng.choice(SUBJECTS)} made of {rng.choice(OBJECTS)}s sings to a {rng.choice(PLACES)}"
+              for _ in range(args.queries)]
+
+    print(f"\n{'query':<10} {'median us':>10} {'p95 us':>10} {'>= 0.5':>8}")
+    for name, queries in (("exact", exact), ("edited", edited), ("unseen", unseen)):
+        results = []
+        pending = iter(queries)
+        median_ms, p95_ms = timed(lambda: results.append(index.find(next(pending))), args.queries)
+        matched = sum(1 for match in results if match and match[1] >= 0.5) / len(results)
+        print(f"{name:<10} {median_ms * 1000:>10.1f} {p95_ms * 1000:>10.1f} {matched:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark the memory held per cached generation result.
+
+Compares the context dict a result page is rendered from, with the scene
+inlined as a base64 data URI (live, and pickled as LocMemCache stores it),
+against CachedResult records with and without the scene's JPEG bytes, and
+reports how many of each fit in STORY_RESULT_CACHE_BYTES.
+
+Story text is English prose sampled from standard-library docstrings
+(about a medium-tier story); scenes are composed from procedural images,
+so no network is involved.
+
+    python benchmarks/bench_result_cache.py --entries 200
+"""
+import argparse
+import gc
+import pickle
+import pydoc
+import random
+import time
+import tracemalloc
+
+from _django import setup_django, timed
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from mainapp.compositing import EncodedImage, ImageMerger  # noqa: E402
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+from mainapp.results import CachedResult, ResultCache, zstandard  # noqa: E402
+
+MODULES = ["argparse", "asyncio", "collections", "csv", "email", "json", "logging", "pathlib",
+           "random", "re", "socket", "sqlite3", "subprocess", "threading", "unittest", "urllib.request"]
+
+
+def prose_paragraphs():
+    paragraphs = []
+    for name in MODULES:
+        module = pydoc.locate(name)
+        for obj in [module, *vars(module).values()]:
+            doc = getattr(obj, "__doc__", None)
+            if isinstance(doc, str):
+                paragraphs += [" ".join(p.split()) for p in doc.split("\n\n") if len(p) > 200]
+    return paragraphs
+
+
+def make_context(rng, paragraphs, story_id, scene):
+    story = ""
+    while len(story) < 5000:
+        story += rng.choice(paragraphs) + "\n\n"
+    return {
+        "prompt": f"A curious fox {story_id} finds a lantern in the forest",
+        "story": story,
+        "character": rng.choice(paragraphs)[:300],
+        "background": rng.choice(paragraphs)[:300],
+        "character_image_url": f"https://image.pollinations.ai/prompt/character-{story_id}?width=512&height=512",
+        "background_image_url": f"https://image.pollinations.ai/prompt/background-{story_id}?width=512&height=512",
+        "combined_image_url": ImageMerger.to_data_uri(scene.data),
+        "permalink": f"/story/{story_id}/",
+    }
+
+
+def measure(build, count):
+    """Bytes traced per object built by `build(i)`"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--scenes", type=int, default=10, help="distinct composed scenes to cycle through")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    paragraphs = prose_paragraphs()
+    scenes = [
+        ImageMerger.compose_scene(
+            ProceduralSource.render(f"character {i}", 512, 512),
+            ProceduralSource.render(f"background {i}", 512, 512),
+        )
+        for i in range(args.scenes)
+    ]
+    contexts = [make_context(rng, paragraphs, i, scenes[i % len(scenes)]) for i in range(args.entries)]
+    def live_dict(i):
+        # Fresh string objects, as a request would hold them
+        return {key: "".join(list(value)) for key, value in contexts[i].items()}
+
+    def scene_copy(i):
+        # A private copy per entry, as each generation has its own scene
+        scene = scenes[i % len(scenes)]
+        return EncodedImage(bytes(bytearray(scene.data)), etag=scene.etag)
+
+    # Records point at the saved scene instead of inlining it
+    stored = [dict(context, combined_image_url=f"/media/combined/scene_{i}.jpg") for i, context in enumerate(contexts)]
+
+    rows = [
+        ("context dict + data URI", measure(live_dict, args.entries)),
+        ("  pickled (LocMemCache)", measure(lambda i: pickle.dumps(contexts[i], pickle.HIGHEST_PROTOCOL), args.entries)),
+        ("CachedResult + JPEG bytes", measure(lambda i: CachedResult.from_context(i, stored[i], scene_copy(i)), args.entries)),
+        ("CachedResult, image on disk", measure(lambda i: CachedResult.from_context(i, stored[i]), args.entries)),
+    ]
+
+    budget = settings.STORY_RESULT_CACHE_BYTES
+    print(f"entries: {args.entries}, story ~{len(contexts[0]['story'])} chars, "
+          f"scene JPEG ~{sum(map(len, scenes)) // len(scenes) // 1024} KB, "
+          f"compression: {'zstd' if zstandard else 'zlib'}")
+    baseline = rows[0][1]
+    for label, size in rows:
+        print(f"{label:<28} {size / 1024:8.1f} KB/entry  {budget // size:7.0f} per {budget // 2**20} MB  "
+              f"{baseline / size:5.1f}x")
+
+    record = CachedResult.from_context(0, stored[0], scenes[0])
+    text_size = sum(len(value.encode()) for value in stored[0].values())
+    print(f"text fields: {text_size} bytes -> {len(record.text)} compressed")
+    median, p95 = timed(record.context, repeat=2000)
+    print(f"CachedResult.context():      median {median * 1000:.0f} us, p95 {p95 * 1000:.0f} us")
+
+    # The byte bounds hold regardless of entry size; old entries keep their text
+    cache = ResultCache(budget, 3600, settings.STORY_RESULT_CACHE_IMAGE_BYTES)
+    start = time.perf_counter()
+    for i in range(args.entries * 20):
+        cache.set(CachedResult.from_context(i, stored[i % args.entries], scene_copy(i)))
+    elapsed = time.perf_counter() - start
+    metrics = cache.metrics()
+    print(f"ResultCache after {args.entries * 20} sets: {metrics['entries']} entries "
+          f"({metrics['images']} with images), {cache.nbytes / 2**20:.1f} MB of {budget / 2**20:.0f} MB, "
+          f"{elapsed / (args.entries * 20) * 1e6:.0f} us per set")
+
+
+if __name__ == "__main__":
+    main()
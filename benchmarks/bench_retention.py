@@ -0,0 +1,96 @@
+"""
+Benchmark the retention job's effect on concurrent reads.
+
+Seeds --rows expired stories into a throwaway database (scenes cycling
+through --scenes small files in a temporary media root), then runs the age
+policy in a background thread while the main thread keeps reading story
+rows the way the story pages do. Compares one unbatched delete with
+RETENTION_BATCH_SIZE batches separated by RETENTION_BATCH_PAUSE: the
+batched job takes longer overall but the readers' worst case stays low.
+
+    python benchmarks/bench_retention.py --rows 50000
+"""
+import argparse
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+from _django import benchmark_database, setup_django
+
+setup_django()
+
+from django.core.files.base import ContentFile  # noqa: E402
+from django.core.files.storage import default_storage  # noqa: E402
+from django.db import close_old_connections  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from mainapp.models import LIST_FIELDS, StoryGeneration  # noqa: E402
+from mainapp.retention import RetentionReport, expire_old_stories  # noqa: E402
+
+
+def seed(rows, scenes, batch=5000):
+    names = [default_storage.save(f"combined/bench_{i}.jpg", ContentFile(b"\xff\xd8" + bytes(2000) + b"\xff\xd9"))
+             for i in range(scenes)]
+    for start in range(0, rows, batch):
+        StoryGeneration.objects.bulk_create(
+            StoryGeneration(user_prompt=f"A fox finds lantern number {i}", story="Once upon a time",
+                            combined_image=names[i % scenes], storyboard=[])
+            for i in range(start, min(start + batch, rows))
+        )
+    StoryGeneration.objects.update(created_at=timezone.now() - timedelta(days=60))
+    # Fresh rows the readers keep asking for
+    StoryGeneration.objects.bulk_create(
+        StoryGeneration(user_prompt=f"A recent story {i}", story="Once upon a time", storyboard=[]) for i in range(500)
+    )
+    return list(StoryGeneration.objects.filter(user_prompt__startswith="A recent").values_list("id", flat=True))
+
+
+def run(rows, scenes, batch_size, pause):
+    with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), benchmark_database():
+        recent = seed(rows, scenes)
+        report = RetentionReport()
+        done = threading.Event()
+        job_time = []
+
+        def job():
+            start = time.perf_counter()
+            with override_settings(RETENTION_MAX_AGE_DAYS=30, RETENTION_KEEP_ACCESS_COUNT=0,
+                                   RETENTION_BATCH_SIZE=batch_size, RETENTION_BATCH_PAUSE=pause):
+                expire_old_stories(report)
+            job_time.append(time.perf_counter() - start)
+            close_old_connections()
+            done.set()
+
+        samples = []
+        worker = threading.Thread(target=job)
+        worker.start()
+        while not done.is_set():
+            start = time.perf_counter()
+            StoryGeneration.objects.only(*LIST_FIELDS).get(pk=random.choice(recent))
+            samples.append((time.perf_counter() - start) * 1000)
+        worker.join()
+        samples.sort()
+        return report, job_time[0], samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--scenes", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05)
+    args = parser.parse_args()
+
+    for label, batch_size, pause in (("unbatched", args.rows, 0.0), ("batched", args.batch_size, args.pause)):
+        report, seconds, samples = run(args.rows, args.scenes, batch_size, pause)
+        print(f"{label:<10} deleted {report['stories_deleted']} stories and {report['files_deleted']} files "
+              f"in {seconds:.1f} s; reads during the job: {len(samples)}, "
+              f"median {samples[len(samples) // 2]:.2f} ms, p99 {samples[int(len(samples) * 0.99)]:.2f} ms, "
+              f"max {samples[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark peak memory of scene compositing against output resolution.
+
+Each resolution is composed in a fresh child process, once full-frame and
+once in strips (SCENE_TILE_PIXELS), and the child reports how far its peak
+RSS rose above what it used just before composing, along with the time taken.
+Full-frame memory grows with several RGBA copies of the output; tiled memory
+should grow only by the output frame and its encoded JPEG.
+
+    python benchmarks/bench_scene_memory.py --sizes 800x600,1920x1080,3840x2160,7680x4320
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from _django import setup_django
+
+setup_django()
+
+from django.test import override_settings  # noqa: E402
+
+from mainapp.compositing import ImageMerger  # noqa: E402
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(width, height, tiled):
+    character = ProceduralSource.render("a brave fox in a red cloak", 512, 512)
+    background = ProceduralSource.render("a misty harbour town at dusk", 1024, 768)
+    tile_pixels = 1024 * 1024 if tiled else width * height
+    with override_settings(SCENE_TILE_PIXELS=tile_pixels):
+        before = peak_rss_mb()
+        start = time.perf_counter()
+        scene = ImageMerger.compose_scene(character, background, size=(width, height))
+        elapsed = time.perf_counter() - start
+    print(json.dumps({"rss": peak_rss_mb() - before, "ms": elapsed * 1000, "bytes": len(scene)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="800x600,1920x1080,3840x2160,7680x4320")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        width, height, mode = args.child.split(",")
+        child(int(width), int(height), mode == "tiled")
+        return
+
+    print(f"{'size':>10} {'full-frame':>20} {'tiled':>20} {'JPEG':>8}")
+    for size in args.sizes.split(","):
+        width, height = map(int, size.split("x"))
+        runs = {}
+        for mode in ("full", "tiled"):
+            output = subprocess.run([sys.executable, __file__, "--child", f"{width},{height},{mode}"],
+                                    capture_output=True, text=True, check=True).stdout
+            runs[mode] = json.loads(output.splitlines()[-1])
+        print(f"{size:>10} " + " ".join(f"{runs[m]['rss']:7.0f} MB {runs[m]['ms']:6.0f} ms" for m in ("full", "tiled"))
+              + f" {runs['tiled']['bytes'] / 1024 / 1024:6.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark the story history read paths over a large seeded table.
+
+Compares keyset (cursor) pagination with OFFSET pagination at increasing
+depths, and the deferred-field listing/detail querysets against full rows.
+
+    python benchmarks/bench_story_history.py --rows 1000000
+"""
+import argparse
+import random
+from datetime import timedelta
+
+from _django import benchmark_database, setup_django, timed
+
+setup_django()
+
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from mainapp.models import StoryGeneration  # noqa: E402
+from mainapp.pagination import encode_cursor, keyset_page  # noqa: E402
+
+WORDS = "dragon castle forest knight ocean star robot garden city moon storm river crystal".split()
+
+
+def seed(rows: int, text_bytes: int, batch_size: int = 10_000):
+    rng = random.Random(42)
+    start = timezone.now() - timedelta(seconds=rows)
+    filler = ("lorem ipsum " * (text_bytes // 12 + 1))[:text_bytes]
+
+    # auto_now_add would stamp every row with "now"; spread them out (with some
+    # duplicate timestamps) so the (created_at, id) ordering looks like real traffic
+    created_at_field = StoryGeneration._meta.get_field("created_at")
+    created_at_field.auto_now_add = False
+    try:
+        created = 0
+        while created < rows:
+            batch = []
+            for i in range(created, min(created + batch_size, rows)):
+                batch.append(StoryGeneration(
+                    user_prompt=" ".join(rng.choices(WORDS, k=6)),
+                    story=filler,
+                    character_description=filler,
+                    background_description=filler,
+                    background_image_url=f"https://image.example/{i}.jpg",
+                    created_at=start + timedelta(seconds=i // 2),
+                ))
+            StoryGeneration.objects.bulk_create(batch)
+            created += len(batch)
+    finally:
+        created_at_field.auto_now_add = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--text-bytes", type=int, default=400, help="size of each large text field")
+    parser.add_argument("--page-size", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with benchmark_database() as connection:
+        print(f"Seeding {args.rows:,} rows on {connection.vendor}...")
+        seed(args.rows, args.text_bytes)
+
+        ordered = StoryGeneration.objects.order_by("-created_at", "-id")
+        print(f"\n{'depth':>10} {'OFFSET ms':>12} {'keyset ms':>12}")
+        for depth in (0, args.rows // 100, args.rows // 10, args.rows // 2, args.rows - args.page_size):
+            def offset_page():
+                list(StoryGeneration.objects.for_listing().order_by("-created_at", "-id")[depth:depth + args.page_size])
+
+            anchor = ordered.values("created_at", "id")[depth - 1] if depth else None
+            cursor = encode_cursor(anchor["created_at"], anchor["id"]) if anchor else None
+
+            def cursor_page():
+                keyset_page(StoryGeneration.objects.for_listing(), cursor, args.page_size)
+
+            offset_ms, _ = timed(offset_page, args.repeat)
+            keyset_ms, _ = timed(cursor_page, args.repeat)
+            print(f"{depth:>10,} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
+
+        sample_ids = random.Random(7).sample(range(1, args.rows + 1), min(args.repeat, args.rows))
+        ids = iter(sample_ids * 2)
+        full_ms, _ = timed(lambda: list(StoryGeneration.objects.order_by("-created_at", "-id")[:args.page_size]), args.repeat)
+        listing_ms, _ = timed(lambda: list(StoryGeneration.objects.for_listing().order_by("-created_at", "-id")[:args.page_size]), args.repeat)
+        detail_ms, _ = timed(lambda: StoryGeneration.objects.for_detail().get(pk=next(ids)), args.repeat)
+        print(f"\nfirst page, all fields:      {full_ms:.2f} ms")
+        print(f"first page, for_listing():   {listing_ms:.2f} ms")
+        print(f"permalink, for_detail():     {detail_ms:.2f} ms")
+
+        # Plan of the deepest keyset page: should seek into story_created_id_idx
+        with CaptureQueriesContext(connection) as captured:
+            keyset_page(StoryGeneration.objects.for_listing(), cursor, args.page_size)
+        explain = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        with connection.cursor() as db_cursor:
+            db_cursor.execute(explain + captured[-1]["sql"])
+            print("\nkeyset plan:", *[row[-1] for row in db_cursor.fetchall()], sep="\n  ")
+
+if __name__ == "__main__":
+    main()
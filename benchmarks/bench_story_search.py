@@ -0,0 +1,104 @@
+"""
+Benchmark story search over a large synthetic corpus.
+
+Seeds a throwaway test database (the search index is maintained by the same
+triggers/generated column as production), then times ranked, highlighted
+queries of varying selectivity.
+
+    python benchmarks/bench_story_search.py --rows 200000
+"""
+import argparse
+import random
+import sys
+import time
+
+from _django import benchmark_database, setup_django, timed
+
+setup_django()
+
+from mainapp.models import StoryGeneration  # noqa: E402
+from mainapp.search import search_stories  # noqa: E402
+
+# Zipf-ish vocabulary: a few very common words and a long tail of rare ones
+COMMON = "the a and of to in was her his it with that she he they on for at".split()
+THEMES = """dragon castle forest knight ocean star robot garden city moon storm river
+    crystal lantern wizard princess mountain desert ship island shadow fire winter""".split()
+RARE = [f"{prefix}{middle}{suffix}"
+        for prefix in ("zor", "mel", "quin", "tav", "bryl", "osk", "fen", "dra")
+        for middle in ("a", "e", "i", "o", "u", "ae", "ou", "y", "ia", "eo")
+        for suffix in ("th", "l", "ra", "mb", "x", "nder", "wyn", "sk", "spar", "lin",
+                       "dor", "mir", "vek", "tor", "nis", "gal", "rith", "quel", "bas", "zen",
+                       "fyr", "hal", "jun", "kor", "pel")]
+RARE_WORDS = frozenset(RARE)
+
+
+def story_text(rng: random.Random, words: int) -> str:
+    out = []
+    for _ in range(words):
+        roll = rng.random()
+        if roll < 0.55:
+            out.append(rng.choice(COMMON))
+        elif roll < 0.97:
+            out.append(rng.choice(THEMES))
+        else:
+            out.append(rng.choice(RARE))
+    return " ".join(out).capitalize() + "."
+
+
+def seed(rows: int, words: int, batch_size: int = 5_000):
+    rng = random.Random(42)
+    created = 0
+    while created < rows:
+        batch = [
+            StoryGeneration(
+                user_prompt=story_text(rng, 10),
+                story=story_text(rng, words),
+                character_description=story_text(rng, 30),
+                background_description=story_text(rng, 30),
+            )
+            for _ in range(min(batch_size, rows - created))
+        ]
+        StoryGeneration.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--words", type=int, default=250, help="words per story")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with benchmark_database() as connection:
+        print(f"Seeding {args.rows:,} stories of ~{args.words} words on {connection.vendor}...")
+        start = time.perf_counter()
+        seed(args.rows, args.words)
+        print(f"seeded and indexed in {time.perf_counter() - start:.1f}s")
+
+        # Rare words from a seeded story, so every query has at least one match at any --rows
+        sample = StoryGeneration.objects.order_by("id").values_list("story", flat=True).first()
+        rare = sorted({word for word in sample.rstrip(".").lower().split() if word in RARE_WORDS})
+        rare += rare[:1] * (2 - len(rare))
+        queries = {
+            "rare word": rare[0],
+            "two rare words": f"{rare[0]} {rare[-1]}",
+            "rare + theme": f"{rare[0]} {next(word for word in THEMES if word in sample.lower().split())}",
+            "common theme": "dragon",
+            "two themes": "castle storm",
+        }
+        print(f"\n{'query':<16} {'hits':>6} {'median ms':>10} {'p95 ms':>10}")
+        empty = []
+        for name, query in queries.items():
+            hits = len(search_stories(query, args.limit))
+            median_ms, p95_ms = timed(lambda: search_stories(query, args.limit), args.repeat)
+            print(f"{name:<16} {hits:>6} {median_ms:>10.2f} {p95_ms:>10.2f}")
+            if not hits:
+                empty.append(name)
+        if empty:
+            # Timings of an empty index mean nothing
+            sys.exit(f"no hits for {', '.join(empty)}: the search index is not being maintained")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark storyboard latency as the number of panels grows.
+
+Images come from ProceduralSource with --fetch-latency seconds of sleep
+added per fetch to stand in for the remote image API. Each panel count is
+rendered with single-worker pools (every fetch and panel in turn, the way
+the single-scene pipeline works) and with the configured
+IMAGE_FETCH_WORKERS / STORYBOARD_COMPOSE_WORKERS pools. Beats cycle
+through --settings distinct backgrounds, so later panels reuse fetched images.
+
+    python benchmarks/bench_storyboard.py --fetch-latency 0.4
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _django import setup_django
+
+setup_django()
+
+from django.conf import settings  # noqa: E402
+
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+from mainapp.storyboard import Panel, render_storyboard  # noqa: E402
+
+
+class SlowSource(ProceduralSource):
+    """Procedural images behind a fixed network-like delay"""
+
+    def __init__(self, latency: float):
+        super().__init__("slow", {})
+        self.latency = latency
+
+    def fetch(self, description):
+        time.sleep(self.latency)
+        return super().fetch(description)
+
+
+def run(source, count, distinct, fetch_workers, compose_workers, repeat):
+    beats = [Panel(f"Beat {i + 1}", f"setting {i % distinct}") for i in range(count)]
+    best = None
+    with ThreadPoolExecutor(fetch_workers) as fetcher, ThreadPoolExecutor(compose_workers) as composer:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            board = render_storyboard(source, "a brave fox in a red cloak", beats, fetcher, composer)
+            elapsed = time.perf_counter() - start
+            assert board.sheet, "storyboard failed"
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panels", default="1,2,3,4,6,8")
+    parser.add_argument("--settings", type=int, default=4, help="distinct backgrounds per storyboard")
+    parser.add_argument("--fetch-latency", type=float, default=0.4, help="seconds added to every image fetch")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    source = SlowSource(args.fetch_latency)
+    fetch_workers, compose_workers = settings.IMAGE_FETCH_WORKERS, settings.STORYBOARD_COMPOSE_WORKERS
+    print(f"fetch latency {args.fetch_latency * 1000:.0f} ms, panel "
+          f"{settings.STORYBOARD_PANEL_WIDTH}x{settings.STORYBOARD_PANEL_HEIGHT}, "
+          f"pools: {fetch_workers} fetch / {compose_workers} compose, best of {args.repeat}")
+    print(f"{'panels':>6} {'serial':>10} {'parallel':>10} {'vs 1 panel':>11}")
+    baseline = None
+    for count in map(int, args.panels.split(",")):
+        serial = run(source, count, args.settings, 1, 1, args.repeat)
+        parallel = run(source, count, args.settings, fetch_workers, compose_workers, args.repeat)
+        baseline = baseline or parallel
+        print(f"{count:>6} {serial * 1000:>8.0f}ms {parallel * 1000:>8.0f}ms {parallel / baseline:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
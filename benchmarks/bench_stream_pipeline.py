@@ -0,0 +1,72 @@
+"""
+Benchmark end-to-end generation latency with and without the streamed pipeline.
+
+The LLM is the offline stub with --llm-latency seconds spread over its
+streamed chunks; images come from ProceduralSource behind --fetch-latency
+seconds of sleep per fetch, standing in for the remote image API. Each run
+goes through run_pipeline against a throwaway database, once with
+LLM_STREAM_PIPELINE off (images start after the whole response has been
+parsed) and once with it on (images start as their descriptions stream in).
+
+    python benchmarks/bench_stream_pipeline.py --llm-latency 2 --fetch-latency 1.5
+"""
+import argparse
+import statistics
+import time
+
+from _django import benchmark_database, setup_django
+
+setup_django()
+
+from django.test import override_settings  # noqa: E402
+
+from mainapp.image_sources import ProceduralSource  # noqa: E402
+from mainapp.llm import LocalStubProvider, ProviderRouter  # noqa: E402
+from mainapp.pipeline import run_pipeline  # noqa: E402
+from mainapp.prompts import get_tier  # noqa: E402
+
+
+class SlowSource(ProceduralSource):
+    """Procedural images behind a fixed network-like delay"""
+
+    def __init__(self, latency: float):
+        super().__init__("procedural", {})
+        self.latency = latency
+
+    def fetch(self, description):
+        time.sleep(self.latency)
+        return super().fetch(description)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="seconds for the whole LLM response")
+    parser.add_argument("--fetch-latency", type=float, default=1.5, help="seconds added to every image fetch")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    router = ProviderRouter([LocalStubProvider("local", {"LATENCY": args.llm_latency})])
+    source = SlowSource(args.fetch_latency)
+    tier = get_tier("medium")
+    print(f"LLM {args.llm_latency * 1000:.0f} ms, image fetch {args.fetch_latency * 1000:.0f} ms, "
+          f"{args.runs} runs each")
+    print(f"  sum:  {(args.llm_latency + args.fetch_latency) * 1000:6.0f} ms   "
+          f"max: {max(args.llm_latency, args.fetch_latency) * 1000:6.0f} ms")
+
+    with benchmark_database():
+        for label, streamed in (("complete, then fetch", False), ("streamed pipeline", True)):
+            totals, fetch_waits = [], []
+            with override_settings(LLM_STREAM_PIPELINE=streamed, IMAGE_DEDUPE=False):
+                for i in range(args.runs):
+                    stages = {}
+                    start = time.perf_counter()
+                    result = run_pipeline(f"A fox finds lantern number {i}", tier, source, router=router, stages=stages)
+                    totals.append((time.perf_counter() - start) * 1000)
+                    fetch_waits.append(stages["image_fetch_ms"])
+                    assert result.combined_image, "no scene composed"
+            print(f"{label:<22} median {statistics.median(totals):6.0f} ms "
+                  f"(waiting for images after the LLM: {statistics.median(fetch_waits):5.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
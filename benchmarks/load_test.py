@@ -0,0 +1,140 @@
+"""
+Load-test the generate endpoint under two gunicorn setups.
+
+  before  the old startup.sh command: one sync worker, --timeout 600
+  after   gunicorn -c gunicorn.conf.py (sized by story_generator/server.py)
+
+The pipeline runs offline: the local LLM stub sleeps --llm-latency seconds
+(standing in for the upstream API) and images are rendered and composited
+on the CPU by the procedural source, so the I/O:CPU mix matches production
+without touching the network. Each client keeps POSTing fresh generations; requests turned away by
+admission control (429/503) are counted separately as "shed".
+
+    python benchmarks/load_test.py --clients 32 --duration 20 --llm-latency 2
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from _django import BASE_DIR
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"server exited with {process.returncode}")
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    sys.exit("server did not start")
+
+
+def client(base_url: str, token: str, client_id: int, stop_at: float, results: list):
+    session = requests.Session()
+    n = 0
+    while time.monotonic() < stop_at:
+        n += 1
+        data = {"prompt": f"client {client_id} story {n}: a lantern that remembers", "fresh": "1"}
+        start = time.monotonic()
+        try:
+            # Passed explicitly: with DEBUG off the cookie is Secure and would not be sent over http
+            response = session.post(
+                base_url + "/generate/", data=data, timeout=120, cookies={"csrftoken": token},
+                headers={"X-CSRFToken": token, "Referer": base_url + "/"},
+            )
+            if response.status_code == 200 and "Unexpected Error" not in response.text:
+                outcome = "ok"
+            elif response.status_code in (429, 503):
+                outcome = "shed"
+                # Well-behaved clients back off as told instead of hammering the server
+                retry_after = float(response.headers.get("Retry-After", 1))
+            else:
+                outcome = "error"
+        except requests.RequestException:
+            outcome = "error"
+        results.append((time.monotonic() - start, outcome))
+        if outcome == "shed":
+            time.sleep(min(retry_after, max(0.0, stop_at - time.monotonic())))
+
+
+def run(name, command, env, options):
+    base_url = f"http://127.0.0.1:{options.port}"
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(base_url + "/", process)
+        # One CSRF token for every client, fetched before the server is busy
+        token = requests.get(base_url + "/", timeout=10).cookies.get("csrftoken", "")
+        results = []
+        stop_at = time.monotonic() + options.duration
+        threads = [
+            threading.Thread(target=client, args=(base_url, token, i, stop_at, results))
+            for i in range(options.clients)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = sorted(latency for latency, outcome in results if outcome == "ok")
+    shed = sorted(latency for latency, outcome in results if outcome == "shed")
+    errors = sum(1 for _, outcome in results if outcome == "error")
+    if not latencies:
+        print(f"{name:>6}: no successful requests ({errors} errors)")
+        return
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    line = (
+        f"{name:>6}: {len(latencies) / elapsed:6.2f} req/s, "
+        f"p50 {statistics.median(latencies):6.2f} s, p95 {p95:6.2f} s, "
+        f"{len(latencies)} ok, {errors} errors"
+    )
+    if shed:
+        line += f", {len(shed)} shed (429/503, p50 {statistics.median(shed) * 1000:.0f} ms)"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per setup")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="simulated upstream seconds per story")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--setup", choices=["both", "before", "after"], default="both")
+    options = parser.parse_args()
+
+    env = dict(
+        os.environ,
+        LLM_ROUTING="local",
+        LLM_STUB_LATENCY=str(options.llm_latency),
+        IMAGE_SOURCE="procedural",
+        LOG_LEVEL="WARNING",
+        # Every client shares one address; measure capacity, not the per-client limit
+        GENERATE_RATE_LIMIT_PER_MINUTE="0",
+    )
+    env.setdefault("DJANGO_SETTINGS_MODULE", "story_generator.settings")
+    bind = f"127.0.0.1:{options.port}"
+    print(f"{options.clients} clients, {options.duration:.0f} s each, simulated LLM latency {options.llm_latency} s")
+    # -c /dev/null: gunicorn would otherwise pick up ./gunicorn.conf.py on its own
+    old_command = ["gunicorn", "-c", "/dev/null", "--bind", bind, "--timeout", "600", "story_generator.wsgi:application"]
+    if options.setup in ("both", "before"):
+        run("before", old_command, env, options)
+    if options.setup in ("both", "after"):
+        run("after", ["gunicorn", "-c", "gunicorn.conf.py", "--bind", bind], env, options)
+
+
+if __name__ == "__main__":
+    main()
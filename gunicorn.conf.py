@@ -0,0 +1,28 @@
+"""
+Gunicorn configuration: gunicorn -c gunicorn.conf.py
+
+Worker class, worker/thread counts, timeouts and recycling are derived from
+settings by story_generator/server.py; override them with the SERVER_*
+environment variables rather than editing this file.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'story_generator.settings')
+
+from story_generator.server import gunicorn_options  # noqa: E402
+
+_options = gunicorn_options()
+
+wsgi_app = _options['wsgi_app']
+bind = _options['bind']
+worker_class = _options['worker_class']
+workers = _options['workers']
+threads = _options.get('threads', 1)
+worker_connections = _options.get('worker_connections', 1000)
+timeout = _options['timeout']
+graceful_timeout = _options['graceful_timeout']
+keepalive = _options['keepalive']
+max_requests = _options['max_requests']
+max_requests_jitter = _options['max_requests_jitter']
+preload_app = _options['preload_app']
+worker_tmp_dir = _options.get('worker_tmp_dir')
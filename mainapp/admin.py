@@ -1,3 +1,48 @@
+from django.conf import settings
 from django.contrib import admin
+from django.db import router
+from django.http import StreamingHttpResponse
 
-# Register your models here.
+from .export import export_zip
+from .models import LIST_FIELDS, StoryGeneration
+
+
+@admin.register(StoryGeneration)
+class StoryGenerationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'short_prompt', 'created_at', 'access_count', 'pool_theme', 'has_scene')
+    list_filter = ('created_at',)
+    search_fields = ('user_prompt',)
+    date_hierarchy = 'created_at'
+    ordering = ('-created_at', '-id')
+    # Counting every row on each changelist page is slow on a large table
+    show_full_result_count = False
+    readonly_fields = (
+        'created_at', 'access_count', 'last_accessed_at', 'combined_image_etag', 'combined_image_size',
+        'character_image_hash', 'background_image_hash', 'combined_image_hash',
+    )
+    exclude = ('character_image_placeholder', 'background_image_placeholder', 'combined_image_placeholder')
+    actions = ('export_selected',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # The changelist only needs the card fields; the change form loads the full row
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            queryset = queryset.only(*LIST_FIELDS, 'access_count', 'pool_theme')
+        return queryset
+
+    @admin.display(description='Prompt')
+    def short_prompt(self, obj):
+        return obj.user_prompt[:80]
+
+    @admin.display(boolean=True, description='Scene')
+    def has_scene(self, obj):
+        return bool(obj.combined_image)
+
+    @admin.action(description='Export selected stories (ZIP with images)')
+    def export_selected(self, request, queryset):
+        # Only the ids are carried over: the export reads the rows in chunks itself
+        stories = StoryGeneration.objects.using(router.db_for_read(StoryGeneration)).filter(
+            pk__in=queryset.values('pk'))
+        response = StreamingHttpResponse(export_zip(stories, settings.EXPORT_CHUNK_SIZE), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="stories.zip"'
+        return response
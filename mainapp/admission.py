@@ -0,0 +1,264 @@
+"""
+Admission control for expensive endpoints.
+
+Two gates run before a generation starts:
+
+1. A per-client token bucket kept in the cache backend (shared across
+   workers when the cache is Redis). An empty bucket answers 429 at once.
+2. A per-process concurrency limit with a bounded wait queue. When all
+   slots are busy a request waits for one up to GENERATE_QUEUE_TIMEOUT
+   seconds; when the queue itself is full it is turned away immediately.
+   Both overload cases answer 503. The limit guards each worker's own
+   request threads, so an instance admits up to
+   GENERATE_MAX_CONCURRENCY_PER_WORKER times SERVER_WORKERS generations.
+
+Rejections carry Retry-After, so under overload clients get a fast,
+explicit answer while admitted requests keep a bounded latency, instead of
+every request slowing down until they all time out.
+"""
+import ipaddress
+import logging
+import math
+import threading
+import time
+from functools import wraps
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimiter:
+    """Counting semaphore with a bounded FIFO-ish wait queue and counters for metrics"""
+
+    def __init__(self, limit: int, max_queue: int, queue_timeout: float):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        # Exponentially weighted mean seconds per admitted request, for Retry-After
+        self.mean_service_time = 0.0
+
+    def acquire(self) -> Optional[str]:
+        """Take a slot; returns None when admitted, else the rejection reason"""
+        with self._cond:
+            if self.in_flight < self.limit and not self.queued:
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                return 'queue_full'
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        return 'queue_timeout'
+                    self._cond.wait(remaining)
+            finally:
+                self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+
+    def release(self, service_time: float) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self.mean_service_time = (
+                service_time if not self.mean_service_time
+                else 0.8 * self.mean_service_time + 0.2 * service_time
+            )
+            self._cond.notify()
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        backlog = self.in_flight + self.queued
+        return max(1, math.ceil(self.mean_service_time * backlog / max(self.limit, 1)))
+
+    def metrics(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_timeout': self.rejected_timeout,
+                'mean_service_seconds': round(self.mean_service_time, 3),
+            }
+
+
+class TokenBucket:
+    """
+    Token bucket per key in the cache: `burst` tokens, refilled at `rate` per
+    second. Read-modify-write is not atomic across processes, so concurrent
+    requests from one client can occasionally slip an extra request through;
+    that is acceptable for abuse control and avoids a lock per request.
+    """
+
+    def __init__(self, prefix: str, burst: int, rate: float):
+        self.prefix = prefix
+        self.burst = burst
+        self.rate = rate
+        self.limited = 0
+
+    def take(self, key: str) -> float:
+        """Consume a token; returns 0 when allowed, else seconds until one is available"""
+        cache_key = f"{self.prefix}:{key}"
+        now = time.time()
+        tokens, updated = cache.get(cache_key) or (float(self.burst), now)
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.limited += 1
+            return (1 - tokens) / self.rate
+        # Expire once the bucket would be full again; a missing bucket reads as full
+        cache.set(cache_key, (tokens - 1, now), timeout=math.ceil(self.burst / self.rate) + 1)
+        return 0.0
+
+
+def _parse_ip(value: str):
+    """Address from a header entry or REMOTE_ADDR, allowing a port ("1.2.3.4:80", "[::1]:80"); None if invalid"""
+    value = value.strip()
+    for candidate in (value, value.rpartition(':')[0]):
+        try:
+            return ipaddress.ip_address(candidate.strip('[]'))
+        except ValueError:
+            continue
+    return None
+
+
+def _is_trusted_proxy(address) -> bool:
+    return address is not None and any(
+        address in ipaddress.ip_network(proxy, strict=False) for proxy in settings.RATE_LIMIT_TRUSTED_PROXIES
+    )
+
+
+def client_ip(request) -> str:
+    """
+    Client address for rate limiting. RATE_LIMIT_CLIENT_IP_HEADER is only
+    read when the connection comes from one of RATE_LIMIT_TRUSTED_PROXIES:
+    its entries are walked back from the last (appended by our proxy) past
+    any other trusted proxies, and the first untrusted one is the client.
+    Earlier entries are client-supplied and spoofable.
+    """
+    remote = request.META.get('REMOTE_ADDR', '')
+    header = settings.RATE_LIMIT_CLIENT_IP_HEADER
+    forwarded = request.META.get(header, '') if header else ''
+    if not forwarded or not _is_trusted_proxy(_parse_ip(remote)):
+        return remote
+    entries = [entry.strip() for entry in forwarded.split(',') if entry.strip()]
+    for entry in reversed(entries):
+        address = _parse_ip(entry)
+        if not _is_trusted_proxy(address):
+            return str(address) if address is not None else entry
+    return remote
+
+
+_limiter: Optional[ConcurrencyLimiter] = None
+_bucket: Optional[TokenBucket] = None
+_init_lock = threading.Lock()
+
+
+def get_generate_limiter() -> ConcurrencyLimiter:
+    global _limiter
+    if _limiter is None:
+        with _init_lock:
+            if _limiter is None:
+                threads = settings.SERVER_THREADS
+                _limiter = ConcurrencyLimiter(
+                    settings.GENERATE_MAX_CONCURRENCY_PER_WORKER or max(1, threads * 3 // 4),
+                    settings.GENERATE_MAX_QUEUE_PER_WORKER or max(1, threads // 8),
+                    settings.GENERATE_QUEUE_TIMEOUT,
+                )
+    return _limiter
+
+
+def get_generate_bucket() -> Optional[TokenBucket]:
+    """Per-client bucket for generations, or None when rate limiting is disabled"""
+    global _bucket
+    if not settings.GENERATE_RATE_LIMIT_PER_MINUTE:
+        return None
+    if _bucket is None:
+        with _init_lock:
+            if _bucket is None:
+                _bucket = TokenBucket(
+                    'mainapp:generate-rate',
+                    settings.GENERATE_RATE_LIMIT_BURST,
+                    settings.GENERATE_RATE_LIMIT_PER_MINUTE / 60,
+                )
+    return _bucket
+
+
+def admission_metrics() -> Dict[str, float]:
+    metrics = get_generate_limiter().metrics()
+    bucket = get_generate_bucket()
+    metrics['rate_limited'] = bucket.limited if bucket else 0
+    return metrics
+
+
+def _rejection(request, status: int, reason: str, message: str, retry_after: float):
+    retry_after = max(1, math.ceil(retry_after))
+    logger.warning("Generation rejected: %s", reason, extra={
+        'event': 'admission_rejected', 'reason': reason, 'status_code': status, 'retry_after': retry_after,
+    })
+    response = render(request, 'mainapp/result.html', {
+        'prompt': request.POST.get('prompt', ''),
+        'story': message,
+        'character': '', 'background': '', 'character_image_url': '',
+        'background_image_url': '', 'combined_image_url': '',
+    }, status=status)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_control(view=None, *, methods=('POST',), rate_limit: bool = True):
+    """
+    Apply the rate limit and concurrency gates to a view's requests with one
+    of `methods` (POST by default). Use bare or as
+    @admission_control(methods=..., rate_limit=False) for cheap per-request
+    endpoints that still need the concurrency cap.
+    """
+    if view is None:
+        return lambda view: admission_control(view, methods=methods, rate_limit=rate_limit)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in methods:
+            return view(request, *args, **kwargs)
+
+        bucket = get_generate_bucket() if rate_limit else None
+        if bucket:
+            wait = bucket.take(client_ip(request))
+            if wait:
+                return _rejection(
+                    request, 429, 'rate_limited',
+                    'Error: Too many stories requested. Please wait a moment and try again.', wait,
+                )
+
+        limiter = get_generate_limiter()
+        reason = limiter.acquire()
+        if reason:
+            return _rejection(
+                request, 503, reason,
+                'Error: The story generator is busy right now. Please try again shortly.',
+                limiter.retry_after(),
+            )
+        started = time.monotonic()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            limiter.release(time.monotonic() - started)
+
+    return wrapper
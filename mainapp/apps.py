@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MainappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mainapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .db import instrument_connections
+        instrument_connections()
+        from .memprofile import start_profiling
+        start_profiling()
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Bump when home/result templates change so clients revalidate
+TEMPLATE_CACHE_VERSION = "6"
+
+UI_MODES = ("high", "base")
+
+
+def story_page_key(story_id, ui_mode: str) -> str:
+    """Cache key for a rendered story permalink page"""
+    return f"mainapp:story-page:{story_id}:{ui_mode}"
+
+
+def content_etag(content: bytes) -> str:
+    return hashlib.sha1(content).hexdigest()
+
+
+def home_etag(request) -> str:
+    """
+    ETag for the home page.
+    The page embeds a CSRF token, so the tag is tied to the client's CSRF cookie:
+    a cached copy is only reused while its token is still valid.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+    raw = f"{TEMPLATE_CACHE_VERSION}:{settings.UI_MODE}:{csrf_cookie}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def get_story_page(story_id, ui_mode: str):
+    """Return the cached (content, etag) pair for a story page, or None"""
+    return cache.get(story_page_key(story_id, ui_mode))
+
+
+def set_story_page(story_id, ui_mode: str, content: bytes) -> str:
+    etag = content_etag(content)
+    cache.set(story_page_key(story_id, ui_mode), (content, etag), settings.STORY_PAGE_CACHE_TIMEOUT)
+    return etag
+
+
+def invalidate_story_page(story_id) -> None:
+    """Drop every cached rendering of a story"""
+    cache.delete_many([story_page_key(story_id, mode) for mode in UI_MODES])
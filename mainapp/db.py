@@ -0,0 +1,175 @@
+"""
+Database routing and connection metrics.
+
+Worker threads keep their connection between requests (DATABASE_CONN_MAX_AGE,
+checked for liveness before reuse) or borrow one from Django's pool
+(DATABASE_POOL), so a request rarely pays for a new SSL handshake with the
+database server.
+
+When a `replica` alias is configured (DATABASE_REPLICA_URL), views wrapped
+in replica_reads send their reads to it: the gallery and search pages, which
+tolerate a little replication lag. Everything else, including reading back a
+story right after it was generated, stays on the primary, as do all writes.
+
+job_lock() keeps a background job to one process across every instance with
+a lease row in the database, which unlike the default cache is shared.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import wraps
+from typing import Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.utils import load_backend
+from django.utils import timezone
+
+REPLICA_DB_ALIAS = 'replica'
+
+_replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+def replica_reads(view):
+    """Run a read-only view against the replica when one is configured"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Writes to the primary; reads inside replica_reads views to the replica"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and REPLICA_DB_ALIAS in settings.DATABASES:
+            return REPLICA_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+
+class ConnectionMetrics:
+    """Count and duration of new database connections per alias"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._aliases: Dict[str, Dict[str, float]] = {}
+
+    def record(self, alias: str, seconds: float) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            stats = self._aliases.setdefault(alias, {'connects': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0})
+            stats['connects'] += 1
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+            stats['last_ms'] = ms
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                alias: {
+                    'connects': int(stats['connects']),
+                    'mean_ms': round(stats['total_ms'] / stats['connects'], 2),
+                    'max_ms': round(stats['max_ms'], 2),
+                    'last_ms': round(stats['last_ms'], 2),
+                }
+                for alias, stats in self._aliases.items()
+            }
+
+
+_metrics = ConnectionMetrics()
+
+
+def instrument_connections() -> None:
+    """
+    Time every new connection (or pool checkout) made by the configured
+    backends. Django has no pre-connect signal, so each backend's connect()
+    is wrapped once.
+    """
+    for options in settings.DATABASES.values():
+        wrapper_class = load_backend(options['ENGINE']).DatabaseWrapper
+        if getattr(wrapper_class.connect, 'instrumented', False):
+            continue
+        wrapper_class.connect = _timed_connect(wrapper_class.connect)
+
+
+def _timed_connect(connect):
+    @wraps(connect)
+    def wrapper(self):
+        start = time.perf_counter()
+        try:
+            return connect(self)
+        finally:
+            _metrics.record(self.alias, time.perf_counter() - start)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def database_metrics() -> dict:
+    return {
+        'aliases': sorted(settings.DATABASES),
+        'connections': _metrics.snapshot(),
+    }
+
+
+class JobLease:
+    """A held job lock; renew() it more often than its timeout during long runs"""
+
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timedelta(seconds=timeout)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def acquire(self) -> bool:
+        from .models import JobLock
+
+        now = timezone.now()
+        # Take over a lease whose holder died without releasing it; the WHERE
+        # clause makes this atomic against another process doing the same
+        if JobLock.objects.filter(name=self.name, expires_at__lte=now).update(
+                holder=self.holder, expires_at=now + self.timeout):
+            return True
+        try:
+            with transaction.atomic():
+                JobLock.objects.create(name=self.name, holder=self.holder, expires_at=now + self.timeout)
+        except IntegrityError:
+            return False
+        return True
+
+    def renew(self) -> None:
+        from .models import JobLock
+
+        JobLock.objects.filter(name=self.name, holder=self.holder).update(expires_at=timezone.now() + self.timeout)
+
+    def release(self) -> None:
+        from .models import JobLock
+
+        JobLock.objects.filter(name=self.name, holder=self.holder).delete()
+
+
+@contextmanager
+def job_lock(name: str, timeout: float) -> Iterator[Optional[JobLease]]:
+    """The lease if this process got the lock, else None; released on exit"""
+    lease = JobLease(name, timeout)
+    if not lease.acquire():
+        yield None
+        return
+    try:
+        yield lease
+    finally:
+        lease.release()
@@ -0,0 +1,212 @@
+"""
+Bulk export of saved stories as NDJSON, or as a ZIP of that NDJSON plus
+the composed scene files.
+
+Everything is produced by generators, so an export of any size streams out
+in constant memory: rows are read with QuerySet.iterator(chunk_size=...)
+(a server-side cursor on PostgreSQL) as plain values rather than model
+instances, and serialized lines are flushed in blocks of about
+EXPORT_FLUSH_BYTES. The ZIP is written by ZipStream rather than zipfile,
+which keeps a ZipInfo per entry in memory until it writes the central
+directory; ZipStream spools those records to a temporary file instead.
+
+Scenes shared between stories by the near-duplicate reuse (see
+mainapp/phash.py) are archived once: the image pass asks the database for
+the distinct file names. Character and background images are remote URLs
+and stay in the rows as such.
+"""
+import io
+import logging
+import struct
+import tempfile
+import time
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import StoryGeneration
+
+logger = logging.getLogger(__name__)
+
+# Columns written per story; hashes, validators and placeholders can be recomputed
+EXPORT_FIELDS = (
+    'id', 'created_at', 'user_prompt', 'story', 'character_description', 'background_description',
+    'character_image_url', 'background_image_url', 'combined_image', 'storyboard', 'pool_theme',
+)
+# Directory of the scene files inside the archive
+IMAGES_DIR = 'images/'
+# Bytes of output gathered before a chunk is yielded
+EXPORT_FLUSH_BYTES = 64 * 1024
+# Directory records kept in memory before the spool moves to disk
+_DIRECTORY_SPOOL_BYTES = 1024 * 1024
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+
+def export_rows(queryset, chunk_size: int) -> Iterator[dict]:
+    """Story rows as dicts, oldest first, with combined_image as its path in the ZIP"""
+    for row in queryset.order_by('id').values(*EXPORT_FIELDS).iterator(chunk_size=chunk_size):
+        if row['combined_image']:
+            row['combined_image'] = IMAGES_DIR + row['combined_image']
+        yield row
+
+
+def ndjson_chunks(rows: Iterable[dict]) -> Iterator[bytes]:
+    """One JSON object per line, in blocks of about EXPORT_FLUSH_BYTES"""
+    lines, size = [], 0
+    for row in rows:
+        line = (_encoder.encode(row) + '\n').encode('utf-8')
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_FLUSH_BYTES:
+            yield b''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield b''.join(lines)
+
+
+def export_ndjson(queryset, chunk_size: int) -> Iterator[bytes]:
+    return ndjson_chunks(export_rows(queryset, chunk_size))
+
+
+def _file_chunks(file) -> Iterator[bytes]:
+    with file:
+        while True:
+            block = file.read(EXPORT_FLUSH_BYTES)
+            if not block:
+                return
+            yield block
+
+
+def export_zip(queryset, chunk_size: int) -> Iterator[bytes]:
+    """stories.ndjson followed by every distinct scene file the rows refer to"""
+    archive = ZipStream()
+    yield from archive.add('stories.ndjson', export_ndjson(queryset, chunk_size), compress=True)
+    names = (
+        queryset.exclude(combined_image='')
+        .order_by('combined_image')
+        .values_list('combined_image', flat=True)
+        .distinct()
+        .iterator(chunk_size=chunk_size)
+    )
+    for name in names:
+        try:
+            file = default_storage.open(name, 'rb')
+        except (FileNotFoundError, OSError):
+            logger.warning("Scene file %s is missing, left out of the export", name)
+            continue
+        # Scenes are JPEGs already, so deflating them would only cost time
+        yield from archive.add(IMAGES_DIR + name, _file_chunks(file), compress=False)
+    yield from archive.close()
+
+
+def stories_for_export(since=None, alias: Optional[str] = None):
+    """Stories created on or after the date `since` (all when None), read from `alias`"""
+    queryset = StoryGeneration.objects.all()
+    if alias:
+        queryset = queryset.using(alias)
+    if since:
+        # Start of that day in TIME_ZONE, so the created_at index can be used
+        queryset = queryset.filter(created_at__gte=timezone.make_aware(datetime.combine(since, datetime.min.time())))
+    return queryset
+
+
+class ZipStream:
+    """
+    Minimal streaming ZIP64 writer. Each entry is written as a local header,
+    its data and a trailing data descriptor (sizes and CRC are only known
+    once the data has gone out); its central directory record is spooled
+    and the directory is emitted by close(). Every entry uses ZIP64 fields,
+    so neither an entry nor the archive has a 4 GiB or 65535-entry limit.
+    """
+
+    _VERSION = 45  # ZIP64
+    _FLAGS = 0x08 | 0x800  # sizes in a data descriptor; UTF-8 names
+
+    def __init__(self):
+        self._offset = 0
+        self._entries = 0
+        self._directory = tempfile.SpooledTemporaryFile(max_size=_DIRECTORY_SPOOL_BYTES)
+
+    def add(self, name: str, chunks: Iterable[bytes], compress: bool = True,
+            modified: Optional[float] = None) -> Iterator[bytes]:
+        """Bytes of one entry: local header, data and data descriptor"""
+        encoded_name = name.encode('utf-8')
+        method = 8 if compress else 0
+        dos_time, dos_date = _dos_datetime(modified or time.time())
+        header_offset = self._offset
+
+        header = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self._VERSION, self._FLAGS, method, dos_time, dos_date,
+            0, 0xFFFFFFFF, 0xFFFFFFFF, len(encoded_name), 20,
+        ) + encoded_name + struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        yield self._emit(header)
+
+        crc, size, compressed_size = 0, 0, 0
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if compress else None
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk) if compressor else chunk
+            if data:
+                compressed_size += len(data)
+                yield self._emit(data)
+        if compressor:
+            data = compressor.flush()
+            compressed_size += len(data)
+            if data:
+                yield self._emit(data)
+
+        yield self._emit(struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size))
+
+        self._directory.write(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, self._VERSION | (3 << 8), self._VERSION, self._FLAGS, method,
+            dos_time, dos_date, crc, 0xFFFFFFFF, 0xFFFFFFFF, len(encoded_name), 28, 0, 0, 0,
+            0o100644 << 16, 0xFFFFFFFF,
+        ) + encoded_name + struct.pack('<HHQQQ', 0x0001, 24, size, compressed_size, header_offset))
+        self._entries += 1
+
+    def close(self) -> Iterator[bytes]:
+        """The central directory and end records"""
+        directory_offset = self._offset
+        self._directory.seek(0)
+        while True:
+            block = self._directory.read(EXPORT_FLUSH_BYTES)
+            if not block:
+                break
+            yield self._emit(block)
+        self._directory.close()
+        directory_size = self._offset - directory_offset
+
+        end64_offset = self._offset
+        entries = self._entries
+        yield self._emit(
+            struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, self._VERSION, self._VERSION, 0, 0,
+                        entries, entries, directory_size, directory_offset)
+            + struct.pack('<IIQI', 0x07064b50, 0, end64_offset, 1)
+            + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(entries, 0xFFFF), min(entries, 0xFFFF),
+                          min(directory_size, 0xFFFFFFFF), min(directory_offset, 0xFFFFFFFF), 0)
+        )
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+
+def _dos_datetime(timestamp: float):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def write_export(output: io.RawIOBase, chunks: Iterable[bytes]) -> int:
+    """Write an export to a binary file; returns the bytes written"""
+    written = 0
+    for chunk in chunks:
+        output.write(chunk)
+        written += len(chunk)
+    return written
@@ -0,0 +1,218 @@
+"""
+Image sources for character and background pictures.
+
+A source turns a description into a browser-facing URL and, for compositing,
+into a PIL image. Sources are configured in settings.IMAGE_SOURCES the same way
+as LLM providers (named entries with a BACKEND path); settings.IMAGE_SOURCE
+picks the default and a request may name another configured source.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import random
+import textwrap
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from .startup import lazy_import
+
+requests = lazy_import('requests')
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageFont = lazy_import('PIL.ImageFont')
+
+logger = logging.getLogger(__name__)
+
+
+class ImageSource:
+    """Interface every image backend implements"""
+
+    def __init__(self, name: str, options: dict):
+        self.name = name
+        self.width = int(options.get('WIDTH', 512))
+        self.height = int(options.get('HEIGHT', 512))
+
+    def url(self, description: str) -> str:
+        raise NotImplementedError
+
+    def fetch(self, description: str) -> Optional[Image.Image]:
+        """RGBA image for the description, or None if it can't be produced"""
+        raise NotImplementedError
+
+
+class PollinationsSource(ImageSource):
+    """Remote text-to-image via Pollinations AI, with a picsum placeholder if URL building fails"""
+
+    def __init__(self, name: str, options: dict):
+        super().__init__(name, options)
+        self.base_url = options.get('BASE_URL', "https://image.pollinations.ai/prompt/")
+        self.timeout = float(options.get('TIMEOUT', 10))
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def url(self, description: str) -> str:
+        if not description.strip():
+            return ""
+        # crc32 rather than hash(): stable across worker processes, so the same
+        # description always maps to the same (upstream-cacheable) image
+        seed = zlib.crc32(description.encode('utf-8')) % 10000
+        try:
+            enhanced_desc = f"high quality, detailed, 4k resolution, {description}"
+            return (
+                f"{self.base_url}{quote(enhanced_desc)}"
+                f"?width={self.width}&height={self.height}&seed={seed}&enhance=true"
+            )
+        except Exception as e:
+            logger.error("Error generating image: %s", e)
+            return f"https://picsum.photos/{self.width}/{self.height}?random={seed % 1000}"
+
+    def fetch(self, description: str) -> Optional[Image.Image]:
+        url = self.url(description)
+        if not url:
+            return None
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return Image.open(io.BytesIO(response.content)).convert('RGBA')
+        except Exception as e:
+            logger.error("Error downloading image from %s: %s", url, e)
+            return None
+
+
+class ProceduralSource(ImageSource):
+    """
+    Local CPU renderer: a gradient, a few shapes and the description text,
+    all derived from a seeded RNG so a description always renders the same
+    image. Needs no network, so it works offline, in load tests and as a
+    fallback when the upstream is down.
+    """
+
+    MAX_SIZE = 2048
+    # Largest side procedural_image renders for a public URL; fetch() uses the configured size
+    MAX_SERVED_SIZE = 1024
+    _PALETTE = [
+        (36, 59, 85), (20, 30, 48), (142, 68, 173), (44, 62, 80), (231, 76, 60), (241, 196, 15),
+        (46, 204, 113), (52, 152, 219), (230, 126, 34), (26, 188, 156), (236, 240, 241), (149, 165, 166),
+    ]
+
+    def url(self, description: str) -> str:
+        if not description.strip():
+            return ""
+        query = urlencode({'d': description, 'w': self.width, 'h': self.height})
+        return f"{reverse('procedural_image')}?{query}"
+
+    def fetch(self, description: str) -> Optional[Image.Image]:
+        if not description.strip():
+            return None
+        return self.render(description, self.width, self.height)
+
+    @classmethod
+    def render(cls, description: str, width: int, height: int) -> Image.Image:
+        width = max(16, min(width, cls.MAX_SIZE))
+        height = max(16, min(height, cls.MAX_SIZE))
+        seed = int.from_bytes(hashlib.sha256(description.encode('utf-8')).digest()[:8], 'big')
+        rng = random.Random(seed)
+        top, bottom = rng.sample(cls._PALETTE, 2)
+
+        # Vertical gradient: scale PIL's 256px ramp instead of drawing per row
+        mask = Image.linear_gradient('L').resize((width, height))
+        image = Image.composite(Image.new('RGBA', (width, height), bottom + (255,)),
+                                Image.new('RGBA', (width, height), top + (255,)), mask)
+
+        overlay = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(overlay)
+        for _ in range(rng.randint(3, 7)):
+            color = rng.choice(cls._PALETTE) + (rng.randint(60, 160),)
+            x, y = rng.randrange(width), rng.randrange(height)
+            r = rng.randint(min(width, height) // 12, min(width, height) // 4)
+            if rng.random() < 0.5:
+                draw.ellipse([x - r, y - r, x + r, y + r], fill=color)
+            else:
+                points = [(x + rng.randint(-r, r), y + rng.randint(-r, r)) for _ in range(rng.randint(3, 5))]
+                draw.polygon(points, fill=color)
+        image = Image.alpha_composite(image, overlay)
+
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.load_default()
+        chars_per_line = max(10, width // 8)
+        lines = textwrap.wrap(description, chars_per_line)[:max(1, height // 48)]
+        y = height - 16 * len(lines) - 12
+        for line in lines:
+            draw.text((12, y), line, fill=(255, 255, 255, 230), font=font)
+            y += 16
+        return image
+
+
+_sources: Dict[str, ImageSource] = {}
+_sources_lock = threading.Lock()
+
+
+def get_image_source(name: Optional[str] = None) -> ImageSource:
+    """Configured source by name; unknown or empty names give settings.IMAGE_SOURCE"""
+    if name not in settings.IMAGE_SOURCES:
+        name = settings.IMAGE_SOURCE
+    source = _sources.get(name)
+    if source is None:
+        with _sources_lock:
+            source = _sources.get(name)
+            if source is None:
+                options = settings.IMAGE_SOURCES[name]
+                source = _sources[name] = import_string(options['BACKEND'])(name, options)
+    return source
+
+
+class BoundedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor with a bounded work queue: submit() blocks while
+    `max_pending` tasks are already queued or running, so a burst of
+    requests waits for fetch slots instead of piling up work (and the
+    images it holds) in an unbounded queue.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, thread_name_prefix: str = ''):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max(max_pending, max_workers))
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        self._slots.acquire()
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        # Also called when a queued task is cancelled
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_fetch_pool: Optional[BoundedThreadPoolExecutor] = None
+
+
+def fetch_pool() -> BoundedThreadPoolExecutor:
+    """
+    Process-wide executor for image downloads, shared by every request so
+    concurrent fetches stay bounded by IMAGE_FETCH_WORKERS and queued ones
+    by IMAGE_FETCH_MAX_PENDING.
+    """
+    global _fetch_pool
+    if _fetch_pool is None:
+        with _sources_lock:
+            if _fetch_pool is None:
+                _fetch_pool = BoundedThreadPoolExecutor(settings.IMAGE_FETCH_WORKERS, settings.IMAGE_FETCH_MAX_PENDING,
+                                                        thread_name_prefix='image-fetch')
+    return _fetch_pool
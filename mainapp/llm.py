@@ -0,0 +1,323 @@
+"""
+LLM provider layer.
+
+Providers share a small interface (complete / stream) and are configured in
+settings.LLM_PROVIDERS the same way Django configures CACHES: a dict of named
+entries with a BACKEND dotted path and backend-specific options.
+settings.LLM_ROUTING lists the providers that may serve requests; the router
+tries healthy ones cheapest first and fails over to the next on error.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .startup import lazy_import
+
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """A provider answered with an error (non-2xx status or unusable body)"""
+
+    def __init__(self, provider: str, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+
+
+class NoProviderAvailable(ProviderError):
+    pass
+
+
+def extract_text(data) -> str:
+    """
+    Pull the generated text out of a chat-completion style response.
+    Handles message.content, delta.content, choice.text and a few flat shapes;
+    returns '' when nothing usable is found.
+    """
+    if not isinstance(data, dict):
+        return data if isinstance(data, str) else ""
+
+    choices = data.get('choices')
+    if isinstance(choices, list) and choices:
+        choice = choices[0]
+        if not isinstance(choice, dict):
+            return ""
+        for key in ('message', 'delta'):
+            part = choice.get(key)
+            if isinstance(part, dict) and part.get('content'):
+                return part['content']
+        for key in ('text', 'content'):
+            if choice.get(key):
+                return choice[key]
+        return ""
+
+    for key in ('content', 'response', 'text'):
+        if isinstance(data.get(key), str):
+            return data[key]
+    return ""
+
+
+class BaseProvider:
+    """Interface every LLM backend implements"""
+
+    def __init__(self, name: str, options: dict):
+        self.name = name
+        self.cost_per_1k_tokens = float(options.get('COST_PER_1K_TOKENS', 0))
+        self.timeout = float(options.get('TIMEOUT', 30))
+
+    def is_configured(self) -> bool:
+        return True
+
+    def complete(self, messages: List[dict], max_tokens: int, temperature: float = 0.7) -> str:
+        raise NotImplementedError
+
+    def stream(self, messages: List[dict], max_tokens: int, temperature: float = 0.7) -> Iterator[str]:
+        """Yield the response text in chunks; defaults to a single chunk"""
+        yield self.complete(messages, max_tokens, temperature)
+
+
+class OpenAICompatibleProvider(BaseProvider):
+    """
+    Any /chat/completions API in the OpenAI request/response format.
+    Each worker thread keeps its own requests.Session so TCP/TLS connections
+    to the provider are reused across requests.
+    """
+
+    def __init__(self, name: str, options: dict):
+        super().__init__(name, options)
+        self.base_url = options['BASE_URL'].rstrip('/')
+        self.api_key = options.get('API_KEY')
+        self.model = options['MODEL']
+        self._local = threading.local()
+
+    def is_configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+            })
+            self._local.session = session
+        return session
+
+    def _post(self, messages, max_tokens, temperature, stream=False):
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        if stream:
+            payload["stream"] = True
+        response = self.session.post(
+            f"{self.base_url}/chat/completions",
+            json=payload,
+            timeout=self.timeout,
+            stream=stream,
+        )
+        if response.status_code != 200:
+            raise ProviderError(self.name, response.text, response.status_code)
+        return response
+
+    def complete(self, messages, max_tokens, temperature=0.7):
+        data = self._post(messages, max_tokens, temperature).json()
+        text = extract_text(data)
+        if not text:
+            logger.error("Could not extract content from %s response", self.name)
+            logger.debug("Unrecognised %s response: %.500s", self.name, data)
+            # Let the caller's fallback parsing have a go at the raw body
+            text = str(data) if isinstance(data, dict) else ""
+        if not text:
+            raise ProviderError(self.name, f"Could not extract content from API response. Response type: {type(data)}")
+        return text
+
+    def stream(self, messages, max_tokens, temperature=0.7):
+        response = self._post(messages, max_tokens, temperature, stream=True)
+        with response:
+            # SSE is UTF-8 by definition; without a charset requests would decode
+            # text/event-stream as ISO-8859-1 (or yield bytes when it has no encoding)
+            response.encoding = 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                body = line[5:].strip()
+                if body == "[DONE]":
+                    break
+                chunk = extract_text(json.loads(body))
+                if chunk:
+                    yield chunk
+
+
+class PerplexityProvider(OpenAICompatibleProvider):
+    def __init__(self, name: str, options: dict):
+        options = {'BASE_URL': "https://api.perplexity.ai", 'MODEL': "sonar", **options}
+        super().__init__(name, options)
+
+
+class LocalStubProvider(BaseProvider):
+    """
+    Deterministic offline stand-in for load tests and local development.
+    The same prompt always yields the same story; LATENCY (seconds, with
+    optional JITTER) simulates upstream response time without using CPU.
+    """
+
+    _SUBJECTS = ["a wandering knight", "a curious robot", "an old lighthouse keeper", "a young witch", "a clever fox"]
+    _PLACES = ["a misty harbour town", "a crystal cave", "a floating market", "an abandoned observatory", "a desert oasis"]
+    _STORYBOARD = re.compile(r"exactly (\d+) scene beats")
+
+    def __init__(self, name: str, options: dict):
+        super().__init__(name, options)
+        self.latency = float(options.get('LATENCY', 0))
+        self.jitter = float(options.get('JITTER', 0))
+        self.chunk_size = int(options.get('CHUNK_SIZE', 40))
+
+    def _respond(self, messages: List[dict], max_tokens: int) -> str:
+        prompt = messages[-1]['content'] if messages else ""
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        subject = self._SUBJECTS[digest[0] % len(self._SUBJECTS)]
+        place = self._PLACES[digest[1] % len(self._PLACES)]
+        paragraphs = max(1, min(5, max_tokens // 400))
+        story = "\n\n".join(
+            f"Part {i + 1}: In {place}, {subject} found something unexpected and chose to follow it."
+            for i in range(paragraphs)
+        )
+        response = {
+            "character": f"{subject.capitalize()}, drawn in warm colours with a determined expression",
+            "background": f"{place.capitalize()} at dusk, soft light and long shadows",
+            "story": story,
+        }
+        storyboard = self._STORYBOARD.search(prompt)
+        if storyboard:
+            # Settings recur across beats, as they do in real storyboards
+            places = [self._PLACES[byte % len(self._PLACES)] for byte in digest[2:2 + int(storyboard.group(1))]]
+            response["panels"] = [
+                {"beat": f"Beat {i + 1}: {subject} reaches {beat_place}.",
+                 "background": f"{beat_place.capitalize()} at dusk, soft light and long shadows"}
+                for i, beat_place in enumerate(places)
+            ]
+        return json.dumps(response)
+
+    def _wait(self, fraction: float = 1.0):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay * fraction)
+
+    def complete(self, messages, max_tokens, temperature=0.7):
+        self._wait()
+        return self._respond(messages, max_tokens)
+
+    def stream(self, messages, max_tokens, temperature=0.7):
+        text = self._respond(messages, max_tokens)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for chunk in chunks:
+            self._wait(1 / len(chunks))
+            yield chunk
+
+
+class ProviderRouter:
+    """
+    Picks a provider per call: configured and healthy ones first, cheapest
+    first. A provider that fails FAILURE_THRESHOLD times in a row is skipped
+    for COOLDOWN seconds (unless nothing else is left).
+    """
+
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 30.0
+
+    def __init__(self, providers: List[BaseProvider]):
+        self.providers = providers
+        self._lock = threading.Lock()
+        self._failures = {p.name: 0 for p in providers}
+        self._down_until = {p.name: 0.0 for p in providers}
+
+    def has_configured_provider(self) -> bool:
+        return any(p.is_configured() for p in self.providers)
+
+    def _candidates(self) -> List[BaseProvider]:
+        now = time.monotonic()
+        configured = [p for p in self.providers if p.is_configured()]
+        healthy = [p for p in configured if self._down_until[p.name] <= now]
+        unhealthy = [p for p in configured if self._down_until[p.name] > now]
+        return sorted(healthy, key=lambda p: p.cost_per_1k_tokens) + unhealthy
+
+    def _record(self, provider: BaseProvider, ok: bool):
+        with self._lock:
+            if ok:
+                self._failures[provider.name] = 0
+                return
+            self._failures[provider.name] += 1
+            if self._failures[provider.name] >= self.FAILURE_THRESHOLD:
+                self._down_until[provider.name] = time.monotonic() + self.COOLDOWN
+                logger.warning("LLM provider %s marked unhealthy for %ss", provider.name, self.COOLDOWN)
+
+    def complete(self, messages, max_tokens, temperature=0.7) -> str:
+        last_error = None
+        for provider in self._candidates():
+            try:
+                text = provider.complete(messages, max_tokens, temperature)
+            except (ProviderError, requests.exceptions.RequestException) as e:
+                logger.warning("LLM provider %s failed: %s", provider.name, e)
+                self._record(provider, ok=False)
+                last_error = e
+                continue
+            self._record(provider, ok=True)
+            return text
+        if last_error:
+            raise last_error
+        raise NoProviderAvailable("router", "No LLM provider is configured")
+
+    def stream(self, messages, max_tokens, temperature=0.7) -> Iterator[str]:
+        """Stream from the first provider that starts successfully"""
+        last_error = None
+        for provider in self._candidates():
+            chunks = provider.stream(messages, max_tokens, temperature)
+            try:
+                first = next(chunks, "")
+            except (ProviderError, requests.exceptions.RequestException) as e:
+                logger.warning("LLM provider %s failed: %s", provider.name, e)
+                self._record(provider, ok=False)
+                last_error = e
+                continue
+            self._record(provider, ok=True)
+            yield first
+            yield from chunks
+            return
+        if last_error:
+            raise last_error
+        raise NoProviderAvailable("router", "No LLM provider is configured")
+
+
+_router: Optional[ProviderRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """Process-wide router built from settings.LLM_PROVIDERS / LLM_ROUTING"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                providers = []
+                for name in settings.LLM_ROUTING:
+                    options = settings.LLM_PROVIDERS[name]
+                    providers.append(import_string(options['BACKEND'])(name, options))
+                _router = ProviderRouter(providers)
+    return _router
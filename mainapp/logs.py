@@ -0,0 +1,156 @@
+"""
+Structured logging.
+
+Every record carries the id of the request that produced it (taken from an
+incoming X-Request-ID header or generated), is rendered as one JSON object
+per line, and is written by a background thread: request threads only put
+records on a bounded queue, so slow log I/O never blocks them. When the
+queue is full, records are dropped and counted instead of waiting.
+
+Referenced from settings.LOGGING, so this module must not import models.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import re
+import uuid
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id'}
+
+
+def get_request_id() -> str:
+    return _request_id.get()
+
+
+class RequestIdMiddleware:
+    """Bind a request id for the duration of the request and echo it back in X-Request-ID"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        request.request_id = request_id
+        token = _request_id.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request id; runs in the request thread, before queueing"""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class DebugSampleFilter(logging.Filter):
+    """
+    Keep DEBUG records for a `rate` fraction of requests. Sampling is by
+    request id, so a sampled request keeps all of its debug lines.
+    Records at INFO and above always pass.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.threshold = int(max(0.0, min(float(rate), 1.0)) * 10000)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        request_id = getattr(record, 'request_id', None) or _request_id.get()
+        return zlib.crc32(request_id.encode()) % 10000 < self.threshold
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message, request id and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def formatTime(self, record, datefmt=None):
+        return super().formatTime(record, datefmt or '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}'
+
+
+class QueueStreamHandler(QueueHandler):
+    """
+    Stream handler whose formatting and writes happen on a listener thread.
+    The calling thread only resolves the message arguments (so mutable args
+    are captured as they were) and enqueues without blocking.
+    """
+
+    def __init__(self, stream=None, maxsize: int = 10000):
+        self.maxsize = maxsize
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream)
+        self.dropped = 0
+        self._start_listener()
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            # The listener thread does not survive fork (e.g. gunicorn --preload)
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def _start_listener(self):
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _restart_after_fork(self):
+        if self.listener is None:
+            return
+        self.queue = queue.Queue(self.maxsize)
+        self._start_listener()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        listener, self.listener = getattr(self, 'listener', None), None
+        if listener is not None:
+            listener.stop()
+            self.target.flush()
+        super().close()
@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mainapp.retention import RetentionScheduler, run_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the retention policies (RETENTION_*): expire old stories, compact old "
+        "scenes, cap total scene size and sweep orphaned files. Runs one pass, or with "
+        "--loop keeps running passes during RETENTION_HOURS. Work is batched and paced, "
+        "and the process lowers its CPU priority so web workers come first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Run the scheduler until interrupted")
+        parser.add_argument('--interval', type=int, default=None,
+                            help="Seconds between passes with --loop (default RETENTION_INTERVAL)")
+
+    def handle(self, *args, **options):
+        if settings.RETENTION_NICENESS and hasattr(os, 'nice'):
+            os.nice(settings.RETENTION_NICENESS)
+
+        if options['loop']:
+            scheduler = RetentionScheduler(options['interval'])
+            self.stdout.write(
+                f"Running retention every {scheduler.interval} s during hours "
+                f"{settings.RETENTION_HOURS or 'any'}"
+            )
+            scheduler.start()
+            try:
+                scheduler.join()
+            except KeyboardInterrupt:
+                scheduler.stop()
+            return
+
+        report = run_retention()
+        if report is None:
+            self.stdout.write("A retention pass is already running elsewhere")
+            return
+        self.stdout.write(", ".join(f"{key.replace('_', ' ')}: {value}" for key, value in report.items()))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mainapp.pool import PoolScheduler, is_off_peak, pool_themes, refill_pool
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-generate stories for seeded and trending themes so matching prompts are "
+        "served from the warm pool. Runs one pass, or with --loop keeps refilling "
+        "during STORY_POOL_OFF_PEAK_HOURS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Run the scheduler until interrupted")
+        parser.add_argument('--interval', type=int, default=None,
+                            help="Seconds between passes with --loop (default STORY_POOL_REFILL_INTERVAL)")
+        parser.add_argument('--now', action='store_true', help="Refill even outside off-peak hours")
+        parser.add_argument('--limit', type=int, default=None, help="Generate at most this many stories")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            scheduler = PoolScheduler(options['interval'])
+            self.stdout.write(
+                f"Refilling every {scheduler.interval} s during off-peak hours "
+                f"({settings.STORY_POOL_OFF_PEAK_HOURS or 'any'})"
+            )
+            scheduler.start()
+            try:
+                scheduler.join()
+            except KeyboardInterrupt:
+                scheduler.stop()
+            return
+
+        if not options['now'] and not is_off_peak():
+            self.stdout.write("Outside off-peak hours, skipping (use --now to refill anyway)")
+            return
+        themes = pool_themes()
+        if not themes:
+            self.stdout.write("No themes: set STORY_POOL_THEMES or wait for trending prompts")
+            return
+        generated = refill_pool(options['limit'])
+        self.stdout.write(f"Generated {generated} pooled stor{'y' if generated == 1 else 'ies'} for {len(themes)} theme(s)")
@@ -0,0 +1,64 @@
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+# Same defaults collectstatic applies
+IGNORE_PATTERNS = ['CVS', '.*', '*~']
+STAMP_NAME = '.static-fingerprint'
+
+
+def static_fingerprint() -> str:
+    """Hash of every source static file's path, size and mtime, plus the storage config"""
+    digest = hashlib.sha256()
+    digest.update(repr(settings.STORAGES.get('staticfiles')).encode())
+    entries = []
+    for finder in get_finders():
+        for path, storage in finder.list(IGNORE_PATTERNS):
+            stat = os.stat(storage.path(path))
+            entries.append(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}")
+    for entry in sorted(entries):
+        digest.update(entry.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Release steps for instance boot: collectstatic and migrate, each skipped "
+        "when nothing has changed since the last run. Replaces running both commands "
+        "separately, which boots Django twice and always walks every static file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--force', action='store_true', help="Run both steps unconditionally")
+
+    def handle(self, *args, **options):
+        self.collect_static(options['force'])
+        self.migrate(options['database'], options['force'])
+
+    def collect_static(self, force: bool):
+        stamp = Path(settings.STATIC_ROOT) / STAMP_NAME
+        fingerprint = static_fingerprint()
+        if not force and stamp.exists() and stamp.read_text() == fingerprint:
+            self.stdout.write("Static files unchanged, skipping collectstatic")
+            return
+        call_command('collectstatic', interactive=False, verbosity=0)
+        stamp.write_text(fingerprint)
+        self.stdout.write("Collected static files")
+
+    def migrate(self, database: str, force: bool):
+        executor = MigrationExecutor(connections[database])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not force and not plan:
+            self.stdout.write("No unapplied migrations, skipping migrate")
+            return
+        call_command('migrate', database=database, interactive=False, verbosity=0)
+        self.stdout.write(f"Applied {len(plan)} migration(s)")
@@ -0,0 +1,126 @@
+"""
+Serving image bytes without extra copies.
+
+Images come either from memory (an EncodedImage held by the result cache)
+or from a file in local media storage. In-memory bytes go to the WSGI
+server as the very bytes object that was encoded: no getvalue() copy, no
+base64, no Python-level chunking. Files are handed over as a file object
+with a fileno, so servers that support it (gunicorn) send them with
+sendfile() straight from the page cache.
+
+Single byte ranges (Range: bytes=a-b) are answered with 206, honouring
+If-Range; the ETag and length come precomputed from encode time, so
+conditional requests are answered without touching the image.
+"""
+import os
+import re
+from typing import Optional, Tuple
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+UNSATISFIABLE = 'unsatisfiable'
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single-range header, None to serve the whole
+    body (no header, multiple ranges or a malformed one), or UNSATISFIABLE.
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the final `last` bytes
+        length = int(last)
+        if not length:
+            return UNSATISFIABLE
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end:
+        return None if last and int(last) < start else UNSATISFIABLE
+    return start, end
+
+
+class FileRange:
+    """
+    File object limited to `length` bytes from its current position. It
+    exposes the real fileno, so sendfile() sends exactly Content-Length
+    bytes from there; plain read() callers are stopped at the range end.
+    """
+
+    def __init__(self, file, length: int):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self.file.fileno()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _requested_range(request, etag: str, size: int):
+    header = request.META.get('HTTP_RANGE')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range.strip() != etag:
+        # The client's partial copy is stale: send the whole image
+        return None
+    return parse_range(header, size)
+
+
+def image_response(request, *, etag: str, size: int, content_type: str,
+                   data: Optional[bytes] = None, path: Optional[str] = None, max_age: int = 0) -> HttpResponse:
+    """
+    Response for an image held in `data` or stored at `path`, with ETag,
+    Content-Length, Range and conditional request handling.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        byte_range = _requested_range(request, etag, size)
+        if byte_range == UNSATISFIABLE:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+
+        if data is not None:
+            # bytes objects pass through HttpResponse untouched; only a partial range is sliced
+            body = data if length == len(data) else data[start:end + 1]
+            response = HttpResponse(body, content_type=content_type)
+        else:
+            file = open(path, 'rb')
+            if start:
+                file.seek(start)
+            response = FileResponse(FileRange(file, length), content_type=content_type)
+            response['Content-Length'] = str(length)
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def file_validators(path: str) -> Tuple[str, int]:
+    """(etag, size) for a file stored before validators were recorded at encode time"""
+    stat = os.stat(path)
+    return f'{stat.st_size:x}-{stat.st_mtime_ns:x}', stat.st_size
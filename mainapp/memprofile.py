@@ -0,0 +1,283 @@
+"""
+Memory profiling and RSS-based worker recycling.
+
+With MEMORY_PROFILING on, tracemalloc traces every allocation from startup.
+MemoryProfileMiddleware records each request's peak traced memory and how
+much it left allocated, and the pipeline calls memory_checkpoint() after
+each stage, which adds `<stage>_peak_kb` and `<stage>_kb` (net change) to
+the stage timings and keeps a tracemalloc snapshot in a bounded ring.
+Pillow allocates pixel buffers outside Python's allocator, so images are
+invisible to tracemalloc (their BytesIO buffers, encoded bytes and base64
+strings are not); `<stage>_rss_kb`, the change in resident memory, covers them.
+/debug/memory/ (staff only) lists the snapshots and recent requests, the
+top allocating call sites, and diffs between any two snapshots (or a
+snapshot and now), which is where a leak shows up as a call site whose
+retained size keeps growing. tracemalloc's peak is process-wide, so
+per-request figures are exact only while requests don't overlap.
+
+Tracing costs several times the allocation time, so it is off by default.
+When both profiling and WORKER_MAX_RSS_MB are off the middleware removes
+itself at startup, and memory_checkpoint() is a single context variable
+lookup.
+
+WORKER_MAX_RSS_MB recycles a gunicorn worker whose resident set has grown
+past the threshold: after the response it sends the worker SIGTERM, which
+gunicorn treats as a graceful shutdown (in-flight requests finish) and
+replaces the worker with a fresh fork.
+"""
+import itertools
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .logs import get_request_id
+
+logger = logging.getLogger(__name__)
+
+# Allocations made by tracemalloc itself and the import machinery are noise in every
+# report. They are dropped from the grouped statistics rather than with
+# Snapshot.filter_traces(), which walks every trace in Python and takes seconds.
+_NOISE_FILES = frozenset((
+    tracemalloc.__file__,
+    '<frozen importlib._bootstrap>',
+    '<frozen importlib._bootstrap_external>',
+    '<unknown>',
+))
+
+
+def start_profiling() -> None:
+    """Start tracing when MEMORY_PROFILING is on (called once at startup)"""
+    if settings.MEMORY_PROFILING and not tracemalloc.is_tracing():
+        tracemalloc.start(settings.MEMORY_PROFILING_FRAMES)
+
+
+def rss_bytes() -> Optional[int]:
+    """Current resident set size, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class LabelledSnapshot(NamedTuple):
+    id: int
+    label: str
+    request_id: str
+    taken_at: float
+    snapshot: tracemalloc.Snapshot
+
+
+class SnapshotRing:
+    """The last MEMORY_PROFILING_SNAPSHOTS snapshots, by id"""
+
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._snapshots: Deque[LabelledSnapshot] = deque(maxlen=size)
+
+    def take(self, label: str) -> LabelledSnapshot:
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            entry = LabelledSnapshot(next(self._ids), label, get_request_id(), time.time(), snapshot)
+            self._snapshots.append(entry)
+        return entry
+
+    def get(self, snapshot_id: int) -> Optional[LabelledSnapshot]:
+        with self._lock:
+            return next((entry for entry in self._snapshots if entry.id == snapshot_id), None)
+
+    def latest(self) -> Optional[LabelledSnapshot]:
+        with self._lock:
+            return self._snapshots[-1] if self._snapshots else None
+
+    def list(self) -> List[LabelledSnapshot]:
+        with self._lock:
+            return list(self._snapshots)
+
+
+_snapshots: Optional[SnapshotRing] = None
+_snapshots_lock = threading.Lock()
+
+
+def snapshot_ring() -> SnapshotRing:
+    global _snapshots
+    if _snapshots is None:
+        with _snapshots_lock:
+            if _snapshots is None:
+                _snapshots = SnapshotRing(settings.MEMORY_PROFILING_SNAPSHOTS)
+    return _snapshots
+
+
+class RequestProfile:
+    """Traced memory of one request, measured from its start and from the last checkpoint"""
+
+    __slots__ = ('start', 'last', 'peak', 'start_rss', 'last_rss')
+
+    def __init__(self):
+        tracemalloc.reset_peak()
+        self.start = self.last = self.peak = tracemalloc.get_traced_memory()[0]
+        self.start_rss = self.last_rss = rss_bytes() or 0
+
+    def checkpoint(self) -> Dict[str, float]:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rss = rss_bytes() or 0
+        self.peak = max(self.peak, peak)
+        usage = {
+            'peak_kb': round((peak - self.last) / 1024, 1),
+            'kb': round((current - self.last) / 1024, 1),
+            'rss_kb': round((rss - self.last_rss) / 1024, 1),
+        }
+        self.last, self.last_rss = current, rss
+        return usage
+
+
+_profile: ContextVar[Optional[RequestProfile]] = ContextVar('memory_profile', default=None)
+
+# The last requests' memory summaries, newest last
+_recent_requests: Deque[dict] = deque(maxlen=50)
+
+
+def memory_checkpoint(stages: Dict[str, float], stage: str) -> None:
+    """Record traced memory for the stage that just finished; no-op unless profiling"""
+    profile = _profile.get()
+    if profile is None:
+        return
+    usage = profile.checkpoint()
+    stages[f'{stage}_peak_kb'] = usage['peak_kb']
+    stages[f'{stage}_kb'] = usage['kb']
+    stages[f'{stage}_rss_kb'] = usage['rss_kb']
+    if settings.MEMORY_PROFILING_SNAPSHOTS:
+        snapshot_ring().take(stage)
+
+
+class MemoryProfileMiddleware:
+    """Per-request traced memory and RSS-based recycling; unused when both are off"""
+
+    def __init__(self, get_response):
+        if not settings.MEMORY_PROFILING and not settings.WORKER_MAX_RSS_MB:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self._recycling = False
+
+    def __call__(self, request):
+        if not tracemalloc.is_tracing():
+            response = self.get_response(request)
+        else:
+            profile = RequestProfile()
+            token = _profile.set(profile)
+            try:
+                response = self.get_response(request)
+            finally:
+                _profile.reset(token)
+            self._record(request, profile)
+        if settings.WORKER_MAX_RSS_MB:
+            self._check_rss(request)
+        return response
+
+    def _record(self, request, profile: RequestProfile) -> None:
+        current, peak = tracemalloc.get_traced_memory()
+        summary = {
+            'request_id': get_request_id(),
+            'path': request.path,
+            'peak_kb': round((max(profile.peak, peak) - profile.start) / 1024, 1),
+            'retained_kb': round((current - profile.start) / 1024, 1),
+            'rss_kb': round(((rss_bytes() or 0) - profile.start_rss) / 1024, 1),
+        }
+        _recent_requests.append(summary)
+        logger.debug("Request memory: peak %s KiB, retained %s KiB", summary['peak_kb'], summary['retained_kb'],
+                     extra={'event': 'request_memory', **summary})
+
+    def _check_rss(self, request) -> None:
+        rss = rss_bytes()
+        if rss is None or self._recycling or rss < settings.WORKER_MAX_RSS_MB * 1024 * 1024:
+            return
+        if not request.META.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            # Other servers (runserver) would just exit
+            return
+        self._recycling = True
+        logger.warning("Worker RSS %d MiB is over WORKER_MAX_RSS_MB, recycling", rss // (1024 * 1024),
+                       extra={'event': 'worker_recycle', 'rss_mb': rss // (1024 * 1024)})
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _statistics(stats, limit: int) -> List[dict]:
+    rows = []
+    for stat in stats:
+        # Frames run from the oldest call to the allocation itself
+        frame = stat.traceback[-1]
+        if frame.filename in _NOISE_FILES:
+            continue
+        row = {
+            'site': f'{frame.filename}:{frame.lineno}',
+            'size_kb': round(stat.size / 1024, 1),
+            'count': stat.count,
+        }
+        if hasattr(stat, 'size_diff'):
+            row.update(size_diff_kb=round(stat.size_diff / 1024, 1), count_diff=stat.count_diff)
+        if len(stat.traceback) > 1:
+            row['traceback'] = [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+        rows.append(row)
+        if len(rows) == limit:
+            break
+    return rows
+
+
+def memory_report(before: Optional[str] = None, after: Optional[str] = None,
+                  group_by: str = 'lineno', limit: int = 20) -> dict:
+    """
+    Debug report: snapshots, recent requests and top allocation sites, or
+    the diff from snapshot `before` to `after` (a snapshot id, or 'now' for
+    a fresh one). Raises KeyError for an unknown snapshot id.
+    """
+    report = {
+        'tracing': tracemalloc.is_tracing(),
+        'rss_mb': round((rss_bytes() or 0) / (1024 * 1024), 1),
+    }
+    if not report['tracing']:
+        return report
+    ring = snapshot_ring()
+    report.update({
+        'traced_kb': round(tracemalloc.get_traced_memory()[0] / 1024, 1),
+        'snapshots': [
+            {'id': entry.id, 'label': entry.label, 'request_id': entry.request_id, 'taken_at': entry.taken_at}
+            for entry in ring.list()
+        ],
+        'recent_requests': list(_recent_requests),
+    })
+
+    def resolve(value: str) -> LabelledSnapshot:
+        if value == 'now':
+            return ring.take('now')
+        entry = ring.get(int(value))
+        if entry is None:
+            raise KeyError(value)
+        return entry
+
+    if before:
+        old = resolve(before)
+        new = resolve(after or 'now')
+        diff = new.snapshot.compare_to(old.snapshot, group_by)
+        report['diff'] = {'from': old.id, 'to': new.id, 'top': _statistics(diff, limit)}
+    else:
+        latest = ring.latest() or ring.take('now')
+        report['top'] = {'snapshot': latest.id, 'sites': _statistics(latest.snapshot.statistics(group_by), limit)}
+    return report
+
+
+def memory_metrics() -> dict:
+    """Cheap figures for /metrics/"""
+    metrics = {'rss_mb': round((rss_bytes() or 0) / (1024 * 1024), 1), 'tracing': tracemalloc.is_tracing()}
+    if metrics['tracing']:
+        metrics['traced_kb'] = round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+    return metrics
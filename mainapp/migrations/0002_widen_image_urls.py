@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='character_image_url',
+            field=models.URLField(blank=True, max_length=2048),
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='background_image_url',
+            field=models.URLField(blank=True, max_length=2048),
+        ),
+    ]
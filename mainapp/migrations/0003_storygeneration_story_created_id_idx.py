@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_widen_image_urls'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(fields=['-created_at', '-id'], name='story_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-19 00:50
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS mainapp_story_fts USING fts5(
+        user_prompt, story, character_description, background_description,
+        content='mainapp_storygeneration', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_ai AFTER INSERT ON mainapp_storygeneration BEGIN
+        INSERT INTO mainapp_story_fts(rowid, user_prompt, story, character_description, background_description)
+        VALUES (new.id, new.user_prompt, new.story, new.character_description, new.background_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_ad AFTER DELETE ON mainapp_storygeneration BEGIN
+        INSERT INTO mainapp_story_fts(mainapp_story_fts, rowid, user_prompt, story, character_description, background_description)
+        VALUES ('delete', old.id, old.user_prompt, old.story, old.character_description, old.background_description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_au AFTER UPDATE ON mainapp_storygeneration BEGIN
+        INSERT INTO mainapp_story_fts(mainapp_story_fts, rowid, user_prompt, story, character_description, background_description)
+        VALUES ('delete', old.id, old.user_prompt, old.story, old.character_description, old.background_description);
+        INSERT INTO mainapp_story_fts(rowid, user_prompt, story, character_description, background_description)
+        VALUES (new.id, new.user_prompt, new.story, new.character_description, new.background_description);
+    END
+    """,
+    "INSERT INTO mainapp_story_fts(mainapp_story_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS mainapp_story_fts_au",
+    "DROP TRIGGER IF EXISTS mainapp_story_fts_ad",
+    "DROP TRIGGER IF EXISTS mainapp_story_fts_ai",
+    "DROP TABLE IF EXISTS mainapp_story_fts",
+]
+
+# A generated column keeps the vector in step with every insert/update
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE mainapp_storygeneration ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(user_prompt, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(story, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(character_description, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(background_description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS story_search_vector_gin ON mainapp_storygeneration USING GIN (search_vector)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS story_search_vector_gin",
+    "ALTER TABLE mainapp_storygeneration DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_storygeneration_story_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_story_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='pool_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='pool_theme',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(condition=models.Q(('pool_claimed_at__isnull', True), ('pool_theme__isnull', False)), fields=['pool_theme', 'id'], name='story_pool_available_idx'),
+        ),
+    ]
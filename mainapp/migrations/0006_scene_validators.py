@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_story_pool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_image_etag',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_image_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
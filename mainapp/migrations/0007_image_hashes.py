@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 02:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_scene_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_image_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 04:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0007_image_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='storyboard',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_storyboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_image_placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0009_image_placeholders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='access_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 02:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0011_job_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='image_source',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='length',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
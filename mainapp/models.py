@@ -2,16 +2,106 @@ from django.db import models
 
 # Create your models here.
 from django.db import models
+from django.db.models import Q
+from django.urls import reverse
+
+# Fields rendered on gallery/history cards; the large text fields are left out
+LIST_FIELDS = ('id', 'user_prompt', 'combined_image', 'background_image_url', 'created_at')
+
+# Fields rendered on the result/permalink page
+DETAIL_FIELDS = (
+    'id', 'user_prompt', 'story', 'character_description', 'background_description',
+    'character_image_url', 'background_image_url', 'combined_image',
+    'combined_image_etag', 'combined_image_size', 'storyboard',
+    'character_image_placeholder', 'background_image_placeholder', 'combined_image_placeholder',
+)
+
+
+class StoryGenerationQuerySet(models.QuerySet):
+    def for_listing(self):
+        return self.only(*LIST_FIELDS)
+
+    def for_detail(self):
+        return self.only(*DETAIL_FIELDS)
+
+    def pooled(self, theme: str):
+        """Pre-generated stories for a theme that have not been served yet"""
+        return self.filter(pool_theme=theme, pool_claimed_at__isnull=True)
+
+    def served(self):
+        """Everything but unserved pool stories, which are only handed out by claiming them"""
+        return self.filter(Q(pool_theme__isnull=True) | Q(pool_claimed_at__isnull=False))
+
 
 class StoryGeneration(models.Model):
     user_prompt = models.TextField()
     story = models.TextField()
     character_description = models.TextField()
     background_description = models.TextField()
-    character_image_url = models.URLField(blank=True)
-    background_image_url = models.URLField(blank=True)
+    character_image_url = models.URLField(max_length=2048, blank=True)
+    background_image_url = models.URLField(max_length=2048, blank=True)
     combined_image = models.ImageField(upload_to='combined/', blank=True)
+    # Validators for serving the scene, computed when it is encoded (see mainapp/media.py)
+    combined_image_etag = models.CharField(max_length=64, blank=True, default='')
+    combined_image_size = models.PositiveIntegerField(null=True, blank=True)
+    # 64-bit perceptual hashes (stored signed) for near-duplicate detection, see mainapp/phash.py
+    character_image_hash = models.BigIntegerField(null=True, blank=True)
+    background_image_hash = models.BigIntegerField(null=True, blank=True)
+    combined_image_hash = models.BigIntegerField(null=True, blank=True)
+    # Tiny inline thumbnails (data URIs) painted while the full images load
+    character_image_placeholder = models.TextField(blank=True, default='')
+    background_image_placeholder = models.TextField(blank=True, default='')
+    combined_image_placeholder = models.TextField(blank=True, default='')
+    # Storyboard mode (see mainapp/storyboard.py): [{"beat": ..., "background": ...}]
+    # per panel of combined_image; empty for a single scene
+    storyboard = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Warm pool (see mainapp/pool.py): normalized theme a story was pre-generated
+    # for, and when it was handed out; null for on-demand generations. NULL rather
+    # than '' so `pool_theme = %s` lets the database use the partial index below.
+    pool_theme = models.CharField(max_length=255, null=True, blank=True)
+    pool_claimed_at = models.DateTimeField(null=True, blank=True)
+    # Length tier and image source the story was generated with, so near-duplicate
+    # reuse only serves it for the same request; '' on rows from before (the defaults)
+    length = models.CharField(max_length=32, blank=True, default='')
+    image_source = models.CharField(max_length=64, blank=True, default='')
+    # Page views, flushed in batches by each worker (see mainapp/retention.py)
+    access_count = models.PositiveIntegerField(default=0)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = StoryGenerationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination for history/gallery pages
+            models.Index(fields=['-created_at', '-id'], name='story_created_id_idx'),
+            # Unserved pool entries only, so the index stays tiny
+            models.Index(
+                fields=['pool_theme', 'id'],
+                condition=models.Q(pool_claimed_at__isnull=True, pool_theme__isnull=False),
+                name='story_pool_available_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"Story: {self.user_prompt[:50]}..."
+
+    def get_absolute_url(self):
+        return reverse('story_detail', args=[self.pk])
+
+    def get_scene_url(self):
+        return reverse('story_scene', args=[self.pk]) if self.combined_image else ''
+
+
+class JobLock(models.Model):
+    """
+    Lease held by a background job (see mainapp/db.py:job_lock) so only one
+    process on any instance runs it at a time; unlike the cache, the
+    database is shared by every process.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    holder = models.CharField(max_length=128)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder} until {self.expires_at}"
@@ -0,0 +1,48 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.db.models import Q
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    """Opaque cursor pointing just past the given (created_at, id) row"""
+    raw = f"{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """Return (created_at, id) from a cursor, or None if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    Newest-first page of `queryset` using keyset pagination on (created_at, id).
+    Each page is an index range scan that starts where the last one stopped,
+    so deep pages cost the same as the first one (unlike OFFSET).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by("-created_at", "-id")
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        created_at, pk = position
+        # The redundant created_at__lte bound gives the planner an index range
+        # to seek into; the OR alone forces a scan from the top of the index.
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk),
+            created_at__lte=created_at,
+        )
+
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.pk)
+    return rows, next_cursor
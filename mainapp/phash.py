@@ -0,0 +1,281 @@
+"""
+Perceptual hashes of story images, for spotting near-duplicates.
+
+Similar descriptions often come back from the image source as near-identical
+pictures. Each fetched character and background image and each composed
+scene gets a 64-bit difference hash (dHash): the image is shrunk to 9x8
+grayscale and every bit says whether a pixel is brighter than its left
+neighbour. The whole computation runs inside PIL's C code.
+
+Hashes are looked up with multi-index hashing, the bit-level analogue of
+the LSH banding in similarity.py: the hash is cut into BLOCKS 16-bit blocks,
+each with its own table. Two hashes within distance d differ in at most
+d // BLOCKS bits in some block (pigeonhole), so probing each table with
+every key that close to the query's block finds all of them, and only those
+few candidates get an exact Hamming check.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from itertools import combinations
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from django.conf import settings
+
+from .startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageChops = lazy_import('PIL.ImageChops')
+
+HASH_BITS = 64
+BLOCKS = 4
+BLOCK_BITS = HASH_BITS // BLOCKS
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+# Ids re-read behind the sync cursor, for rows other workers commit out of id order
+SYNC_OVERLAP = 100
+# PIL point() table mapping any positive difference to a set bit
+_POSITIVE = [0] + [255] * 255
+
+
+def dhash(image: Image.Image) -> int:
+    """64-bit difference hash of an image"""
+    # Grayscale first: resizing one channel is cheaper than three or four
+    gray = image.convert('L').resize((9, 8), Image.Resampling.BOX, reducing_gap=2.0)
+    # right - left, clipped at 0: non-zero exactly where a pixel is brighter than its left neighbour
+    diff = ImageChops.subtract(gray.crop((1, 0, 9, 8)), gray.crop((0, 0, 8, 8)))
+    return int.from_bytes(diff.point(_POSITIVE, '1').tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def to_signed(value: Optional[int]) -> Optional[int]:
+    """Store an unsigned 64-bit hash in a signed BigIntegerField"""
+    if value is None:
+        return None
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return None
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+_masks: Dict[int, Tuple[int, ...]] = {}
+
+
+def _probe_masks(radius: int) -> Tuple[int, ...]:
+    """XOR masks for every block key within `radius` bits of a given key"""
+    if radius not in _masks:
+        masks = [0]
+        for bits in range(1, radius + 1):
+            for positions in combinations(range(BLOCK_BITS), bits):
+                masks.append(sum(1 << position for position in positions))
+        _masks[radius] = tuple(masks)
+    return _masks[radius]
+
+
+class HashIndex:
+    """Multi-index Hamming lookup from 64-bit hashes to story ids"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes: Dict[int, int] = {}
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(BLOCKS)]
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, story_id: int):
+        return story_id in self._hashes
+
+    def add(self, story_id: int, value: int) -> None:
+        with self._lock:
+            self._remove(story_id)
+            self._hashes[story_id] = value
+            for block, table in enumerate(self._tables):
+                table.setdefault((value >> (block * BLOCK_BITS)) & BLOCK_MASK, set()).add(story_id)
+
+    def remove(self, story_id: int) -> None:
+        with self._lock:
+            self._remove(story_id)
+
+    def _remove(self, story_id: int) -> None:
+        value = self._hashes.pop(story_id, None)
+        if value is None:
+            return
+        for block, table in enumerate(self._tables):
+            key = (value >> (block * BLOCK_BITS)) & BLOCK_MASK
+            bucket = table[key]
+            bucket.discard(story_id)
+            if not bucket:
+                del table[key]
+
+    def find(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """(story_id, distance) of every hash within max_distance, closest first"""
+        radius = max_distance // BLOCKS
+        masks = _probe_masks(radius)
+        candidates: Set[int] = set()
+        # add() and remove() change the buckets from other threads, so they are read under the lock
+        with self._lock:
+            for block, table in enumerate(self._tables):
+                key = (value >> (block * BLOCK_BITS)) & BLOCK_MASK
+                for mask in masks:
+                    bucket = table.get(key ^ mask)
+                    if bucket:
+                        candidates |= bucket
+            stored = [(story_id, self._hashes[story_id]) for story_id in candidates if story_id in self._hashes]
+        matches = []
+        for story_id, stored_value in stored:
+            distance = hamming(value, stored_value)
+            if distance <= max_distance:
+                matches.append((story_id, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+
+class ImageHashes(NamedTuple):
+    character: Optional[int]
+    background: Optional[int]
+
+
+class SceneAsset(NamedTuple):
+    """A stored composed scene that a new generation can point at instead of writing a copy"""
+    story_id: int
+    name: str
+    etag: str
+    size: Optional[int]
+    placeholder: str
+    distance: int
+
+
+class ImageIndex:
+    """Per-kind hash indexes for the images of saved generations"""
+
+    def __init__(self):
+        self.character = HashIndex()
+        self.background = HashIndex()
+        self.combined = HashIndex()
+        # Highest id read by _sync_index; local saves don't move it, since other
+        # workers may still commit lower ids
+        self.synced_id = 0
+        self.scenes_reused = 0
+
+    def add(self, story_id: int, character: Optional[int], background: Optional[int],
+            combined: Optional[int]) -> None:
+        for index, value in ((self.character, character), (self.background, background), (self.combined, combined)):
+            if value is not None:
+                index.add(story_id, value)
+
+    def remove(self, story_id: int) -> None:
+        for index in (self.character, self.background, self.combined):
+            index.remove(story_id)
+
+    def find_pair(self, hashes: ImageHashes, max_distance: int) -> List[Tuple[int, int]]:
+        """Stories with a scene whose character and background both match; (story_id, summed distance)"""
+        if hashes.character is None or hashes.background is None:
+            return []
+        backgrounds = dict(self.background.find(hashes.background, max_distance))
+        matches = [
+            (story_id, distance + backgrounds[story_id])
+            for story_id, distance in self.character.find(hashes.character, max_distance)
+            if story_id in backgrounds and story_id in self.combined
+        ]
+        matches.sort(key=lambda match: match[1])
+        return matches
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            'characters': len(self.character),
+            'backgrounds': len(self.background),
+            'scenes': len(self.combined),
+            'scenes_reused': self.scenes_reused,
+        }
+
+
+_index: Optional[ImageIndex] = None
+_index_lock = threading.Lock()
+_last_sync: Optional[float] = None
+
+
+def _sync_index(index: ImageIndex) -> None:
+    """Pull hashes saved by other workers since the last sync"""
+    from .models import StoryGeneration
+
+    rows = (
+        StoryGeneration.objects
+        .filter(pk__gt=index.synced_id - SYNC_OVERLAP)
+        .order_by('pk')
+        .values_list('pk', 'character_image_hash', 'background_image_hash', 'combined_image_hash')
+        .iterator(chunk_size=2000)
+    )
+    for story_id, character, background, combined in rows:
+        # Re-adding an indexed story replaces its hashes with the same values
+        index.add(story_id, to_unsigned(character), to_unsigned(background), to_unsigned(combined))
+        index.synced_id = max(index.synced_id, story_id)
+
+
+def get_image_index() -> ImageIndex:
+    """Process-wide index, built lazily and topped up every IMAGE_HASH_SYNC_INTERVAL seconds"""
+    global _index, _last_sync
+    now = time.monotonic()
+
+    def stale():
+        return _last_sync is None or now - _last_sync > settings.IMAGE_HASH_SYNC_INTERVAL
+
+    if stale():
+        with _index_lock:
+            if _index is None:
+                _index = ImageIndex()
+            if stale():
+                _sync_index(_index)
+                _last_sync = now
+    return _index
+
+
+def index_generation_images(generation) -> None:
+    if _index is not None:
+        _index.add(
+            generation.pk,
+            to_unsigned(generation.character_image_hash),
+            to_unsigned(generation.background_image_hash),
+            to_unsigned(generation.combined_image_hash),
+        )
+
+
+def unindex_generation_images(story_id: int) -> None:
+    if _index is not None:
+        _index.remove(story_id)
+
+
+def image_index_metrics() -> Optional[Dict[str, int]]:
+    """Counters of this process's index, None until it has been built"""
+    return _index.metrics() if _index is not None else None
+
+
+def _scene_asset(matches: List[Tuple[int, int]]) -> Optional[SceneAsset]:
+    from .models import StoryGeneration
+
+    for story_id, distance in matches[:4]:
+        row = (
+            StoryGeneration.objects.filter(pk=story_id).exclude(combined_image='')
+            .values_list('combined_image', 'combined_image_etag', 'combined_image_size', 'combined_image_placeholder')
+            .first()
+        )
+        if row:
+            get_image_index().scenes_reused += 1
+            return SceneAsset(story_id, *row, distance)
+    return None
+
+
+def find_scene_for_images(hashes: ImageHashes) -> Optional[SceneAsset]:
+    """Stored scene composed from near-identical character and background images"""
+    return _scene_asset(get_image_index().find_pair(hashes, settings.IMAGE_DEDUPE_DISTANCE))
+
+
+def find_duplicate_scene(scene_hash: int) -> Optional[SceneAsset]:
+    """Stored scene that is itself a near-duplicate of a freshly composed one"""
+    return _scene_asset(get_image_index().combined.find(scene_hash, settings.IMAGE_DEDUPE_SCENE_DISTANCE))
@@ -0,0 +1,311 @@
+"""
+The story generation pipeline: LLM call, response parsing, image fetch,
+scene compositing and saving. Shared by the generate view and the warm
+story pool, so both produce identical StoryGeneration rows.
+"""
+import json
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .compositing import EncodedImage, ImageMerger
+from .image_sources import ImageSource, get_image_source
+from .llm import ProviderRouter, get_router
+from .memprofile import memory_checkpoint
+from .models import StoryGeneration
+from .phash import ImageHashes, SceneAsset, find_duplicate_scene, find_scene_for_images, to_signed
+from .prompts import STORYBOARD_TOKENS_PER_PANEL, LengthTier, build_messages, build_storyboard_messages
+from .storyboard import Panel, render_storyboard
+from .streaming import ImagePrefetcher, stream_completion
+
+logger = logging.getLogger(__name__)
+
+
+class StoryResult(NamedTuple):
+    story: str
+    character: str
+    background: str
+    character_image_url: str
+    background_image_url: str
+    # Composed scene, when both images could be fetched
+    combined_image: Optional[EncodedImage]
+    generation: Optional[StoryGeneration]
+    # Storyboard beats, whose panels make up combined_image; empty for a single scene
+    storyboard: Tuple[Panel, ...] = ()
+
+    @property
+    def combined_image_url(self) -> str:
+        """The scene inlined as a data URI, else the best single image URL"""
+        if self.combined_image:
+            return ImageMerger.to_data_uri(self.combined_image.data)
+        return self.background_image_url or self.character_image_url
+
+
+def elapsed_ms(since: float) -> float:
+    return round((time.perf_counter() - since) * 1000, 1)
+
+
+def strip_emphasis(text: str) -> str:
+    return text.replace("**", "").replace("*", "")
+
+
+def strip_markdown_fences(text: str) -> str:
+    """Enhanced markdown fence removal with JSON extraction."""
+    text = text.strip()
+
+    # Remove various markdown code blocks
+    if text.startswith("```json"):
+        text = text[7:].lstrip()  # len("```json") = 7
+    elif text.startswith("```"):
+        text = text[3:].lstrip()  # len("```") = 3
+
+    if text.endswith("```"):
+        text = text[:-3].rstrip()
+
+    # Remove any remaining markdown formatting
+    text = strip_emphasis(text)
+
+    # Extract JSON object if present
+    start_idx = text.find('{')
+    end_idx = text.rfind('}') + 1
+    if start_idx != -1 and end_idx > start_idx:
+        return text[start_idx:end_idx]
+
+    return text
+
+
+def parse_story_response(ai_text: str, user_prompt: str):
+    """(story, character, background) from the LLM text, with fallbacks for missing or non-JSON output"""
+    clean_text = strip_markdown_fences(ai_text)
+    try:
+        result_json = json.loads(clean_text)
+    except json.JSONDecodeError as json_error:
+        logger.warning("JSON parsing failed, using the raw text as the story: %s", json_error)
+        return (
+            clean_text,
+            f"A character from this story about {user_prompt}",
+            f"The setting of this story about {user_prompt}",
+        )
+    return (
+        result_json.get('story', '') or clean_text,
+        result_json.get('character', '') or f"A character from the story: {user_prompt}",
+        result_json.get('background', '') or f"The setting for the story: {user_prompt}",
+    )
+
+
+def parse_storyboard_response(ai_text: str, user_prompt: str, panels: int) -> Tuple[str, str, List[Panel]]:
+    """(story, character, panels) from the LLM text; missing beats are cut from the story's paragraphs"""
+    clean_text = strip_markdown_fences(ai_text)
+    try:
+        result_json = json.loads(clean_text)
+    except json.JSONDecodeError as json_error:
+        logger.warning("JSON parsing failed, using the raw text as the story: %s", json_error)
+        result_json = {}
+    if not isinstance(result_json, dict):
+        result_json = {}
+    story = result_json.get('story', '') or clean_text
+    character = result_json.get('character', '') or f"A character from the story: {user_prompt}"
+    setting = result_json.get('background', '') or f"The setting for the story: {user_prompt}"
+
+    beats = []
+    for entry in result_json.get('panels') or []:
+        if isinstance(entry, dict):
+            beat, background = str(entry.get('beat', '')), str(entry.get('background', ''))
+        else:
+            beat, background = str(entry), ''
+        if beat.strip():
+            beats.append(Panel(beat.strip(), background.strip() or setting))
+    if len(beats) < panels:
+        paragraphs = [p.strip() for p in story.split('\n\n') if p.strip()] or [story]
+        for i in range(len(beats), panels):
+            beats.append(Panel(paragraphs[i % len(paragraphs)], setting))
+    return story, character, beats[:panels]
+
+
+def get_image_url(description, source_name: Optional[str] = None):
+    """Image URL for a description from the configured image source"""
+    if not description.strip():
+        return ""
+    return get_image_source(source_name).url(description)
+
+
+def save_generation(user_prompt, story_text, character_desc, background_desc,
+                    character_image_url, background_image_url, combined_image: Optional[EncodedImage] = None,
+                    pool_theme: Optional[str] = None, hashes: ImageHashes = ImageHashes(None, None),
+                    shared_scene: Optional[SceneAsset] = None,
+                    storyboard: Tuple[Panel, ...] = (),
+                    placeholders: Tuple[str, str] = ('', ''),
+                    length: str = '', image_source: str = '') -> Optional[StoryGeneration]:
+    """
+    Persist a finished generation so it can be shared by permalink. With a
+    shared_scene the record points at that existing file instead of writing
+    `combined_image`. `placeholders` are the character and background thumbnails;
+    `length` and `image_source` name the tier and source it was generated with.
+    """
+    try:
+        generation = StoryGeneration(
+            user_prompt=user_prompt,
+            story=story_text,
+            character_description=character_desc,
+            background_description=background_desc,
+            character_image_url=character_image_url,
+            background_image_url=background_image_url,
+            pool_theme=pool_theme,
+            character_image_hash=to_signed(hashes.character),
+            background_image_hash=to_signed(hashes.background),
+            storyboard=[panel._asdict() for panel in storyboard],
+            character_image_placeholder=placeholders[0],
+            background_image_placeholder=placeholders[1],
+            length=length,
+            image_source=image_source,
+        )
+        if shared_scene:
+            generation.combined_image.name = shared_scene.name
+            generation.combined_image_etag = shared_scene.etag
+            generation.combined_image_size = shared_scene.size
+            generation.combined_image_placeholder = shared_scene.placeholder
+        elif combined_image:
+            generation.combined_image.save("scene.jpg", ContentFile(combined_image.data), save=False)
+            generation.combined_image_etag = combined_image.etag
+            generation.combined_image_size = len(combined_image)
+            generation.combined_image_hash = to_signed(combined_image.dhash)
+            generation.combined_image_placeholder = combined_image.placeholder
+        generation.save()
+        return generation
+    except Exception:
+        logger.exception("Failed to save story generation")
+        return None
+
+
+def run_pipeline(user_prompt: str, tier: LengthTier, image_source: ImageSource,
+                 router: Optional[ProviderRouter] = None, stages: Optional[Dict[str, float]] = None,
+                 pool_theme: Optional[str] = None, panels: int = 0) -> StoryResult:
+    """
+    Generate, illustrate and save one story, as a storyboard of `panels`
+    scenes when that is 2 or more. Per-stage timings are written into
+    `stages` when given. Raises ProviderError if no LLM provider answers.
+    """
+    stages = {} if stages is None else stages
+    router = router or get_router()
+    if panels > 1:
+        return _run_storyboard(user_prompt, tier, image_source, router, stages, panels)
+
+    messages = build_messages(user_prompt, tier)
+    prefetcher = ImagePrefetcher(image_source)
+    try:
+        stage_start = time.perf_counter()
+        if settings.LLM_STREAM_PIPELINE:
+            # Image fetches start as soon as their descriptions are complete
+            ai_text = stream_completion(router, messages, tier.max_tokens,
+                                        lambda kind, description: prefetcher.start(kind, strip_emphasis(description)))
+        else:
+            ai_text = router.complete(messages, max_tokens=tier.max_tokens)
+        stages['llm_ms'] = elapsed_ms(stage_start)
+        memory_checkpoint(stages, 'llm')
+    except Exception:
+        prefetcher.cancel()
+        raise
+    logger.debug("LLM response: %.200s", ai_text)
+
+    story_text, character_desc, background_desc = parse_story_response(ai_text, user_prompt)
+
+    character_image_url = get_image_url(character_desc, image_source.name) if character_desc else ""
+    background_image_url = get_image_url(background_desc, image_source.name) if background_desc else ""
+
+    # Create combined scene
+    combined_image = None
+    shared_scene = None
+    hashes = ImageHashes(None, None)
+    placeholders = ('', '')
+    if character_image_url and background_image_url:
+        stage_start = time.perf_counter()
+        # Both fetches run at once; with streaming they are usually done already
+        prefetcher.start('character', character_desc)
+        prefetcher.start('background', background_desc)
+        char_img = prefetcher.get('character', character_desc)
+        bg_img = prefetcher.get('background', background_desc)
+        stages['image_fetch_ms'] = elapsed_ms(stage_start)
+        memory_checkpoint(stages, 'image_fetch')
+        hashes = ImageHashes(char_img.hash if char_img else None, bg_img.hash if bg_img else None)
+        placeholders = (char_img.placeholder if char_img else '', bg_img.placeholder if bg_img else '')
+        if char_img and bg_img:
+            if settings.IMAGE_DEDUPE:
+                # Near-identical inputs were composed before: reuse that scene
+                shared_scene = find_scene_for_images(hashes)
+            if shared_scene is None:
+                stage_start = time.perf_counter()
+                combined_image = ImageMerger.compose_scene(char_img.image, bg_img.image, prepared=True)
+                stages['compose_ms'] = elapsed_ms(stage_start)
+                memory_checkpoint(stages, 'compose')
+                if settings.IMAGE_DEDUPE and combined_image and combined_image.dhash is not None:
+                    shared_scene = find_duplicate_scene(combined_image.dhash)
+            if shared_scene:
+                # The stored file is served from now on; drop the fresh copy
+                combined_image = None
+                stages['scene_reused_from'] = shared_scene.story_id
+        else:
+            logger.warning("Failed to download one or both images")
+
+    stage_start = time.perf_counter()
+    generation = save_generation(
+        user_prompt, story_text, character_desc, background_desc,
+        character_image_url, background_image_url, combined_image,
+        pool_theme=pool_theme, hashes=hashes, shared_scene=shared_scene, placeholders=placeholders,
+        length=tier.name, image_source=image_source.name,
+    )
+    stages['save_ms'] = elapsed_ms(stage_start)
+    memory_checkpoint(stages, 'save')
+
+    return StoryResult(
+        story_text, character_desc, background_desc,
+        character_image_url, background_image_url, combined_image, generation,
+    )
+
+
+def _run_storyboard(user_prompt: str, tier: LengthTier, image_source: ImageSource,
+                    router: ProviderRouter, stages: Dict[str, float], panels: int) -> StoryResult:
+    stage_start = time.perf_counter()
+    ai_text = router.complete(
+        build_storyboard_messages(user_prompt, tier, panels),
+        max_tokens=tier.max_tokens + STORYBOARD_TOKENS_PER_PANEL * panels,
+    )
+    stages['llm_ms'] = elapsed_ms(stage_start)
+    memory_checkpoint(stages, 'llm')
+    logger.debug("LLM response: %.200s", ai_text)
+
+    story_text, character_desc, beats = parse_storyboard_response(ai_text, user_prompt, panels)
+    character_image_url = get_image_url(character_desc, image_source.name)
+    background_image_url = get_image_url(beats[0].background, image_source.name)
+
+    stage_start = time.perf_counter()
+    board = render_storyboard(image_source, character_desc, beats)
+    sheet = board.sheet
+    stages['storyboard_ms'] = elapsed_ms(stage_start)
+    memory_checkpoint(stages, 'storyboard')
+    stages['panels'] = len(beats)
+
+    shared_scene = None
+    if settings.IMAGE_DEDUPE and sheet and sheet.dhash is not None:
+        shared_scene = find_duplicate_scene(sheet.dhash)
+        if shared_scene:
+            sheet = None
+            stages['scene_reused_from'] = shared_scene.story_id
+
+    stage_start = time.perf_counter()
+    generation = save_generation(
+        user_prompt, story_text, character_desc, beats[0].background,
+        character_image_url, background_image_url, sheet,
+        hashes=ImageHashes(board.character_hash, None), shared_scene=shared_scene, storyboard=tuple(beats),
+        placeholders=(board.character_placeholder, board.background_placeholder),
+        length=tier.name, image_source=image_source.name,
+    )
+    stages['save_ms'] = elapsed_ms(stage_start)
+    memory_checkpoint(stages, 'save')
+
+    return StoryResult(
+        story_text, character_desc, beats[0].background,
+        character_image_url, background_image_url, sheet, generation, tuple(beats),
+    )
@@ -0,0 +1,283 @@
+"""
+Warm story pool.
+
+Traffic clusters around a few themes, so complete stories (text, images and
+composed scene) for those themes are generated ahead of time, off-peak, and
+stored as ordinary StoryGeneration rows tagged with `pool_theme`. A request
+whose prompt matches a theme claims one unserved row with a single
+conditional UPDATE and is answered without calling any upstream.
+
+Themes are the seeded STORY_POOL_THEMES plus the prompts most often requested
+recently. `refill_pool` tops every theme up to STORY_POOL_SIZE; the
+`refill_story_pool` management command runs it once or on a schedule, and a
+claim that leaves a theme below STORY_POOL_LOW_WATER starts the same refill in
+a background thread. Unserved rows stay out of listings, search and prompt
+reuse (`StoryGeneration.objects.served()`).
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .db import job_lock
+from .image_sources import get_image_source
+from .llm import ProviderError, get_router
+from .models import StoryGeneration
+from .pipeline import run_pipeline
+from .prompts import get_tier
+from .similarity import jaccard, normalize_prompt, shingles
+
+logger = logging.getLogger(__name__)
+
+# Seconds the set of themes with unserved stories is memoized per process
+THEME_CACHE_SECONDS = 10
+# Unserved rows tried per claim before giving up to concurrent claimers
+CLAIM_ATTEMPTS = 3
+REFILL_LOCK_KEY = 'mainapp:story-pool-refill'
+# Longest theme key pool_theme can store; longer prompts are never pooled
+MAX_THEME_LENGTH = StoryGeneration._meta.get_field('pool_theme').max_length
+
+_themes: Dict[str, Set[str]] = {}
+_themes_loaded: Optional[float] = None
+_themes_lock = threading.Lock()
+
+
+def _available_themes() -> Dict[str, Set[str]]:
+    """Shingles of every theme that currently has unserved stories"""
+    global _themes, _themes_loaded
+    now = time.monotonic()
+    if _themes_loaded is None or now - _themes_loaded > THEME_CACHE_SECONDS:
+        with _themes_lock:
+            if _themes_loaded is None or now - _themes_loaded > THEME_CACHE_SECONDS:
+                keys = (
+                    StoryGeneration.objects
+                    .filter(pool_theme__isnull=False, pool_claimed_at__isnull=True)
+                    .values_list('pool_theme', flat=True)
+                    .distinct()
+                )
+                _themes = {key: shingles(key) for key in keys}
+                _themes_loaded = now
+    return _themes
+
+
+def _forget_theme(key: str) -> None:
+    """Drop a drained theme until the next reload (copy-on-write: lookups iterate unlocked)"""
+    global _themes
+    with _themes_lock:
+        _themes = {theme: value for theme, value in _themes.items() if theme != key}
+
+
+def match_theme(prompt: str) -> Optional[Tuple[str, float]]:
+    """(theme, similarity) of the closest theme with unserved stories, if close enough"""
+    normalized = normalize_prompt(prompt)
+    if not normalized:
+        return None
+    themes = _available_themes()
+    if normalized in themes:
+        return normalized, 1.0
+    query = shingles(normalized)
+    best = max(((key, jaccard(query, theme)) for key, theme in themes.items()), key=lambda m: m[1], default=None)
+    if best and best[1] >= settings.STORY_POOL_MATCH_THRESHOLD:
+        return best
+    return None
+
+
+def claim_pooled_story(prompt: str) -> Optional[StoryGeneration]:
+    """Hand out one unserved pool story matching the prompt; each is served at most once"""
+    match = match_theme(prompt)
+    if not match:
+        return None
+    theme = match[0]
+    candidates = list(StoryGeneration.objects.pooled(theme).order_by('pk').values_list('pk', flat=True)[:CLAIM_ATTEMPTS])
+    for story_id in candidates:
+        # Only one concurrent request can flip a row from unclaimed to claimed
+        claimed = StoryGeneration.objects.filter(pk=story_id, pool_claimed_at__isnull=True).update(
+            pool_claimed_at=timezone.now(),
+        )
+        if claimed:
+            if len(candidates) == 1:
+                _forget_theme(theme)
+            _check_low_water(theme)
+            return StoryGeneration.objects.for_detail().filter(pk=story_id).first()
+    _forget_theme(theme)
+    _check_low_water(theme)
+    return None
+
+
+def _check_low_water(theme: str) -> None:
+    """Refill in the background once claims leave a theme with fewer than STORY_POOL_LOW_WATER stories"""
+    if settings.STORY_POOL_LOW_WATER <= 0:
+        return
+    if StoryGeneration.objects.pooled(theme).count() < settings.STORY_POOL_LOW_WATER:
+        start_background_refill()
+
+
+_refill_thread: Optional[threading.Thread] = None
+_refill_thread_lock = threading.Lock()
+
+
+def start_background_refill() -> bool:
+    """
+    Run `refill_pool` in a daemon thread unless this process already has one
+    running; the refill lock still keeps it to one refill across processes.
+    Returns whether a thread was started.
+    """
+    global _refill_thread
+    with _refill_thread_lock:
+        if _refill_thread is not None and _refill_thread.is_alive():
+            return False
+        _refill_thread = threading.Thread(target=_background_refill, name='story-pool-refill', daemon=True)
+        _refill_thread.start()
+    return True
+
+
+def _background_refill() -> None:
+    try:
+        generated = refill_pool()
+        logger.info("Story pool low-water refill generated %d stories", generated,
+                    extra={'event': 'story_pool_low_water'})
+    except Exception:
+        logger.exception("Story pool refill failed")
+    finally:
+        close_old_connections()
+
+
+def seeded_themes() -> List[str]:
+    return [prompt for prompt in settings.STORY_POOL_THEMES if normalize_prompt(prompt)]
+
+
+def trending_themes() -> List[str]:
+    """Prompts requested most often on demand over the last STORY_POOL_TRENDING_DAYS"""
+    if not settings.STORY_POOL_TRENDING:
+        return []
+    since = timezone.now() - timedelta(days=settings.STORY_POOL_TRENDING_DAYS)
+    prompts = (
+        StoryGeneration.objects
+        .filter(created_at__gte=since, pool_theme__isnull=True)
+        .order_by('-pk')
+        .values_list('user_prompt', flat=True)[:settings.STORY_POOL_TRENDING_WINDOW]
+    )
+    counts: Counter = Counter()
+    latest: Dict[str, str] = {}
+    for prompt in prompts:
+        key = normalize_prompt(prompt)
+        if key and len(key) <= MAX_THEME_LENGTH:
+            counts[key] += 1
+            latest.setdefault(key, prompt)
+    return [
+        latest[key] for key, count in counts.most_common(settings.STORY_POOL_TRENDING)
+        if count >= settings.STORY_POOL_TRENDING_MIN_COUNT
+    ]
+
+
+def pool_themes() -> Dict[str, str]:
+    """Theme key -> prompt to generate with, seeded themes first"""
+    themes: Dict[str, str] = {}
+    for prompt in seeded_themes() + trending_themes():
+        key = normalize_prompt(prompt)
+        if len(key) > MAX_THEME_LENGTH:
+            logger.warning("Theme %.40r... is too long to pool, skipped", prompt)
+            continue
+        themes.setdefault(key, prompt)
+    return themes
+
+
+def refill_pool(limit: Optional[int] = None) -> int:
+    """
+    Top every theme up to STORY_POOL_SIZE unserved stories, generating at
+    most `limit` (all that are missing by default). Returns how many were
+    generated. Only one process on any instance refills at a time.
+    """
+    lock_timeout = max(60, settings.STORY_POOL_REFILL_INTERVAL)
+    with job_lock(REFILL_LOCK_KEY, lock_timeout) as lease:
+        if lease is None:
+            logger.info("Story pool refill already running elsewhere")
+            return 0
+        return _refill(lease, limit)
+
+
+def _refill(lease, limit: Optional[int]) -> int:
+    generated = 0
+    try:
+        router = get_router()
+        if not router.has_configured_provider():
+            logger.warning("Story pool refill skipped: no LLM provider configured")
+            return 0
+        tier = get_tier(settings.STORY_POOL_LENGTH)
+        image_source = get_image_source()
+        for key, prompt in pool_themes().items():
+            missing = settings.STORY_POOL_SIZE - StoryGeneration.objects.pooled(key).count()
+            for _ in range(max(0, missing)):
+                if limit is not None and generated >= limit:
+                    return generated
+                stages = {}
+                result = run_pipeline(prompt, tier, image_source, router=router, stages=stages, pool_theme=key)
+                if result.generation is None:
+                    break
+                generated += 1
+                logger.info("Pooled story generated", extra={
+                    'event': 'story_pool_generated', 'story_id': result.generation.pk, 'theme': key, **stages,
+                })
+                lease.renew()
+    except ProviderError as e:
+        logger.error("Story pool refill stopped: %s", e, extra={'provider': e.provider, 'status_code': e.status_code})
+    return generated
+
+
+def parse_hours(spec: str) -> Optional[Set[int]]:
+    """
+    Local hours from a spec such as "1-6" or "22-5,13" (ranges are end-exclusive
+    and may wrap midnight). An empty spec means any hour, returned as None.
+    """
+    if not spec.strip():
+        return None
+    hours: Set[int] = set()
+    for part in spec.split(','):
+        start, _, end = part.strip().partition('-')
+        start_hour = int(start) % 24
+        if not end:
+            hours.add(start_hour)
+            continue
+        end_hour = int(end) % 24
+        hour = start_hour
+        while True:
+            hours.add(hour)
+            hour = (hour + 1) % 24
+            if hour == end_hour:
+                break
+    return hours
+
+
+def is_off_peak(now=None, spec: Optional[str] = None) -> bool:
+    """Whether `now` falls in the hours `spec` (default STORY_POOL_OFF_PEAK_HOURS)"""
+    hours = parse_hours(settings.STORY_POOL_OFF_PEAK_HOURS if spec is None else spec)
+    return hours is None or timezone.localtime(now).hour in hours
+
+
+class PoolScheduler(threading.Thread):
+    """Refills the pool every STORY_POOL_REFILL_INTERVAL seconds while off-peak"""
+
+    def __init__(self, interval: Optional[float] = None):
+        super().__init__(name='story-pool-scheduler', daemon=True)
+        self.interval = interval or settings.STORY_POOL_REFILL_INTERVAL
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if is_off_peak():
+                try:
+                    refill_pool()
+                except Exception:
+                    logger.exception("Story pool refill failed")
+                finally:
+                    close_old_connections()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,127 @@
+"""
+Prompt building for the story LLM call.
+
+Message text is assembled from constants built once at import, the user's
+prompt is clipped to a token budget, and each story length tier carries its
+own length instruction and max_tokens so response size (and latency) is
+predictable.
+"""
+import re
+from typing import Dict, List, NamedTuple
+
+from django.conf import settings
+
+SYSTEM_MESSAGE = (
+    "You are a creative storytelling assistant. "
+    "Respond only with valid JSON containing character, background, and story fields."
+)
+
+# Descriptions first: the pipeline starts fetching images while the story streams in
+_JSON_INSTRUCTIONS = (
+    "\n\nRespond with this exact JSON format, fields in this order:\n"
+    '{"character": "detailed character description", "background": "detailed scene description", '
+    '"story": "your story here"}'
+)
+
+_LENGTH_INSTRUCTIONS = {
+    'short': "Keep the story to one or two short paragraphs.",
+    'medium': "Write two or three paragraphs.",
+    'long': "Write four or five rich paragraphs.",
+}
+
+_STORYBOARD_INSTRUCTIONS = (
+    "\nAlso split the story into exactly {panels} scene beats for a storyboard. "
+    "The character appears in every panel; give each beat its own setting, "
+    "repeating a setting word for word when the scene returns to it."
+    "\n\nRespond with this exact JSON format:\n"
+    '{{"story": "your story here", "character": "detailed character description", '
+    '"panels": [{{"beat": "what happens in this panel", "background": "detailed scene description"}}]}}'
+)
+# Extra response tokens allowed per storyboard panel
+STORYBOARD_TOKENS_PER_PANEL = 80
+
+_SYSTEM_MESSAGE_DICT = {"role": "system", "content": SYSTEM_MESSAGE}
+
+# Rough chars-per-token ratio for English BPE vocabularies
+_CHARS_PER_TOKEN = 4
+_WHITESPACE = re.compile(r"\s+")
+
+
+class LengthTier(NamedTuple):
+    name: str
+    max_tokens: int
+    max_prompt_tokens: int
+    instruction: str
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast token estimate (no tokenizer): about one token per four characters,
+    but never fewer than one per word so short, wordy prompts aren't undercounted.
+    """
+    if not text:
+        return 0
+    return max((len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN, text.count(" ") + 1)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Clip text to roughly max_tokens, cutting at a word boundary"""
+    text = _WHITESPACE.sub(" ", text).strip()
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text[:max_tokens * _CHARS_PER_TOKEN]
+    words = clipped.split(" ")
+    if len(words) > max_tokens:
+        words = words[:max_tokens]
+    elif len(words) > 1 and not text[len(clipped):len(clipped) + 1].isspace():
+        words = words[:-1]  # drop the partial last word
+    return " ".join(words)
+
+
+def _build_tiers() -> Dict[str, LengthTier]:
+    return {
+        name: LengthTier(
+            name=name,
+            max_tokens=config['max_tokens'],
+            max_prompt_tokens=config['max_prompt_tokens'],
+            instruction=_LENGTH_INSTRUCTIONS.get(name, ""),
+        )
+        for name, config in settings.STORY_LENGTH_TIERS.items()
+    }
+
+
+_tiers: Dict[str, LengthTier] = {}
+
+
+def get_tier(name: str) -> LengthTier:
+    """Tier by name, falling back to STORY_DEFAULT_LENGTH for unknown names"""
+    if not _tiers:
+        _tiers.update(_build_tiers())
+    return _tiers.get(name) or _tiers[settings.STORY_DEFAULT_LENGTH]
+
+
+def build_messages(user_prompt: str, tier: LengthTier) -> List[dict]:
+    """Chat messages for a story request, with the user prompt clipped to the tier budget"""
+    prompt = truncate_to_tokens(user_prompt, tier.max_prompt_tokens)
+    return [
+        _SYSTEM_MESSAGE_DICT,
+        {
+            "role": "user",
+            "content": "Write a creative story about: " + prompt + "\n" + tier.instruction + _JSON_INSTRUCTIONS,
+        },
+    ]
+
+
+def build_storyboard_messages(user_prompt: str, tier: LengthTier, panels: int) -> List[dict]:
+    """Chat messages asking for a story split into `panels` beats, each with its own setting"""
+    prompt = truncate_to_tokens(user_prompt, tier.max_prompt_tokens)
+    return [
+        _SYSTEM_MESSAGE_DICT,
+        {
+            "role": "user",
+            "content": (
+                "Write a creative story about: " + prompt + "\n" + tier.instruction
+                + _STORYBOARD_INSTRUCTIONS.format(panels=panels)
+            ),
+        },
+    ]
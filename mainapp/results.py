@@ -0,0 +1,280 @@
+"""
+Compact per-process cache of generation results.
+
+A result rendered as a template context is a dict of full Python strings,
+and a freshly composed scene inlined as a base64 data URI is a third larger
+than the JPEG itself. Cached results are instead kept as `CachedResult`
+records: the text fields packed into one compressed blob (zstd when the
+zstandard package is installed, zlib otherwise), the composed scene as raw
+JPEG bytes (an EncodedImage, served as-is by mainapp/media.py). The cache is an LRU bounded by bytes, STORY_RESULT_CACHE_BYTES,
+rather than by entry count. Scene bytes are a hundred times the size of the
+text, so they get their own budget, STORY_RESULT_CACHE_IMAGE_BYTES: past it,
+the least recently used records drop their image (still on disk) but keep
+their text, and the cache holds many more results than it could with images.
+
+Records are immutable; saving or deleting a generation drops it from this
+process's cache, and entries expire after STORY_RESULT_CACHE_TIMEOUT so
+changes made by other workers are picked up.
+"""
+import json
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from .compositing import EncodedImage
+from .models import StoryGeneration
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is slower and compresses less
+    zstandard = None
+
+# Result page context, in the order packed into a record; storyboard is packed as JSON
+TEXT_FIELDS = (
+    'prompt', 'story', 'character', 'background',
+    'character_image_url', 'background_image_url', 'combined_image_url', 'permalink', 'storyboard',
+    'character_placeholder', 'background_placeholder', 'scene_placeholder',
+)
+# Where the stored scene lives and its validators, packed after the context
+SCENE_FIELDS = ('scene_name', 'scene_etag', 'scene_size')
+FIELDS = TEXT_FIELDS + SCENE_FIELDS
+# Bytes charged per entry for the cache's own bookkeeping (OrderedDict node, key)
+ENTRY_OVERHEAD = 120
+
+
+# zstd (de)compressor contexts are reusable but not thread-safe: one pair per thread
+_codecs = threading.local()
+
+
+def compress(data: bytes) -> bytes:
+    if zstandard is None:
+        return zlib.compress(data, 6)
+    compressor = getattr(_codecs, 'compressor', None)
+    if compressor is None:
+        compressor = _codecs.compressor = zstandard.ZstdCompressor(level=3)
+    # The returned object keeps its worst-case-sized allocation; copy it down to size
+    return bytes(memoryview(compressor.compress(data)))
+
+
+def decompress(data: bytes) -> bytes:
+    if zstandard is None:
+        return zlib.decompress(data)
+    decompressor = getattr(_codecs, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _codecs.decompressor = zstandard.ZstdDecompressor()
+    return decompressor.decompress(data)
+
+
+class CachedResult:
+    """One generation: compressed text fields plus, optionally, the composed scene"""
+
+    __slots__ = ('story_id', 'text', 'image', 'expires')
+
+    def __init__(self, story_id: int, text: bytes, image: Optional[EncodedImage] = None, expires: float = 0.0):
+        self.story_id = story_id
+        self.text = text
+        self.image = image
+        self.expires = expires
+
+    @classmethod
+    def from_context(cls, story_id: int, context: Dict[str, str], image: Optional[EncodedImage] = None) -> 'CachedResult':
+        encoded = [str(context.get(name) or '').encode('utf-8') for name in FIELDS]
+        # Field lengths up front, then the fields back to back
+        header = array('I', map(len, encoded)).tobytes()
+        return cls(story_id, compress(header + b''.join(encoded)), image)
+
+    @classmethod
+    def from_generation(cls, generation: StoryGeneration, image: Optional[EncodedImage] = None) -> 'CachedResult':
+        context = generation_context(generation)
+        if generation.combined_image:
+            context.update({
+                'scene_name': generation.combined_image.name,
+                'scene_etag': generation.combined_image_etag,
+                'scene_size': generation.combined_image_size,
+            })
+        return cls.from_context(generation.pk, context, image)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the record"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.text) + ENTRY_OVERHEAD
+        if self.image is not None:
+            size += sys.getsizeof(self.image) + sys.getsizeof(self.image.data)
+        return size
+
+    def fields(self) -> Dict[str, str]:
+        data = memoryview(decompress(self.text))
+        lengths = array('I')
+        lengths.frombytes(data[:lengths.itemsize * len(FIELDS)])
+        fields, offset = {}, lengths.itemsize * len(FIELDS)
+        for name, length in zip(FIELDS, lengths):
+            fields[name] = str(data[offset:offset + length], 'utf-8')
+            offset += length
+        return fields
+
+    def context(self) -> Dict[str, Any]:
+        """Template context for the result page"""
+        fields = self.fields()
+        for name in SCENE_FIELDS:
+            del fields[name]
+        fields['storyboard'] = json.loads(fields['storyboard']) if fields['storyboard'] else []
+        return fields
+
+
+def generation_context(generation: StoryGeneration) -> Dict[str, str]:
+    """Result page context for a saved generation"""
+    combined_image_url = generation.get_scene_url()
+    return {
+        'prompt': generation.user_prompt,
+        'story': generation.story,
+        'character': generation.character_description,
+        'background': generation.background_description,
+        'character_image_url': generation.character_image_url,
+        'background_image_url': generation.background_image_url,
+        'combined_image_url': combined_image_url or generation.background_image_url or generation.character_image_url,
+        'permalink': generation.get_absolute_url(),
+        'storyboard': json.dumps(generation.storyboard) if generation.storyboard else '',
+        'character_placeholder': generation.character_image_placeholder,
+        'background_placeholder': generation.background_image_placeholder,
+        'scene_placeholder': generation.combined_image_placeholder,
+    }
+
+
+class ResultCache:
+    """Thread-safe LRU of CachedResult records, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int, timeout: float, max_image_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_image_bytes = max_bytes if max_image_bytes is None else max_image_bytes
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[int, CachedResult]' = OrderedDict()
+        # Ids of records holding an image, least recently used first
+        self._with_images: 'OrderedDict[int, None]' = OrderedDict()
+        self.nbytes = 0
+        self.image_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, story_id: int) -> Optional[CachedResult]:
+        with self._lock:
+            record = self._entries.get(story_id)
+            if record is None or record.expires < time.monotonic():
+                if record is not None:
+                    self._pop(story_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(story_id)
+            if record.image is not None:
+                self._with_images.move_to_end(story_id)
+            self.hits += 1
+            return record
+
+    def set(self, record: CachedResult) -> None:
+        size = record.nbytes
+        if size > self.max_bytes:
+            return
+        record.expires = time.monotonic() + self.timeout
+        with self._lock:
+            self._pop(record.story_id)
+            self._entries[record.story_id] = record
+            self.nbytes += size
+            if record.image is not None:
+                self._with_images[record.story_id] = None
+                self.image_bytes += len(record.image)
+            while self.image_bytes > self.max_image_bytes:
+                self._drop_image(next(iter(self._with_images)))
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def discard(self, story_id: int) -> None:
+        with self._lock:
+            self._pop(story_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._with_images.clear()
+            self.nbytes = self.image_bytes = 0
+
+    def _pop(self, story_id: int) -> None:
+        record = self._entries.pop(story_id, None)
+        if record is not None:
+            self.nbytes -= record.nbytes
+            if record.image is not None:
+                del self._with_images[story_id]
+                self.image_bytes -= len(record.image)
+
+    def _drop_image(self, story_id: int) -> None:
+        """Replace a record with its text-only copy, keeping its place in the LRU order"""
+        record = self._entries[story_id]
+        slim = CachedResult(record.story_id, record.text, None, record.expires)
+        self._entries[story_id] = slim
+        del self._with_images[story_id]
+        self.image_bytes -= len(record.image)
+        self.nbytes += slim.nbytes - record.nbytes
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'images': len(self._with_images),
+                'image_bytes': self.image_bytes,
+                'max_image_bytes': self.max_image_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(
+                    settings.STORY_RESULT_CACHE_BYTES,
+                    settings.STORY_RESULT_CACHE_TIMEOUT,
+                    settings.STORY_RESULT_CACHE_IMAGE_BYTES,
+                )
+    return _cache
+
+
+def cache_result(generation: StoryGeneration, image: Optional[EncodedImage] = None) -> CachedResult:
+    record = CachedResult.from_generation(generation, image)
+    get_result_cache().set(record)
+    return record
+
+
+def get_result(story_id: int, generation: Optional[StoryGeneration] = None) -> Optional[CachedResult]:
+    """Cached result for a story, loaded from `generation` or the database on a miss"""
+    record = get_result_cache().get(story_id)
+    if record is not None:
+        return record
+    if generation is None:
+        generation = StoryGeneration.objects.for_detail().filter(pk=story_id).first()
+        if generation is None:
+            return None
+    return cache_result(generation)
+
+
+def discard_result(story_id: int) -> None:
+    if _cache is not None:
+        _cache.discard(story_id)
@@ -0,0 +1,356 @@
+"""
+Retention for saved stories and their scene files.
+
+Policies, each off when its setting is 0:
+
+- Age: stories created more than RETENTION_MAX_AGE_DAYS ago and not viewed
+  in that time are deleted, except those viewed at least
+  RETENTION_KEEP_ACCESS_COUNT times.
+- Compaction: scenes older than RETENTION_COMPACT_AFTER_DAYS are
+  re-encoded as WebP at RETENTION_COMPACT_QUALITY, downsampled to at most
+  RETENTION_COMPACT_MAX_WIDTH pixels wide.
+- Size: while the scene files add up to more than RETENTION_MAX_MEDIA_MB,
+  the least viewed, then oldest, stories are deleted.
+
+Finally an orphan sweep lists MEDIA_ROOT/combined/ incrementally and
+deletes files no row refers to. Files younger than RETENTION_ORPHAN_GRACE
+are left alone: a scene is written just before its row is inserted.
+
+Rows are deleted RETENTION_BATCH_SIZE at a time, each batch in its own
+short transaction, with RETENTION_BATCH_PAUSE seconds between batches, so
+the job never holds long locks or saturates the database and disk. A scene
+shared by several stories (see mainapp/phash.py) is only deleted once no
+row refers to it. A scene replaced by compaction is left for a later sweep
+with its mtime bumped, since other workers' result caches
+(STORY_RESULT_CACHE_TIMEOUT) may still name it.
+
+run_retention() is run by `manage.py apply_retention`, or with --loop by
+RetentionScheduler in a separate low-priority process, during
+RETENTION_HOURS. A lease row in the database (see mainapp/db.py:job_lock)
+keeps passes to one process across every instance.
+
+View counts are gathered by record_access() in each worker and written out
+by a background thread every STORY_ACCESS_FLUSH_INTERVAL seconds, one
+UPDATE per distinct count, so page views never wait on a database write.
+"""
+import io
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import F, Max, Q, Sum
+from django.utils import timezone
+
+from .caching import invalidate_story_page
+from .compositing import EncodedImage
+from .db import JobLease, job_lock
+from .models import StoryGeneration
+from .pool import is_off_peak
+from .results import discard_result
+from .startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+logger = logging.getLogger(__name__)
+
+SCENE_DIR = 'combined'
+RETENTION_LOCK_KEY = 'mainapp:story-retention'
+
+
+class AccessRecorder(threading.Thread):
+    """Per-process story view counts, written to the database in the background"""
+
+    def __init__(self, interval: float):
+        super().__init__(name='story-access-recorder', daemon=True)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def record(self, story_id: int) -> None:
+        with self._lock:
+            self._counts[story_id] += 1
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to save story view counts")
+            finally:
+                close_old_connections()
+
+    def flush(self) -> None:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        by_count: Dict[int, List[int]] = defaultdict(list)
+        for story_id, count in counts.items():
+            by_count[count].append(story_id)
+        now = timezone.now()
+        for count, story_ids in by_count.items():
+            StoryGeneration.objects.filter(pk__in=story_ids).update(
+                access_count=F('access_count') + count, last_accessed_at=now)
+
+
+_recorder: Optional[AccessRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def record_access(story_id: int) -> None:
+    """Count a view of a story; the thread is started lazily, so after any fork"""
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = AccessRecorder(settings.STORY_ACCESS_FLUSH_INTERVAL)
+                _recorder.start()
+    _recorder.record(story_id)
+
+
+class RetentionReport(dict):
+    """Counters for one retention pass, and the lock lease it renews between batches"""
+
+    def __init__(self, lease: Optional[JobLease] = None):
+        super().__init__(stories_deleted=0, files_deleted=0, bytes_freed=0,
+                         scenes_compacted=0, bytes_saved=0, orphans_deleted=0)
+        self.lease = lease
+
+
+def _pause(report: RetentionReport) -> None:
+    if report.lease:
+        report.lease.renew()
+    if settings.RETENTION_BATCH_PAUSE:
+        time.sleep(settings.RETENTION_BATCH_PAUSE)
+
+
+def _delete_unreferenced(names, report: RetentionReport) -> None:
+    """Delete the scene files among `names` that no remaining row refers to"""
+    names = {name for name in names if name}
+    if not names:
+        return
+    in_use = set(StoryGeneration.objects.filter(combined_image__in=names).values_list('combined_image', flat=True))
+    for name in names - in_use:
+        try:
+            size = default_storage.size(name)
+            default_storage.delete(name)
+        except (FileNotFoundError, OSError):
+            continue
+        report['files_deleted'] += 1
+        report['bytes_freed'] += size
+
+
+def delete_stories(story_ids: List[int], report: RetentionReport) -> None:
+    """Delete stories in batches, then whichever of their scene files became unreferenced"""
+    batch_size = settings.RETENTION_BATCH_SIZE
+    for start in range(0, len(story_ids), batch_size):
+        batch = story_ids[start:start + batch_size]
+        names = set(StoryGeneration.objects.filter(pk__in=batch).values_list('combined_image', flat=True))
+        # The delete signals drop each story from this process's caches and indexes
+        deleted, _ = StoryGeneration.objects.filter(pk__in=batch).delete()
+        report['stories_deleted'] += deleted
+        _delete_unreferenced(names, report)
+        _pause(report)
+
+
+def expire_old_stories(report: RetentionReport) -> None:
+    cutoff = timezone.now() - timedelta(days=settings.RETENTION_MAX_AGE_DAYS)
+    expired = StoryGeneration.objects.filter(created_at__lt=cutoff).filter(
+        Q(last_accessed_at__isnull=True) | Q(last_accessed_at__lt=cutoff))
+    if settings.RETENTION_KEEP_ACCESS_COUNT:
+        expired = expired.filter(access_count__lt=settings.RETENTION_KEEP_ACCESS_COUNT)
+    while True:
+        # Deleted rows drop out of the query, so the first batch is always the next one
+        story_ids = list(expired.order_by('id').values_list('id', flat=True)[:settings.RETENTION_BATCH_SIZE])
+        if not story_ids:
+            return
+        delete_stories(story_ids, report)
+
+
+def media_bytes() -> int:
+    """Bytes of scene files, each shared file counted once"""
+    files = (
+        StoryGeneration.objects.exclude(combined_image='')
+        .values('combined_image')
+        .annotate(file_size=Max('combined_image_size'))
+    )
+    return files.aggregate(total=Sum('file_size'))['total'] or 0
+
+
+def enforce_media_limit(report: RetentionReport) -> None:
+    limit = settings.RETENTION_MAX_MEDIA_MB * 1024 * 1024
+    excess = media_bytes() - limit
+    if excess <= 0:
+        return
+    # Least viewed, then oldest, stories until their files cover the excess
+    candidates = (
+        StoryGeneration.objects.exclude(combined_image='')
+        .order_by('access_count', 'created_at', 'id')
+        .values_list('id', 'combined_image', 'combined_image_size')
+        .iterator(chunk_size=settings.RETENTION_BATCH_SIZE)
+    )
+    story_ids, seen, covered = [], set(), 0
+    for story_id, name, size in candidates:
+        story_ids.append(story_id)
+        if name not in seen:
+            seen.add(name)
+            covered += size or 0
+        if covered >= excess:
+            break
+    logger.info("Scene files are %d bytes over RETENTION_MAX_MEDIA_MB, deleting %d stories", excess, len(story_ids))
+    delete_stories(story_ids, report)
+
+
+def _compact_file(name: str) -> Optional[EncodedImage]:
+    with default_storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        image.load()
+    max_width = settings.RETENTION_COMPACT_MAX_WIDTH
+    if max_width and image.width > max_width:
+        image = image.resize((max_width, round(image.height * max_width / image.width)), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='WEBP', quality=settings.RETENTION_COMPACT_QUALITY, method=4)
+    return EncodedImage(buffer.getvalue(), content_type='image/webp')
+
+
+def _retire_file(name: str) -> None:
+    """Leave a replaced scene to a later orphan sweep, once no cached result can still name it"""
+    try:
+        os.utime(default_storage.path(name))
+    except NotImplementedError:
+        # Remote storage has no mtime to bump, so the sweep's grace can't apply
+        default_storage.delete(name)
+    except OSError:
+        pass
+
+
+def compact_old_scenes(report: RetentionReport) -> None:
+    cutoff = timezone.now() - timedelta(days=settings.RETENTION_COMPACT_AFTER_DAYS)
+    pending = (
+        StoryGeneration.objects.filter(created_at__lt=cutoff)
+        .exclude(combined_image='').exclude(combined_image__endswith='.webp')
+    )
+    last_id = 0
+    while True:
+        rows = list(pending.filter(pk__gt=last_id).order_by('id').values_list('id', 'combined_image')[:settings.RETENTION_BATCH_SIZE])
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        for name in dict.fromkeys(name for _, name in rows):
+            try:
+                old_size = default_storage.size(name)
+                compacted = _compact_file(name)
+            except (FileNotFoundError, OSError):
+                logger.warning("Could not compact scene %s", name)
+                continue
+            new_name = default_storage.save(f"{os.path.splitext(name)[0]}.webp", ContentFile(compacted.data))
+            # Every story sharing the file moves to the new one
+            sharing = list(StoryGeneration.objects.filter(combined_image=name).values_list('id', flat=True))
+            StoryGeneration.objects.filter(pk__in=sharing).update(
+                combined_image=new_name, combined_image_etag=compacted.etag, combined_image_size=len(compacted))
+            for story_id in sharing:
+                discard_result(story_id)
+                invalidate_story_page(story_id)
+            _retire_file(name)
+            report['scenes_compacted'] += 1
+            report['bytes_saved'] += old_size - len(compacted)
+        _pause(report)
+
+
+def _scene_files() -> Iterator[str]:
+    """Storage names under SCENE_DIR, listed incrementally where the storage is local"""
+    try:
+        directory = default_storage.path(SCENE_DIR)
+    except NotImplementedError:
+        for filename in default_storage.listdir(SCENE_DIR)[1]:
+            yield f"{SCENE_DIR}/{filename}"
+        return
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield f"{SCENE_DIR}/{entry.name}"
+    except FileNotFoundError:
+        return
+
+
+def sweep_orphans(report: RetentionReport) -> None:
+    grace_start = timezone.now() - timedelta(seconds=settings.RETENTION_ORPHAN_GRACE)
+    batch: List[str] = []
+
+    def reconcile():
+        in_use = set(StoryGeneration.objects.filter(combined_image__in=batch).values_list('combined_image', flat=True))
+        for name in batch:
+            if name in in_use:
+                continue
+            try:
+                if default_storage.get_modified_time(name) > grace_start:
+                    continue
+                size = default_storage.size(name)
+                default_storage.delete(name)
+            except (FileNotFoundError, OSError):
+                continue
+            report['orphans_deleted'] += 1
+            report['bytes_freed'] += size
+        batch.clear()
+        _pause(report)
+
+    for name in _scene_files():
+        batch.append(name)
+        if len(batch) >= settings.RETENTION_BATCH_SIZE:
+            reconcile()
+    if batch:
+        reconcile()
+
+
+def run_retention() -> Optional[RetentionReport]:
+    """One pass of every enabled policy and the orphan sweep; None if a pass is already running elsewhere"""
+    lock_timeout = max(60, settings.RETENTION_INTERVAL)
+    with job_lock(RETENTION_LOCK_KEY, lock_timeout) as lease:
+        if lease is None:
+            logger.info("Retention pass already running elsewhere")
+            return None
+        report = RetentionReport(lease)
+        started = time.perf_counter()
+        # The sweep goes first, so scenes replaced by compaction wait until the next pass
+        sweep_orphans(report)
+        if settings.RETENTION_MAX_AGE_DAYS:
+            expire_old_stories(report)
+        if settings.RETENTION_COMPACT_AFTER_DAYS:
+            compact_old_scenes(report)
+        if settings.RETENTION_MAX_MEDIA_MB:
+            enforce_media_limit(report)
+    logger.info("Retention pass finished", extra={
+        'event': 'retention_pass', 'total_ms': round((time.perf_counter() - started) * 1000, 1), **report,
+    })
+    return report
+
+
+class RetentionScheduler(threading.Thread):
+    """Runs a retention pass every RETENTION_INTERVAL seconds during RETENTION_HOURS"""
+
+    def __init__(self, interval: Optional[float] = None):
+        super().__init__(name='story-retention-scheduler', daemon=True)
+        self.interval = interval or settings.RETENTION_INTERVAL
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if is_off_peak(spec=settings.RETENTION_HOURS):
+                try:
+                    run_retention()
+                except Exception:
+                    logger.exception("Retention pass failed")
+                finally:
+                    close_old_connections()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,228 @@
+"""
+Full-text search over saved stories.
+
+The index itself lives in the database (see migration 0004): an external-content
+FTS5 table kept in sync by triggers on SQLite, and a generated tsvector column
+with a GIN index on PostgreSQL. Other backends fall back to a plain substring scan.
+Django rebuilds a SQLite table for most schema changes, which drops its
+triggers, so ensure_search_index() puts them back after every migrate.
+
+Relevance scoring a broad query ("dragon") costs time proportional to every
+matching row, so it is bounded by STORY_SEARCH_RANK_WINDOW. On SQLite, queries
+with at most that many matches get exact bm25 ranking; broader ones list
+stories whose prompt matches first, newest first, then the remaining matches.
+On PostgreSQL, ts_rank_cd needs no corpus statistics, so the newest matches in
+the window are ranked. Snippets are built only for the rows returned.
+"""
+import logging
+import re
+from typing import List, Optional, TypedDict
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import StoryGeneration
+
+logger = logging.getLogger(__name__)
+
+# Highlight markers: control characters that do not occur in generated text and pass through HTML escaping
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+# Pool stories not served yet, which searches leave out (see StoryGenerationQuerySet.served)
+_UNSERVED_IDS_SQL = (
+    "SELECT id FROM mainapp_storygeneration WHERE pool_theme IS NOT NULL AND pool_claimed_at IS NULL"
+)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+SQLITE_FTS_TABLE = 'mainapp_story_fts'
+
+# The triggers created by migration 0004, which keeps its own frozen copy of this SQL
+SQLITE_FTS_TRIGGERS = {
+    'mainapp_story_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_ai AFTER INSERT ON mainapp_storygeneration BEGIN
+            INSERT INTO mainapp_story_fts(rowid, user_prompt, story, character_description, background_description)
+            VALUES (new.id, new.user_prompt, new.story, new.character_description, new.background_description);
+        END
+    """,
+    'mainapp_story_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_ad AFTER DELETE ON mainapp_storygeneration BEGIN
+            INSERT INTO mainapp_story_fts(mainapp_story_fts, rowid, user_prompt, story, character_description, background_description)
+            VALUES ('delete', old.id, old.user_prompt, old.story, old.character_description, old.background_description);
+        END
+    """,
+    'mainapp_story_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS mainapp_story_fts_au AFTER UPDATE ON mainapp_storygeneration BEGIN
+            INSERT INTO mainapp_story_fts(mainapp_story_fts, rowid, user_prompt, story, character_description, background_description)
+            VALUES ('delete', old.id, old.user_prompt, old.story, old.character_description, old.background_description);
+            INSERT INTO mainapp_story_fts(rowid, user_prompt, story, character_description, background_description)
+            VALUES (new.id, new.user_prompt, new.story, new.character_description, new.background_description);
+        END
+    """,
+}
+
+
+class SearchResult(TypedDict):
+    id: int
+    prompt: str
+    snippet: str
+    rank: float
+
+
+def _fts5_query(query: str) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 query: every word is quoted (so FTS5
+    operators in user input are inert) and the words are ANDed together.
+    """
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"' for token in tokens)
+
+
+def _highlight(snippet: str) -> str:
+    """Escape a raw snippet and turn the markers into <mark> tags"""
+    html = escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+    return mark_safe(html)
+
+
+def _search_sqlite(connection, query: str, limit: int) -> List[SearchResult]:
+    match = _fts5_query(query)
+    if not match:
+        return []
+    window = settings.STORY_SEARCH_RANK_WINDOW
+    # Unserved pool stories are indexed like any row but only handed out by
+    # claiming them; the subquery reads the partial index on those few rows
+    matches_sql = f"""
+        SELECT rowid FROM mainapp_story_fts
+        WHERE mainapp_story_fts MATCH %s AND rowid NOT IN ({_UNSERVED_IDS_SQL})
+        ORDER BY rowid DESC
+        LIMIT %s
+    """
+    ranked_sql = f"""
+        SELECT rowid, bm25(mainapp_story_fts, 10.0, 4.0, 1.0, 1.0) AS rank
+        FROM mainapp_story_fts
+        WHERE mainapp_story_fts MATCH %s AND rowid NOT IN ({_UNSERVED_IDS_SQL})
+        ORDER BY rank
+        LIMIT %s
+    """
+    # One query for every returned row; the rowid range lets FTS5 skip the
+    # matches outside it before the IN list is checked
+    snippet_sql = """
+        SELECT s.id, s.user_prompt, snippet(mainapp_story_fts, -1, %s, %s, '...', 24)
+        FROM mainapp_story_fts
+        JOIN mainapp_storygeneration s ON s.id = mainapp_story_fts.rowid
+        WHERE mainapp_story_fts MATCH %s
+          AND mainapp_story_fts.rowid BETWEEN %s AND %s
+          AND mainapp_story_fts.rowid IN ({ids})
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(matches_sql, [match, window + 1])
+        recent = [pk for (pk,) in cursor.fetchall()]
+        if len(recent) <= window:
+            cursor.execute(ranked_sql, [match, limit])
+            # bm25() is lower-is-better; flip it so every backend ranks higher-is-better
+            ranked = [(pk, -rank) for pk, rank in cursor.fetchall()]
+        else:
+            cursor.execute(matches_sql, [f"{{user_prompt}} : ({match})", limit])
+            in_prompt = [pk for (pk,) in cursor.fetchall()]
+            seen = set(in_prompt)
+            ordered = in_prompt + [pk for pk in recent if pk not in seen]
+            ranked = [(pk, 1.0 if pk in seen else 0.0) for pk in ordered[:limit]]
+
+        if not ranked:
+            return []
+        ids = [pk for pk, _ in ranked]
+        cursor.execute(snippet_sql.format(ids=', '.join(['%s'] * len(ids))),
+                       [_MARK_START, _MARK_END, match, min(ids), max(ids), *ids])
+        snippets = {pk: (prompt, snippet) for pk, prompt, snippet in cursor.fetchall()}
+    # Rows deleted since the match query are left out
+    return [
+        {'id': pk, 'prompt': snippets[pk][0], 'snippet': _highlight(snippets[pk][1]), 'rank': rank}
+        for pk, rank in ranked if pk in snippets
+    ]
+
+
+def _search_postgres(connection, query: str, limit: int) -> List[SearchResult]:
+    if not _TOKEN.search(query):
+        return []
+    sql = f"""
+        WITH q AS (SELECT websearch_to_tsquery('english', %s) AS query),
+        recent AS (
+            SELECT s.id, ts_rank_cd(s.search_vector, q.query) AS rank
+            FROM mainapp_storygeneration s, q
+            WHERE s.search_vector @@ q.query
+              AND s.id NOT IN ({_UNSERVED_IDS_SQL})
+            ORDER BY s.id DESC
+            LIMIT %s
+        ),
+        top AS (SELECT id, rank FROM recent ORDER BY rank DESC LIMIT %s)
+        SELECT s.id, s.user_prompt, ts_headline('english', s.story, q.query, %s), top.rank
+        FROM top JOIN mainapp_storygeneration s ON s.id = top.id, q
+        ORDER BY top.rank DESC
+    """
+    headline_options = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxFragments=1, MaxWords=30, MinWords=10"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, settings.STORY_SEARCH_RANK_WINDOW, limit, headline_options])
+        rows = cursor.fetchall()
+    return [
+        {'id': pk, 'prompt': prompt, 'snippet': _highlight(snippet), 'rank': rank}
+        for pk, prompt, snippet, rank in rows
+    ]
+
+
+def _search_fallback(alias: str, query: str, limit: int) -> List[SearchResult]:
+    rows = (
+        StoryGeneration.objects.using(alias)
+        .served()
+        .filter(story__icontains=query)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'user_prompt', 'story')[:limit]
+    )
+    return [
+        {'id': pk, 'prompt': prompt, 'snippet': escape(story[:200]), 'rank': 0.0}
+        for pk, prompt, story in rows
+    ]
+
+
+def ensure_search_index(connection) -> bool:
+    """
+    Recreate any missing SQLite FTS5 trigger and rebuild the index from the
+    table, since rows written while a trigger was gone are missing from it.
+    Returns whether a repair was needed. A no-op on other backends, and
+    before migration 0004 has created the FTS5 table.
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND tbl_name = 'mainapp_storygeneration')",
+            [SQLITE_FTS_TABLE],
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+        if SQLITE_FTS_TABLE not in existing:
+            return False
+        missing = [name for name in SQLITE_FTS_TRIGGERS if name not in existing]
+        if not missing:
+            return False
+        for name in missing:
+            cursor.execute(SQLITE_FTS_TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+    logger.info("Recreated search index triggers %s and rebuilt the index", ", ".join(missing))
+    return True
+
+
+def search_stories(query: str, limit: int = 20) -> List[SearchResult]:
+    """Ranked stories matching `query`, best first, with highlighted snippets"""
+    query = query.strip()
+    if not query:
+        return []
+    alias = router.db_for_read(StoryGeneration)
+    connection = connections[alias]
+    if connection.vendor == 'sqlite':
+        return _search_sqlite(connection, query, limit)
+    if connection.vendor == 'postgresql':
+        return _search_postgres(connection, query, limit)
+    return _search_fallback(alias, query, limit)
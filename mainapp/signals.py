@@ -0,0 +1,40 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .caching import invalidate_story_page
+from .models import StoryGeneration
+from .phash import index_generation_images, unindex_generation_images
+from .results import discard_result
+from .search import ensure_search_index
+from .similarity import index_generation, unindex_generation
+
+
+@receiver(post_save, sender=StoryGeneration)
+@receiver(post_delete, sender=StoryGeneration)
+def invalidate_story_cache(sender, instance, **kwargs):
+    """Keep cached permalink pages and results in step with the record"""
+    invalidate_story_page(instance.pk)
+    discard_result(instance.pk)
+
+
+@receiver(post_save, sender=StoryGeneration)
+def index_story_prompt(sender, instance, created, **kwargs):
+    if created:
+        # Pool stories are only handed out by claiming them, never reused by prompt
+        if instance.pool_theme is None:
+            index_generation(instance.pk, instance.user_prompt)
+        index_generation_images(instance)
+
+
+@receiver(post_delete, sender=StoryGeneration)
+def unindex_story_prompt(sender, instance, **kwargs):
+    unindex_generation(instance.pk)
+    unindex_generation_images(instance.pk)
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, app_config, using, **kwargs):
+    """Schema changes that rebuild the story table drop the SQLite search triggers"""
+    if app_config.label == 'mainapp':
+        ensure_search_index(connections[using])
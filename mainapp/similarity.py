@@ -0,0 +1,207 @@
+"""
+Near-duplicate prompt detection.
+
+Prompts are normalized, split into character shingles and summarised with a
+MinHash signature. Signatures are bucketed with LSH banding so a lookup only
+touches prompts that share a band; the few sharing the most bands are then
+confirmed with exact Jaccard similarity on the shingles.
+"""
+import hashlib
+import re
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+from django.conf import settings
+
+SHINGLE_SIZE = 4
+# 10 bands of 3 rows: prompts with Jaccard 0.7 share a band ~98% of the time,
+# at 0.5 ~74%, at 0.3 ~24%
+NUM_PERM = 30
+BANDS = 10
+ROWS_PER_BAND = NUM_PERM // BANDS
+# Newest prompts kept per LSH bucket; bounds lookup cost for very common phrasings
+BUCKET_LIMIT = 64
+# Candidates (by shared band count) verified with exact Jaccard per lookup
+VERIFY_LIMIT = 4
+# Ids re-read behind the sync cursor, for rows other workers commit out of id order
+SYNC_OVERLAP = 100
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+# Function words carry little meaning in short prompts but dominate their shingles
+_STOPWORDS = frozenset("""
+    a an the and or of in inside into on onto at to from with within by for
+    about over under near is are was were be who that this which its their
+""".split())
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Lowercase, drop punctuation and stopwords, collapse whitespace"""
+    words = _NON_WORD.sub(" ", prompt.lower()).split()
+    return " ".join(word for word in words if word not in _STOPWORDS)
+
+
+def shingles(normalized: str) -> Set[str]:
+    """Character shingles of a normalized prompt"""
+    text = f" {normalized} "
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(prompt_shingles: Set[str]) -> Tuple[int, ...]:
+    """
+    MinHash signature with NUM_PERM independent 16-bit hash functions.
+    One 64-byte BLAKE2 digest per shingle yields all NUM_PERM hash values at
+    once, and the element-wise minimum is taken with zip/min so the work stays in C.
+    """
+    rows = [
+        tuple(array("H", hashlib.blake2b(shingle.encode("utf-8"), digest_size=NUM_PERM * 2).digest()))
+        for shingle in prompt_shingles
+    ]
+    return tuple(map(min, zip(*rows)))
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    intersection = len(a & b)
+    return intersection / (len(a) + len(b) - intersection)
+
+
+class PromptIndex:
+    """
+    Incremental MinHash-LSH index mapping prompts to StoryGeneration ids.
+    Identical normalized prompts collapse to a single entry (the newest id).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: Dict[str, int] = {}
+        self._texts: Dict[int, str] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Deque[str]] = {}
+        # Highest id read by _sync_index; local saves don't move it, since other
+        # workers may still commit lower ids
+        self.synced_id = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, story_id: int, prompt: str) -> None:
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return
+        with self._lock:
+            previous = self._ids.get(normalized)
+            if previous is not None:
+                if story_id > previous:
+                    del self._texts[previous]
+                    self._ids[normalized] = story_id
+                    self._texts[story_id] = normalized
+                return
+            self._ids[normalized] = story_id
+            self._texts[story_id] = normalized
+            signature = minhash(shingles(normalized))
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = deque(maxlen=BUCKET_LIMIT)
+                bucket.append(normalized)
+
+    def remove(self, story_id: int) -> None:
+        """Forget a story; its LSH bucket entries are skipped lazily on lookup"""
+        with self._lock:
+            normalized = self._texts.pop(story_id, None)
+            if normalized is not None and self._ids.get(normalized) == story_id:
+                del self._ids[normalized]
+
+    def find(self, prompt: str) -> Optional[Tuple[int, float]]:
+        """Return (story_id, similarity) of the closest indexed prompt, if any"""
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return None
+        query = shingles(normalized)
+        signature = minhash(query)
+        hits: Counter = Counter()
+        # add() appends to the buckets from other threads; only the Jaccard checks run unlocked
+        with self._lock:
+            exact = self._ids.get(normalized)
+            if exact is not None:
+                return exact, 1.0
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+                bucket = self._buckets.get(key)
+                if bucket:
+                    hits.update(bucket)
+            candidates = [(candidate, self._ids.get(candidate)) for candidate, _ in hits.most_common(VERIFY_LIMIT)]
+
+        best = None
+        for candidate, story_id in candidates:
+            if story_id is None:
+                continue
+            score = jaccard(query, shingles(candidate))
+            if best is None or score > best[1]:
+                best = (story_id, score)
+        return best
+
+
+_index: Optional[PromptIndex] = None
+_index_lock = threading.Lock()
+_last_sync: Optional[float] = None
+
+
+def _sync_index(index: PromptIndex) -> None:
+    """Pull rows written by other workers since the last sync"""
+    from .models import StoryGeneration
+
+    # Pool stories are only handed out by claiming them (see mainapp/pool.py)
+    rows = (
+        StoryGeneration.objects
+        .filter(pk__gt=index.synced_id - SYNC_OVERLAP, pool_theme__isnull=True)
+        .order_by('pk')
+        .values_list('pk', 'user_prompt')
+        .iterator(chunk_size=2000)
+    )
+    for story_id, prompt in rows:
+        # Re-adding an indexed story is a no-op
+        index.add(story_id, prompt)
+        index.synced_id = max(index.synced_id, story_id)
+
+
+def get_prompt_index() -> PromptIndex:
+    """Process-wide index, built lazily and topped up every PROMPT_INDEX_SYNC_INTERVAL seconds"""
+    global _index, _last_sync
+    now = time.monotonic()
+
+    def stale():
+        return _last_sync is None or now - _last_sync > settings.PROMPT_INDEX_SYNC_INTERVAL
+
+    if stale():
+        with _index_lock:
+            if _index is None:
+                _index = PromptIndex()
+            if stale():
+                _sync_index(_index)
+                _last_sync = now
+    return _index
+
+
+def index_generation(story_id: int, prompt: str) -> None:
+    if _index is not None:
+        _index.add(story_id, prompt)
+
+
+def unindex_generation(story_id: int) -> None:
+    if _index is not None:
+        _index.remove(story_id)
+
+
+def find_similar_generation(prompt: str, threshold: float) -> Optional[Tuple[int, float]]:
+    """(story_id, similarity) of a past generation at least `threshold` similar, or None"""
+    match = get_prompt_index().find(prompt)
+    if match and match[1] >= threshold:
+        return match
+    return None
@@ -0,0 +1,72 @@
+"""
+Process startup helpers.
+
+Heavy third-party modules (the PIL imaging stack, requests) are bound with
+lazy_import so management commands and URL checks don't pay for them. The
+web process instead calls preload() from wsgi.py: under gunicorn --preload
+that runs once in the master, and every forked worker starts with the
+imports, URLconf, templates and prompt index already in (copy-on-write) memory.
+"""
+import gc
+import importlib
+import logging
+import types
+
+logger = logging.getLogger(__name__)
+
+PRELOAD_MODULES = (
+    'requests',
+    'PIL.Image',
+    'PIL.ImageDraw',
+    'PIL.ImageEnhance',
+    'PIL.ImageFilter',
+    'PIL.ImageFont',
+)
+
+PRELOAD_TEMPLATES = (
+    'mainapp/home.html',
+    'mainapp/homeUIUX.html',
+    'mainapp/result.html',
+    'mainapp/resultUIUX.html',
+    'mainapp/lqip_image.html',
+)
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, attr):
+        # import_module holds the per-module import lock, so concurrent first uses are safe
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Stand-in for `import name` that defers the import until an attribute is used"""
+    return _LazyModule(name)
+
+
+def preload() -> None:
+    """Import and warm everything a request needs, then freeze the heap for forking"""
+    from django.db import connections
+    from django.template.loader import get_template
+    from django.urls import get_resolver
+
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    get_resolver().reverse_dict  # imports views and builds the reverse lookup tables
+    for name in PRELOAD_TEMPLATES:
+        get_template(name)
+
+    try:
+        from .similarity import get_prompt_index
+        get_prompt_index()
+    except Exception as e:
+        logger.warning("Prompt index not preloaded: %s", e)
+    finally:
+        # Never hand an open database connection to forked workers
+        connections.close_all()
+
+    # Move everything loaded so far out of the collector's reach, so GC passes in
+    # the workers don't touch (and copy) the pages shared with the master
+    gc.collect()
+    gc.freeze()
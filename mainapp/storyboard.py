@@ -0,0 +1,148 @@
+"""
+Storyboard mode: a story split into beats, one composed panel per beat.
+
+The character is shared by every panel and beats often return to the same
+setting, so each distinct description is fetched once, on the shared image
+fetch pool (IMAGE_FETCH_WORKERS threads), and the character is resized and
+soft-edged once for all panels. Each panel is composed on a second bounded
+pool (STORYBOARD_COMPOSE_WORKERS; PIL releases the GIL while resampling and
+blending) as soon as its background arrives, with the character moving
+across the storyboard from panel to panel, and pasted into a sheet that is
+allocated once at its final size. Latency is then roughly one fetch plus a
+few panels' compositing, not N of each.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from .compositing import EncodedImage, ImageMerger
+from .image_sources import ImageSource, fetch_pool
+from .phash import dhash
+from .startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+
+logger = logging.getLogger(__name__)
+
+# Pixels between panels on the sheet
+GUTTER = 8
+
+
+class Panel(NamedTuple):
+    beat: str
+    background: str
+
+
+class Storyboard(NamedTuple):
+    # The stitched panels, None if the character or every background failed
+    sheet: Optional[EncodedImage]
+    character_hash: Optional[int]
+    # Inline thumbnails of the character and the first panel's background
+    character_placeholder: str = ''
+    background_placeholder: str = ''
+
+
+def panel_count(value) -> int:
+    """Requested number of panels, clamped to STORYBOARD_MAX_PANELS; 0 for a single scene"""
+    try:
+        panels = int(value)
+    except (TypeError, ValueError):
+        return 0
+    return min(panels, settings.STORYBOARD_MAX_PANELS) if panels > 1 else 0
+
+
+_compose_pool: Optional[ThreadPoolExecutor] = None
+_compose_pool_lock = threading.Lock()
+
+
+def compose_pool() -> ThreadPoolExecutor:
+    """Process-wide compositing executor, shared by all requests so the thread count stays bounded"""
+    global _compose_pool
+    if _compose_pool is None:
+        with _compose_pool_lock:
+            if _compose_pool is None:
+                _compose_pool = ThreadPoolExecutor(max_workers=settings.STORYBOARD_COMPOSE_WORKERS,
+                                                   thread_name_prefix='storyboard-compose')
+    return _compose_pool
+
+
+def sheet_layout(panels: int, panel_size: Tuple[int, int], columns: int) -> Tuple[Tuple[int, int], List[Tuple[int, int]]]:
+    """Sheet size and each panel's top-left corner: a strip up to `columns` panels, a grid beyond"""
+    width, height = panel_size
+    columns = max(1, min(columns, panels))
+    rows = math.ceil(panels / columns)
+    size = (columns * width + (columns + 1) * GUTTER, rows * height + (rows + 1) * GUTTER)
+    corners = [
+        (GUTTER + (i % columns) * (width + GUTTER), GUTTER + (i // columns) * (height + GUTTER))
+        for i in range(panels)
+    ]
+    return size, corners
+
+
+def render_storyboard(image_source: ImageSource, character_desc: str, panels: List[Panel],
+                      fetcher: Optional[ThreadPoolExecutor] = None,
+                      composer: Optional[ThreadPoolExecutor] = None) -> Storyboard:
+    """Fetch, compose and stitch the panels into one JPEG sheet"""
+    fetcher = fetcher or fetch_pool()
+    composer = composer or compose_pool()
+    panel_size = (settings.STORYBOARD_PANEL_WIDTH, settings.STORYBOARD_PANEL_HEIGHT)
+
+    # One fetch per distinct description, all in flight at once
+    character_future = fetcher.submit(image_source.fetch, character_desc)
+    background_futures: Dict[str, Future] = {}
+    for panel in panels:
+        if panel.background not in background_futures:
+            background_futures[panel.background] = fetcher.submit(image_source.fetch, panel.background)
+
+    char_img = character_future.result()
+    if char_img is None:
+        logger.warning("Failed to download the storyboard character")
+        for future in background_futures.values():
+            future.cancel()
+        return Storyboard(None, None)
+    character_hash, character_placeholder = dhash(char_img), ImageMerger.placeholder(char_img)
+    character = ImageMerger.prepare_character(char_img, *panel_size)
+    background_placeholder = ''
+
+    sheet_size, corners = sheet_layout(len(panels), panel_size, settings.STORYBOARD_COLUMNS)
+    sheet = Image.new('RGB', sheet_size, 'white')
+    slots: Dict[str, List[int]] = {}
+    for i, panel in enumerate(panels):
+        slots.setdefault(panel.background, []).append(i)
+
+    # Compose a setting's panels as soon as its image arrives
+    by_future = {future: description for description, future in background_futures.items()}
+    compose_futures = {}
+    for future in as_completed(by_future):
+        bg_img = future.result()
+        if bg_img is None:
+            logger.warning("Failed to download a storyboard background")
+            continue
+        if by_future[future] == panels[0].background:
+            background_placeholder = ImageMerger.placeholder(bg_img)
+        for i in slots[by_future[future]]:
+            position = 0.3 + 0.4 * i / max(1, len(panels) - 1)
+            compose_futures[composer.submit(ImageMerger.render_scene, character, bg_img, panel_size, position)] = i
+
+    composed = 0
+    for future in as_completed(compose_futures):
+        try:
+            scene = future.result()
+        except Exception:
+            logger.exception("Error composing a storyboard panel")
+            continue
+        sheet.paste(scene, corners[compose_futures[future]])
+        composed += 1
+    if not composed:
+        return Storyboard(None, character_hash, character_placeholder, background_placeholder)
+
+    encoded = ImageMerger.encode(sheet)
+    encoded.dhash = dhash(sheet)
+    encoded.placeholder = ImageMerger.placeholder(sheet)
+    return Storyboard(encoded, character_hash, character_placeholder, background_placeholder)
@@ -0,0 +1,204 @@
+"""
+Overlapping the LLM call with image work.
+
+The story prompt asks for the character and background descriptions before
+the story itself, and the response is streamed. JsonFieldScanner reads the
+chunks as they arrive and reports each top-level string field as soon as
+its closing quote is seen. ImagePrefetcher starts fetching that image on
+the shared fetch pool, then hashes it, makes its placeholder thumbnail and
+resizes or masks it for the scene,
+while the story text is still being generated. By the time the response is
+complete the images are usually ready, so end-to-end latency approaches
+max(LLM, images) rather than their sum.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import re
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from .compositing import ImageMerger, is_tiled, scene_size
+from .image_sources import ImageSource, fetch_pool
+from .llm import ProviderError, ProviderRouter
+from .phash import dhash
+from .startup import lazy_import
+
+Image = lazy_import('PIL.Image')
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# Characters that can change the scanner's state
+_SPECIAL = re.compile(r'[\\"{}\[\]:,]')
+
+
+class JsonFieldScanner:
+    """
+    Incremental scanner over streamed JSON text. feed() returns the
+    (key, value) pairs of top-level string fields completed by the chunk;
+    text before the opening brace (such as a markdown fence) is ignored.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        # Index before which the scanner must not look (the character after a backslash)
+        self._skip = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        self.text += chunk
+        fields = []
+        for match in _SPECIAL.finditer(self.text, self._pos):
+            i, char = match.start(), match.group()
+            if i < self._skip:
+                continue
+            if self._in_string:
+                if char == '\\':
+                    self._skip = i + 2
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        value = self._decode(self.text[self._string_start:i])
+                        if self._expect_key:
+                            self._key, self._expect_key = value, False
+                        elif self._key is not None and value is not None:
+                            fields.append((self._key, value))
+                            self._key = None
+            elif char == '"':
+                self._in_string, self._string_start = True, i + 1
+            elif char in '{[':
+                self._depth += 1
+                self._expect_key = self._depth == 1 and char == '{'
+            elif char in '}]':
+                self._depth -= 1
+            elif self._depth == 1:
+                # ':' moves on to the value, ',' to the next key
+                self._expect_key = char == ','
+                if self._expect_key:
+                    self._key = None
+        self._pos = len(self.text)
+        return fields
+
+    @staticmethod
+    def _decode(raw: str) -> Optional[str]:
+        try:
+            # strict=False: models sometimes put raw newlines inside strings
+            return json.loads(f'"{raw}"', strict=False)
+        except ValueError:
+            return None
+
+
+def stream_completion(router: ProviderRouter, messages: List[dict], max_tokens: int,
+                      on_field: Callable[[str, str], None]) -> str:
+    """
+    The full response text, calling on_field(key, value) for each top-level
+    string field as soon as it is complete. A stream that breaks after it
+    has started falls back to a plain completion (with provider failover),
+    unless so little of the LLM time budget is left that the retry would
+    push the request past it; then the error is raised.
+    """
+    scanner = JsonFieldScanner()
+    started = time.monotonic()
+    chunks = router.stream(messages, max_tokens)
+    try:
+        for chunk in chunks:
+            for key, value in scanner.feed(chunk):
+                on_field(key, value)
+    except ProviderError as e:
+        if not scanner.text:
+            raise
+        _check_fallback_budget(started, e)
+        logger.warning("LLM stream broke off, retrying without streaming: %s", e)
+        return router.complete(messages, max_tokens)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        _check_fallback_budget(started, e)
+        logger.warning("LLM stream broke off, retrying without streaming: %s", e)
+        return router.complete(messages, max_tokens)
+    return scanner.text
+
+
+def _check_fallback_budget(started: float, error: Exception) -> None:
+    """
+    Raise unless a plain completion can still fit the LLM share of the request
+    deadline (the routed providers' TIMEOUTs, see story_generator/server.py)
+    """
+    budget = sum(settings.LLM_PROVIDERS[name].get('TIMEOUT', 30) for name in settings.LLM_ROUTING)
+    remaining = budget - (time.monotonic() - started)
+    if remaining >= settings.LLM_STREAM_FALLBACK_MIN_SECONDS:
+        return
+    logger.warning("LLM stream broke off with %.1f s of the LLM budget left, not retrying: %s", remaining, error)
+    if isinstance(error, ProviderError):
+        raise error
+    raise ProviderError('stream', f"Stream broke off: {error}") from error
+
+
+class PreparedImage(NamedTuple):
+    # Resized (background) or resized and soft-edged (character) for a scene_size() scene;
+    # backgrounds for tiled scenes stay at their source size and are resampled strip by strip
+    image: Image.Image
+    # Perceptual hash of the image as fetched
+    hash: int
+    # Inline thumbnail shown while the full image loads
+    placeholder: str
+
+
+def prepare_image(image_source: ImageSource, kind: str, description: str) -> Optional[PreparedImage]:
+    """Fetch one scene input and do the per-image compositing work that does not need the other"""
+    image = image_source.fetch(description)
+    if image is None:
+        return None
+    image_hash, placeholder = dhash(image), ImageMerger.placeholder(image)
+    size = scene_size()
+    if kind == 'character':
+        image = ImageMerger.prepare_character(image, *size)
+    elif not is_tiled(size):
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    return PreparedImage(image, image_hash, placeholder)
+
+
+class ImagePrefetcher:
+    """Character and background fetches for one generation, started as early as their descriptions are known"""
+
+    KINDS = ('character', 'background')
+
+    def __init__(self, image_source: ImageSource):
+        self.image_source = image_source
+        self._started: Dict[str, Tuple[str, Future]] = {}
+
+    def start(self, kind: str, description: str) -> None:
+        if kind not in self.KINDS or not description.strip():
+            return
+        started = self._started.get(kind)
+        if started and started[0] == description:
+            return
+        if started:
+            started[1].cancel()
+        future = fetch_pool().submit(prepare_image, self.image_source, kind, description)
+        self._started[kind] = (description, future)
+
+    def get(self, kind: str, description: str) -> Optional[PreparedImage]:
+        """The prepared image, waiting for (or starting) its fetch; None if it could not be fetched"""
+        self.start(kind, description)
+        started = self._started.get(kind)
+        if started is None or started[0] != description:
+            return None
+        try:
+            return started[1].result()
+        except Exception:
+            logger.exception("Error preparing the %s image", kind)
+            return None
+
+    def cancel(self) -> None:
+        """Drop fetches that have not started yet"""
+        for _, future in self._started.values():
+            future.cancel()
@@ -1,3 +1,206 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import pool
+from .admission import ConcurrencyLimiter, client_ip
+from .models import StoryGeneration
+from .phash import ImageIndex
+from .phash import _sync_index as image_index_sync
+from .results import get_result
+from .search import SQLITE_FTS_TRIGGERS, ensure_search_index, search_stories
+from .similarity import PromptIndex
+from .similarity import _sync_index as prompt_index_sync
+from .similarity import normalize_prompt
+
+
+class StorySearchTests(TestCase):
+    def test_new_story_is_found(self):
+        story = StoryGeneration.objects.create(
+            user_prompt="A lighthouse keeper befriends a whale",
+            story="Every night the keeper sang to the whale beneath the lamp.",
+        )
+        self.assertEqual([result['id'] for result in search_stories("whale")], [story.pk])
+
+    def test_edited_and_deleted_stories_are_reindexed(self):
+        story = StoryGeneration.objects.create(user_prompt="A fox", story="The fox found a lantern.")
+        story.story = "The fox found a compass."
+        story.save()
+        self.assertEqual(search_stories("lantern"), [])
+        self.assertEqual([result['id'] for result in search_stories("compass")], [story.pk])
+        story.delete()
+        self.assertEqual(search_stories("compass"), [])
+
+    def test_ensure_search_index_restores_dropped_triggers(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("triggers are SQLite-only")
+        self.assertFalse(ensure_search_index(connection))
+        with connection.cursor() as cursor:
+            for name in SQLITE_FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER {name}")
+        story = StoryGeneration.objects.create(user_prompt="An owl", story="The owl kept a library.")
+        self.assertEqual(search_stories("library"), [])
+        self.assertTrue(ensure_search_index(connection))
+        self.assertEqual([result['id'] for result in search_stories("library")], [story.pk])
+
+
+class StoryPageTests(TestCase):
+    def test_descriptions_are_escaped(self):
+        story = StoryGeneration.objects.create(
+            user_prompt="A cat",
+            story="The cat slept.",
+            character_description='<script>alert("x")</script>',
+            background_description='<img src=x onerror=alert(1)>',
+        )
+        response = self.client.get(story.get_absolute_url(), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<script>alert(')
+        self.assertNotContains(response, '<img src=x')
+        self.assertContains(response, '&lt;script&gt;')
+
+
+class StaffEndpointTests(TestCase):
+    def test_metrics_requires_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, secure=True).status_code, 302)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pid', response.json())
+
+    def test_export_rejects_invalid_since(self):
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        url = reverse('export_stories_ndjson')
+        for since in ('2024-13-45', 'yesterday'):
+            self.assertEqual(self.client.get(url, {'since': since}, secure=True).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2024-01-31'}, secure=True).status_code, 200)
+
+
+class StorySceneTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.story = StoryGeneration(user_prompt="A heron", story="The heron waited.")
+        self.story.combined_image.save("scene.jpg", ContentFile(b"old jpeg"), save=False)
+        self.story.combined_image_etag, self.story.combined_image_size = "old", 8
+        self.story.save()
+        # Held by this process's result cache, as after an earlier page view
+        self.assertIsNotNone(get_result(self.story.pk))
+
+    def test_file_replaced_elsewhere_is_looked_up_again(self):
+        replacement = self.story.combined_image.storage.save("combined/scene.webp", ContentFile(b"new webp"))
+        self.story.combined_image.storage.delete(self.story.combined_image.name)
+        # Another process compacted it: no signal reaches this process's cache
+        StoryGeneration.objects.filter(pk=self.story.pk).update(
+            combined_image=replacement, combined_image_etag="new", combined_image_size=8)
+        response = self.client.get(self.story.get_scene_url(), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(b"".join(response.streaming_content), b"new webp")
+
+    def test_deleted_file_is_not_found(self):
+        self.story.combined_image.storage.delete(self.story.combined_image.name)
+        response = self.client.get(self.story.get_scene_url(), secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class IndexSyncTests(TestCase):
+    def test_prompt_sync_reads_rows_below_a_local_save(self):
+        index = PromptIndex()
+        prompt_index_sync(index)
+        local = StoryGeneration.objects.create(pk=1000, user_prompt="A whale sings to the moon", story="...")
+        index.add(local.pk, local.user_prompt)
+        # Committed later by another worker with a lower id
+        StoryGeneration.objects.bulk_create([
+            StoryGeneration(pk=local.pk - 1, user_prompt="A tortoise races a hare", story="..."),
+        ])
+        prompt_index_sync(index)
+        self.assertEqual(index.find("A tortoise races a hare"), (local.pk - 1, 1.0))
+
+    def test_image_sync_reads_rows_below_a_local_save(self):
+        index = ImageIndex()
+        image_index_sync(index)
+        local = StoryGeneration.objects.create(pk=1000, user_prompt="A fox", story="...", character_image_hash=1)
+        index.add(local.pk, 1, None, None)
+        StoryGeneration.objects.bulk_create([
+            StoryGeneration(pk=local.pk - 1, user_prompt="An owl", story="...", character_image_hash=2 ** 40),
+        ])
+        image_index_sync(index)
+        self.assertEqual(index.character.find(2 ** 40, 0), [(local.pk - 1, 0)])
+
+
+class StoryPoolTests(TestCase):
+    prompt = "A dragon guards a library"
+
+    def setUp(self):
+        # Themes with unserved stories are memoized per process
+        pool._themes_loaded = None
+        self.addCleanup(setattr, pool, '_themes_loaded', None)
+
+    def add_pooled(self, count):
+        return [
+            StoryGeneration.objects.create(user_prompt=self.prompt, story="The dragon read every scroll.",
+                                           pool_theme=normalize_prompt(self.prompt))
+            for _ in range(count)
+        ]
+
+    @override_settings(STORY_POOL_LOW_WATER=0)
+    def test_unserved_stories_are_hidden_until_claimed(self):
+        story = self.add_pooled(1)[0]
+        index = PromptIndex()
+        prompt_index_sync(index)
+        self.assertIsNone(index.find(self.prompt))
+        self.assertEqual(search_stories("scroll"), [])
+        self.assertNotContains(self.client.get(reverse('story_list'), secure=True), self.prompt)
+
+        self.assertEqual(pool.claim_pooled_story(self.prompt).pk, story.pk)
+        self.assertEqual([result['id'] for result in search_stories("scroll")], [story.pk])
+        self.assertContains(self.client.get(reverse('story_list'), secure=True), self.prompt)
+
+    def test_claim_below_low_water_starts_refill(self):
+        self.add_pooled(3)
+        with override_settings(STORY_POOL_LOW_WATER=2), \
+                mock.patch.object(pool, 'start_background_refill') as refill:
+            pool.claim_pooled_story(self.prompt)
+            refill.assert_not_called()
+            pool.claim_pooled_story(self.prompt)
+            refill.assert_called_once_with()
+
+
+@override_settings(RATE_LIMIT_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR', RATE_LIMIT_TRUSTED_PROXIES=['10.0.0.0/8'])
+class ClientIpTests(SimpleTestCase):
+    def client_ip(self, remote, forwarded):
+        return client_ip(RequestFactory().get('/', REMOTE_ADDR=remote, HTTP_X_FORWARDED_FOR=forwarded))
+
+    def test_header_from_untrusted_peer_is_ignored(self):
+        self.assertEqual(self.client_ip('203.0.113.7', '198.51.100.1'), '203.0.113.7')
+
+    def test_trusted_proxies_are_skipped(self):
+        self.assertEqual(self.client_ip('10.0.0.2', '198.51.100.1, 203.0.113.9:52100, 10.0.0.5'), '203.0.113.9')
+
+
+class ProceduralImageTests(TestCase):
+    url = reverse('procedural_image')
+
+    def test_size_is_capped(self):
+        response = self.client.get(self.url, {'d': "A fox", 'w': 4096, 'h': 300}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        image = Image.open(io.BytesIO(response.content))
+        self.assertEqual(image.size, (1024, 300))
+
+    def test_shares_the_generation_concurrency_limit(self):
+        with mock.patch('mainapp.admission.get_generate_limiter', return_value=ConcurrencyLimiter(0, 0, 0)):
+            response = self.client.get(self.url, {'d': "A fox"}, secure=True)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
@@ -7,4 +7,14 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('generate/', views.generate_story, name='generate_story'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('debug/memory/', views.memory_debug, name='memory_debug'),
+    path('export/stories.ndjson', views.export_stories, {'export_format': 'ndjson'}, name='export_stories_ndjson'),
+    path('export/stories.zip', views.export_stories, {'export_format': 'zip'}, name='export_stories_zip'),
+    path('images/procedural/', views.procedural_image, name='procedural_image'),
+    path('stories/', views.story_list, name='story_list'),
+    path('stories/search/', views.story_search, name='story_search'),
+    path('stories/similar/', views.similar_story, name='similar_story'),
+    path('story/<int:story_id>/', views.story_detail, name='story_detail'),
+    path('story/<int:story_id>/scene.jpg', views.story_scene, name='story_scene'),
 ]
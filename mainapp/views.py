@@ -1,217 +1,51 @@
+from __future__ import annotations
+
 import os
-import json
-import requests
 import logging
-from urllib.parse import quote
+import mimetypes
 from django.shortcuts import render
+from django.urls import reverse
 from django.conf import settings
-from dotenv import load_dotenv
-from PIL import Image, ImageDraw, ImageFont, ImageEnhance, ImageFilter
-import io
-import base64
-from typing import Optional, Tuple
-
-# Setup logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.files.storage import default_storage
+from django.db import router
+from django.db.models import Q
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse,
+)
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition, require_GET, require_safe
+import hashlib
+import time
+from typing import Optional
 
-load_dotenv()
+from .admission import admission_control, admission_metrics
+from .caching import home_etag, get_story_page, set_story_page
+from .models import StoryGeneration
+from .compositing import ImageMerger
+from .db import database_metrics, replica_reads
+from .export import export_ndjson, export_zip, stories_for_export
+from .image_sources import ProceduralSource, get_image_source
+from .llm import ProviderError, get_router
+from .media import file_validators, image_response
+from .memprofile import memory_metrics, memory_report
+from .pagination import keyset_page
+from .phash import image_index_metrics
+from .pipeline import elapsed_ms, run_pipeline
+from .pool import claim_pooled_story
+from .prompts import get_tier
+from .results import CachedResult, cache_result, discard_result, get_result, get_result_cache
+from .retention import record_access
+from .search import search_stories
+from .similarity import find_similar_generation
+from .storyboard import panel_count
+from .startup import lazy_import
 
-PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
-PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
-
-class ImageMerger:
-    """Advanced image merging using PIL to create coherent scenes"""
-    
-    @staticmethod
-    def download_image(url: str) -> Optional[Image.Image]:
-        """Download image from URL and return PIL Image"""
-        try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            return Image.open(io.BytesIO(response.content)).convert('RGBA')
-        except Exception as e:
-            logger.error(f"Error downloading image from {url}: {e}")
-            return None
-    
-    @staticmethod
-    def create_coherent_scene(character_url: str, background_url: str) -> Optional[str]:
-        """
-        Merge character and background into a coherent scene
-        Returns base64 encoded image string
-        """
-        try:
-            # Download images
-            char_img = ImageMerger.download_image(character_url)
-            bg_img = ImageMerger.download_image(background_url)
-            
-            if not char_img or not bg_img:
-                logger.warning("Failed to download one or both images")
-                return character_url or background_url
-            
-            # Standardize size
-            scene_width, scene_height = 800, 600
-            bg_img = bg_img.resize((scene_width, scene_height), Image.Resampling.LANCZOS)
-            
-            # Character processing
-            char_img = ImageMerger._prepare_character(char_img, scene_width, scene_height)
-            
-            # Create the merged scene
-            merged_scene = ImageMerger._compose_scene(bg_img, char_img)
-            
-            # Add artistic effects
-            final_scene = ImageMerger._apply_scene_effects(merged_scene)
-            
-            # Convert to base64
-            return ImageMerger._image_to_base64(final_scene)
-            
-        except Exception as e:
-            logger.error(f"Error in scene creation: {e}")
-            return None
-    
-    @staticmethod
-    def _prepare_character(char_img: Image.Image, scene_width: int, scene_height: int) -> Image.Image:
-        """Prepare character image for scene integration"""
-        # Resize character to fit proportionally (max 40% of scene width)
-        max_char_width = int(scene_width * 0.4)
-        max_char_height = int(scene_height * 0.7)
-        
-        # Calculate aspect ratio preserving resize
-        char_ratio = char_img.width / char_img.height
-        if char_ratio > 1:  # Wider than tall
-            new_width = min(max_char_width, char_img.width)
-            new_height = int(new_width / char_ratio)
-        else:  # Taller than wide
-            new_height = min(max_char_height, char_img.height)
-            new_width = int(new_height * char_ratio)
-        
-        char_img = char_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Create soft edges for better blending
-        char_img = ImageMerger._create_soft_edges(char_img)
-        
-        return char_img
-    
-    @staticmethod
-    def _create_soft_edges(img: Image.Image) -> Image.Image:
-        """Create soft edges around character for better blending"""
-        # Create a mask with soft edges
-        mask = Image.new('L', img.size, 0)
-        draw = ImageDraw.Draw(mask)
-        
-        # Create rounded rectangle mask
-        margin = 10
-        draw.rounded_rectangle(
-            [margin, margin, img.width - margin, img.height - margin],
-            radius=20,
-            fill=255
-        )
-        
-        # Apply Gaussian blur for soft edges
-        mask = mask.filter(ImageFilter.GaussianBlur(radius=3))
-        
-        # Apply mask to image
-        img.putalpha(mask)
-        return img
-    
-    @staticmethod
-    def _compose_scene(background: Image.Image, character: Image.Image) -> Image.Image:
-        """Compose character onto background with proper positioning"""
-        scene = background.copy()
-        
-        # Position character (slightly right of center, bottom aligned)
-        char_x = int(scene.width * 0.6) - character.width // 2
-        char_y = scene.height - character.height - 20  # 20px from bottom
-        
-        # Ensure character fits within scene
-        char_x = max(0, min(char_x, scene.width - character.width))
-        char_y = max(0, min(char_y, scene.height - character.height))
-        
-        # Paste character with alpha blending
-        if character.mode == 'RGBA':
-            scene.paste(character, (char_x, char_y), character)
-        else:
-            scene.paste(character, (char_x, char_y))
-        
-        return scene
-    
-    @staticmethod
-    def _apply_scene_effects(scene: Image.Image) -> Image.Image:
-        """Apply artistic effects to enhance the final scene"""
-        # Convert to RGB for processing
-        if scene.mode == 'RGBA':
-            # Create white background and paste scene
-            rgb_scene = Image.new('RGB', scene.size, 'white')
-            rgb_scene.paste(scene, mask=scene.split()[-1] if len(scene.split()) == 4 else None)
-            scene = rgb_scene
-        
-        # Enhance colors slightly
-        enhancer = ImageEnhance.Color(scene)
-        scene = enhancer.enhance(1.1)
-        
-        # Add subtle vignette effect
-        scene = ImageMerger._add_vignette(scene)
-        
-        return scene
-    
-    @staticmethod
-    def _add_vignette(image: Image.Image) -> Image.Image:
-        """Add subtle vignette effect"""
-        width, height = image.size
-        
-        # Create vignette mask
-        vignette = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(vignette)
-        
-        # Create radial gradient
-        center_x, center_y = width // 2, height // 2
-        max_distance = max(width, height) // 2
-        
-        for i in range(0, max_distance, 10):
-            alpha = int((i / max_distance) * 30)  # Subtle effect
-            draw.ellipse(
-                [center_x - i, center_y - i, center_x + i, center_y + i],
-                outline=(0, 0, 0, alpha)
-            )
-        
-        # Apply vignette
-        image_with_alpha = image.convert('RGBA')
-        final_image = Image.alpha_composite(image_with_alpha, vignette)
-        
-        return final_image.convert('RGB')
-    
-    @staticmethod
-    def _image_to_base64(image: Image.Image) -> str:
-        """Convert PIL Image to base64 string"""
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=95)
-        img_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        return f"data:image/jpeg;base64,{img_data}"
-
-def strip_markdown_fences(text: str) -> str:
-    """Enhanced markdown fence removal with JSON extraction."""
-    text = text.strip()
-    
-    # Remove various markdown code blocks
-    if text.startswith("```json"):
-        text = text[7:].lstrip()  # len("```json") = 7
-    elif text.startswith("```"):
-        text = text[3:].lstrip()  # len("```") = 3
-    
-    if text.endswith("```"):
-        text = text[:-3].rstrip()
-    
-    # Remove any remaining markdown formatting
-    text = text.replace("**", "").replace("*", "")
-    
-    # Extract JSON object if present
-    start_idx = text.find('{')
-    end_idx = text.rfind('}') + 1
-    if start_idx != -1 and end_idx > start_idx:
-        return text[start_idx:end_idx]
-    
-    return text
+logger = logging.getLogger(__name__)
 
+requests = lazy_import('requests')
 
 
 def parse_fallback_text(text: str) -> tuple:
@@ -219,7 +53,7 @@ def parse_fallback_text(text: str) -> tuple:
     Fallback parser when JSON parsing fails
     Returns (story, character, background)
     """
-    logger.info("Using fallback text parsing")
+    logger.debug("Using fallback text parsing")
     
     # If it's a short response, use it as the story
     if len(text) < 500:
@@ -238,47 +72,303 @@ def parse_fallback_text(text: str) -> tuple:
     else:
         return (text, "A story character", "A story setting")
 
-def get_image_url(description):
-    """Generate images using Pollinations AI"""
-    if not description.strip():
-        return ""
-    
-    logger.info(f"Generating image for: {description[:50]}...")
-    
+@require_GET
+@admission_control(methods=('GET',), rate_limit=False)
+def procedural_image(request):
+    """
+    Locally rendered image for a description (served for the procedural image source).
+    Rendering costs CPU, so it shares generate_story's concurrency limit; the per-client
+    rate limit is left out because every result and gallery page embeds these URLs.
+    """
+    description = request.GET.get('d', '')[:500]
     try:
-        # Enhanced prompt engineering for better image quality
-        enhanced_desc = f"high quality, detailed, 4k resolution, {description}"
-        encoded_desc = quote(enhanced_desc)
-        seed = abs(hash(description)) % 10000
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_desc}?width=512&height=512&seed={seed}&enhance=true"
-        logger.info(f"Generated image URL: {image_url[:100]}...")
-        return image_url
-        
-    except Exception as e:
-        logger.error(f"Error generating image: {e}")
-        seed = abs(hash(description)) % 1000
-        return f"https://picsum.photos/512/512?random={seed}"
+        width = min(int(request.GET.get('w', 512)), ProceduralSource.MAX_SERVED_SIZE)
+        height = min(int(request.GET.get('h', 512)), ProceduralSource.MAX_SERVED_SIZE)
+    except ValueError:
+        width = height = 512
 
-def home(request):
-    """Home view with UI mode switching"""
+    # Deterministic for a given query, so revalidations are answered without rendering
+    etag = hashlib.blake2b(f"{width}x{height}:{description}".encode('utf-8'), digest_size=16).hexdigest()
+    max_age = 60 * 60 * 24 * 365
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is None:
+        image = ProceduralSource.render(description, width, height).convert('RGB')
+        encoded = ImageMerger.encode(image, quality=85)
+        response = image_response(request, etag=etag, size=len(encoded), content_type=encoded.content_type,
+                                  data=encoded.data, max_age=max_age)
+    patch_cache_control(response, public=True, max_age=max_age, immutable=True)
+    return response
+
+
+@require_safe
+def story_scene(request, story_id):
+    """
+    The composed scene of a saved story. Served from the result cache when
+    the encoded bytes are held there, else from media storage via sendfile.
+    """
+    record = get_result(story_id)
+    if record is None:
+        raise Http404("No story with that id")
+    try:
+        return _scene_response(request, record)
+    except FileNotFoundError:
+        # The cached record predates the file being deleted or compacted by the
+        # retention job (possibly in another process): look the story up again
+        discard_result(story_id)
+    record = get_result(story_id)
+    if record is None:
+        raise Http404("No story with that id")
+    try:
+        return _scene_response(request, record)
+    except FileNotFoundError:
+        raise Http404("Scene file is missing")
+
+def _scene_response(request, record: CachedResult):
+    if record.image is not None:
+        image = record.image
+        return image_response(request, etag=image.etag, size=len(image), content_type=image.content_type,
+                              data=image.data, max_age=settings.STORY_PAGE_CACHE_TIMEOUT)
+
+    fields = record.fields()
+    if not fields['scene_name']:
+        raise Http404("Story has no composed scene")
+    try:
+        path = default_storage.path(fields['scene_name'])
+    except NotImplementedError:
+        # Remote storage: let the browser fetch it from there
+        return HttpResponseRedirect(default_storage.url(fields['scene_name']))
+    etag, size = fields['scene_etag'], int(fields['scene_size'] or 0)
+    if not etag or not size:
+        etag, size = file_validators(path)
+    # Old scenes may have been re-encoded as WebP by the retention job
+    content_type = mimetypes.guess_type(path)[0] or 'image/jpeg'
+    return image_response(request, etag=etag, size=size, content_type=content_type,
+                          path=path, max_age=settings.STORY_PAGE_CACHE_TIMEOUT)
+
+def _render_home(request):
     if settings.UI_MODE == "high":
         return render(request, "mainapp/homeUIUX.html")
     return render(request, "mainapp/home.html")
 
+@condition(etag_func=lambda request: home_etag(request))
+def home(request):
+    """Home view with UI mode switching and conditional GET support"""
+    response = _render_home(request)
+    patch_cache_control(response, private=True, max_age=settings.HOME_PAGE_MAX_AGE)
+    return response
+
+def _result_template_name() -> str:
+    return 'mainapp/resultUIUX.html' if settings.UI_MODE == "high" else 'mainapp/result.html'
+
+@require_GET
+def story_detail(request, story_id):
+    """
+    Shareable permalink for a saved story.
+    Rendered once from the stored record and served from cache afterwards;
+    the cached page is dropped whenever the record is saved or deleted.
+    """
+    cached = get_story_page(story_id, settings.UI_MODE)
+    if cached is None:
+        record = get_result(story_id)
+        if record is None:
+            raise Http404("No story with that id")
+        content = render_to_string(_result_template_name(), record.context()).encode("utf-8")
+        etag = set_story_page(story_id, settings.UI_MODE, content)
+    else:
+        content, etag = cached
+    record_access(story_id)
+
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content)
+        response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.STORY_PAGE_CACHE_TIMEOUT)
+    return response
+
+@require_GET
+@replica_reads
+def story_list(request):
+    """Gallery of saved stories, newest first, with cursor pagination"""
+    stories, next_cursor = keyset_page(
+        StoryGeneration.objects.served().for_listing(),
+        request.GET.get('cursor'),
+        settings.STORY_LIST_PAGE_SIZE,
+    )
+    return render(request, 'mainapp/story_list.html', {
+        'stories': stories,
+        'next_cursor': next_cursor,
+    })
+
+@require_GET
+@replica_reads
+def story_search(request):
+    """Ranked full-text search over saved stories"""
+    query = request.GET.get('q', '').strip()
+    results = search_stories(query, settings.STORY_SEARCH_LIMIT) if query else []
+    return render(request, 'mainapp/story_search.html', {
+        'query': query,
+        'results': results,
+    })
+
+@require_GET
+def similar_story(request):
+    """Earlier story with a near-identical prompt, offered while a fresh one generates"""
+    match = find_similar_generation(request.GET.get('prompt', ''), settings.PROMPT_SUGGEST_THRESHOLD)
+    if not match:
+        return JsonResponse({'match': None})
+    story_id, similarity = match
+    return JsonResponse({'match': {
+        'id': story_id,
+        'url': reverse('story_detail', args=[story_id]),
+        'similarity': round(similarity, 3),
+    }})
+
+@staff_member_required
+@require_GET
+def metrics(request):
+    """Admission control, result cache, image index, database and memory counters for this worker process (staff only)"""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'generate': admission_metrics(),
+        'result_cache': get_result_cache().metrics(),
+        'image_index': image_index_metrics(),
+        'database': database_metrics(),
+        'memory': memory_metrics(),
+    })
+
+@staff_member_required
+@require_GET
+@replica_reads
+def export_stories(request, export_format):
+    """Streaming bulk export of saved stories, as NDJSON or a ZIP with the scene images (see mainapp/export.py)"""
+    since_param = request.GET.get('since', '')
+    try:
+        since = parse_date(since_param)
+    except ValueError:
+        # Well formed but not a real date, e.g. 2024-13-45
+        since = None
+    if since_param and since is None:
+        return HttpResponseBadRequest("since must be a date as YYYY-MM-DD")
+    # Resolved now: the body is generated after the view (and replica_reads) has returned
+    queryset = stories_for_export(since, router.db_for_read(StoryGeneration))
+    if export_format == 'zip':
+        response = StreamingHttpResponse(export_zip(queryset, settings.EXPORT_CHUNK_SIZE), content_type='application/zip')
+    else:
+        response = StreamingHttpResponse(export_ndjson(queryset, settings.EXPORT_CHUNK_SIZE),
+                                         content_type='application/x-ndjson; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="stories.{export_format}"'
+    return response
+
+@staff_member_required
+@require_GET
+def memory_debug(request):
+    """
+    tracemalloc report for this worker process: top allocation sites, or
+    the diff between snapshots ?from=<id>&to=<id or now> (see mainapp/memprofile.py)
+    """
+    group_by = request.GET.get('group', 'lineno')
+    if group_by not in ('lineno', 'filename', 'traceback'):
+        group_by = 'lineno'
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 200)
+    except ValueError:
+        limit = 20
+    try:
+        report = memory_report(request.GET.get('from'), request.GET.get('to'), group_by, limit)
+    except (KeyError, ValueError):
+        raise Http404("No such snapshot")
+    return JsonResponse(report)
+
+def _pooled_generation(request, user_prompt: str) -> Optional[StoryGeneration]:
+    """Unserved warm-pool story for the prompt, when the request asks for the pool's settings"""
+    if request.POST.get('length', settings.STORY_DEFAULT_LENGTH) != settings.STORY_POOL_LENGTH:
+        return None
+    if request.POST.get('image_source', settings.IMAGE_SOURCE) != settings.IMAGE_SOURCE:
+        return None
+    try:
+        return claim_pooled_story(user_prompt)
+    except Exception:
+        logger.exception("Story pool lookup failed")
+        return None
+
+
+def _generated_with(length: str, image_source: str) -> Q:
+    """Stories generated with a tier and source; rows from before they were recorded used the defaults"""
+    same_length = Q(length=length)
+    if length == settings.STORY_DEFAULT_LENGTH:
+        same_length |= Q(length='')
+    same_source = Q(image_source=image_source)
+    if image_source == settings.IMAGE_SOURCE:
+        same_source |= Q(image_source='')
+    return same_length & same_source
+
+
+def _reusable_result(request, user_prompt: str) -> Optional[CachedResult]:
+    """
+    Stored generation whose prompt is close enough to serve instead of calling
+    the APIs, when it was generated with the requested length and image source
+    """
+    try:
+        match = find_similar_generation(user_prompt, settings.PROMPT_REUSE_THRESHOLD)
+    except Exception:
+        logger.exception("Prompt similarity lookup failed")
+        return None
+    if not match:
+        return None
+    length = get_tier(request.POST.get('length', settings.STORY_DEFAULT_LENGTH)).name
+    image_source = get_image_source(request.POST.get('image_source')).name
+    if not StoryGeneration.objects.filter(_generated_with(length, image_source), pk=match[0]).exists():
+        return None
+    return get_result(match[0])
+
+
+def _fresh_form_context(request, user_prompt: str) -> dict:
+    """What the "generate a fresh one" form posts back"""
+    return {
+        'requested_prompt': user_prompt,
+        'requested_length': request.POST.get('length', ''),
+        'requested_image_source': request.POST.get('image_source', ''),
+    }
+
+@admission_control
 def generate_story(request):
-    """Generate story using Perplexity API with enhanced debugging and error handling"""
-    logger.info(f"Generate story view called with method: {request.method}")
-    
+    """Generate story through the configured LLM providers with enhanced debugging and error handling"""
     if request.method == 'POST':
+        stages = {}
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
         try:
             user_prompt = request.POST.get('prompt', '').strip()
-            logger.info(f"User prompt: {user_prompt[:100]}...")
+            logger.debug("User prompt: %.100s", user_prompt)
             
             if not user_prompt:
                 return render(request, 'mainapp/home.html', {'error': 'Please provide a prompt'})
+
+            panels = panel_count(request.POST.get('panels'))
+            # Pooled and reused stories are single scenes, so storyboards always generate
+            if not request.POST.get('fresh') and not panels:
+                pooled = _pooled_generation(request, user_prompt)
+                if pooled:
+                    logger.info("Serving pooled story %s", pooled.pk, extra={
+                        'event': 'story_pool_hit', 'story_id': pooled.pk, 'total_ms': elapsed_ms(started),
+                    })
+                    context = get_result(pooled.pk, pooled).context()
+                    context.update(pooled=True, **_fresh_form_context(request, user_prompt))
+                    return render(request, _result_template_name(), context)
+
+                reused = _reusable_result(request, user_prompt)
+                if reused:
+                    record_access(reused.story_id)
+                    logger.info("Reusing story %s for near-duplicate prompt", reused.story_id,
+                                extra={'event': 'story_reused', 'story_id': reused.story_id})
+                    context = reused.context()
+                    context.update(reused=True, **_fresh_form_context(request, user_prompt))
+                    return render(request, _result_template_name(), context)
             
-            if not PERPLEXITY_API_KEY:
-                logger.error("No API key found")
+            router = get_router()
+            if not router.has_configured_provider():
+                logger.error("No LLM provider configured")
                 return render(request, 'mainapp/result.html', {
                     'prompt': user_prompt,
                     'story': 'Error: PERPLEXITY_API_KEY not found in environment variables. Please check your .env file.',
@@ -286,209 +376,50 @@ def generate_story(request):
                     'background_image_url': '', 'combined_image_url': '',
                 })
 
-            logger.info("Building Perplexity API request...")
-            
-            # Simplified messages for better compatibility
-            messages = [
-                {
-                    "role": "system",
-                    "content": "You are a creative storytelling assistant. Respond only with valid JSON containing story, character, and background fields."
-                },
-                {
-                    "role": "user", 
-                    "content": f"""Write a creative story about: {user_prompt}
-
-Respond with this exact JSON format:
-{{"story": "your story here", "character": "detailed character description", "background": "detailed scene description"}}"""
-                }
-            ]
-
-            headers = {
-                "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "sonar",
-                "messages": messages,
-                "max_tokens": 1500,
-                "temperature": 0.7
-            }
-            
-            logger.info(f"Sending request to: {PERPLEXITY_BASE_URL}/chat/completions")
-            
-            response = requests.post(
-                f"{PERPLEXITY_BASE_URL}/chat/completions", 
-                headers=headers, 
-                json=payload,
-                timeout=30
-            )
-            
-            logger.info(f"Response status code: {response.status_code}")
-            
-            if response.status_code != 200:
-                error_text = response.text
-                logger.error(f"API Error Response: {error_text}")
+            tier = get_tier(request.POST.get('length', settings.STORY_DEFAULT_LENGTH))
+            image_source = get_image_source(request.POST.get('image_source'))
+
+            try:
+                result = run_pipeline(user_prompt, tier, image_source, router=router, stages=stages, panels=panels)
+            except ProviderError as e:
+                logger.error("LLM provider error: %s", e, extra={'provider': e.provider, 'status_code': e.status_code})
+                story = f'API Error ({e.status_code}): {e}' if e.status_code else f'Error: {e}'
                 return render(request, 'mainapp/result.html', {
                     'prompt': user_prompt,
-                    'story': f'API Error ({response.status_code}): {error_text}',
+                    'story': story,
                     'character': '', 'background': '', 'character_image_url': '',
                     'background_image_url': '', 'combined_image_url': '',
                 })
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            # Safe debugging with type checking
-            logger.info(f"API Response type: {type(data)}")
-            logger.info(f"API Response keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-            
-            # Safe content extraction
-            ai_text = ""
-            
-            try:
-                # Check if response has expected structure
-                if isinstance(data, dict) and 'choices' in data:
-                    choices = data['choices']
-                    logger.info(f"Choices type: {type(choices)}, length: {len(choices) if isinstance(choices, list) else 'Not a list'}")
-                    
-                    if isinstance(choices, list) and len(choices) > 0:
-                        first_choice = choices[0]
-                        logger.info(f"First choice type: {type(first_choice)}")
-                        
-                        if isinstance(first_choice, dict):
-                            logger.info(f"First choice keys: {list(first_choice.keys())}")
-                            
-                            # Try different content extraction methods
-                            if 'message' in first_choice:
-                                message = first_choice['message']
-                                if isinstance(message, dict) and 'content' in message:
-                                    ai_text = message['content']
-                                    logger.info("✅ Extracted from message.content")
-                            
-                            elif 'delta' in first_choice:
-                                delta = first_choice['delta']
-                                if isinstance(delta, dict) and 'content' in delta:
-                                    ai_text = delta['content']
-                                    logger.info("✅ Extracted from delta.content")
-                            
-                            elif 'text' in first_choice:
-                                ai_text = first_choice['text']
-                                logger.info("✅ Extracted from choice.text")
-                            
-                            elif 'content' in first_choice:
-                                ai_text = first_choice['content']
-                                logger.info("✅ Extracted from choice.content")
-                        
-                        else:
-                            logger.error(f"First choice is not a dict: {first_choice}")
-                    
-                    else:
-                        logger.error("Choices is empty or not a list")
-                
-                # Alternative extraction methods
-                elif isinstance(data, dict):
-                    if 'content' in data:
-                        ai_text = data['content']
-                        logger.info("✅ Extracted from data.content")
-                    elif 'response' in data:
-                        ai_text = data['response']
-                        logger.info("✅ Extracted from data.response")
-                    elif 'text' in data:
-                        ai_text = data['text']
-                        logger.info("✅ Extracted from data.text")
-                
-                else:
-                    logger.error(f"Unexpected response format: {type(data)}")
-                    
-            except Exception as parse_error:
-                logger.error(f"Error during content extraction: {parse_error}")
-                import traceback
-                logger.error(f"Extraction traceback: {traceback.format_exc()}")
-            
-            # Final check for content
-            if not ai_text:
-                logger.error("Could not extract any content from response")
-                logger.error(f"Full response (first 500 chars): {str(data)[:500]}...")
-                
-                # Try to use the entire response as fallback
-                if isinstance(data, str):
-                    ai_text = data
-                elif isinstance(data, dict):
-                    ai_text = str(data)
-                else:
-                    return render(request, 'mainapp/result.html', {
-                        'prompt': user_prompt,
-                        'story': f'Error: Could not extract content from API response. Response type: {type(data)}',
-                        'character': '', 'background': '', 'character_image_url': '',
-                        'background_image_url': '', 'combined_image_url': '',
-                    })
-
-            logger.info(f"Successfully extracted AI text: {ai_text[:200]}...")
 
-            # Clean and parse the extracted text
-            clean_text = strip_markdown_fences(ai_text)
-            logger.info(f"Clean text for parsing: {clean_text[:200]}...")
-
-            # Try JSON parsing with comprehensive fallback
-            try:
-                result_json = json.loads(clean_text)
-                story_text = result_json.get('story', '')
-                character_desc = result_json.get('character', '')
-                background_desc = result_json.get('background', '')
-                logger.info("✅ JSON parsing successful")
-                
-                # Ensure we have content
-                if not story_text:
-                    story_text = clean_text
-                if not character_desc:
-                    character_desc = f"A character from the story: {user_prompt}"
-                if not background_desc:
-                    background_desc = f"The setting for the story: {user_prompt}"
-                    
-            except json.JSONDecodeError as json_error:
-                logger.error(f"JSON parsing failed: {json_error}")
-                logger.info("Using fallback text parsing")
-                
-                # Use the full text as story if JSON parsing fails
-                story_text = clean_text
-                character_desc = f"A character from this story about {user_prompt}"
-                background_desc = f"The setting of this story about {user_prompt}"
-
-            logger.info("Starting image generation...")
-            
-            # Generate images with enhanced descriptions
-            character_image_url = get_image_url(character_desc) if character_desc else ""
-            background_image_url = get_image_url(background_desc) if background_desc else ""
-            
-            # Create combined scene
-            logger.info("Creating combined scene...")
-            combined_image_url = ""
-            if character_image_url and background_image_url:
-                combined_image_url = ImageMerger.create_coherent_scene(
-                    character_image_url, 
-                    background_image_url
-                )
-            
-            if not combined_image_url:
-                combined_image_url = background_image_url or character_image_url
-
-            logger.info("Rendering result template...")
-            
-            template_name = 'mainapp/resultUIUX.html' if settings.UI_MODE == "high" else 'mainapp/result.html'
-            
-            return render(request, template_name, {
+            generation = result.generation
+            if generation:
+                cache_result(generation, result.combined_image)
+            logger.info("Story generated", extra={
+                'event': 'story_generated',
+                'story_id': generation.pk if generation else None,
+                'tier': tier.name,
+                'image_source': image_source.name,
+                'total_ms': elapsed_ms(started),
+                'cpu_ms': round((time.thread_time() - cpu_started) * 1000, 1),
+                **stages,
+            })
+            return render(request, _result_template_name(), {
                 'prompt': user_prompt,
-                'story': story_text,
-                'character': character_desc,
-                'background': background_desc,
-                'character_image_url': character_image_url,
-                'background_image_url': background_image_url,
-                'combined_image_url': combined_image_url,
+                'story': result.story,
+                'character': result.character,
+                'background': result.background,
+                'character_image_url': result.character_image_url,
+                'background_image_url': result.background_image_url,
+                'combined_image_url': generation.get_scene_url() if generation else result.combined_image_url,
+                'permalink': generation.get_absolute_url() if generation else '',
+                'storyboard': result.storyboard,
+                'character_placeholder': generation.character_image_placeholder if generation else '',
+                'background_placeholder': generation.background_image_placeholder if generation else '',
+                'scene_placeholder': generation.combined_image_placeholder if generation else '',
             })
 
         except requests.exceptions.Timeout:
-            logger.error("Request timed out")
+            logger.error("Request timed out", extra={'total_ms': elapsed_ms(started), **stages})
             return render(request, 'mainapp/result.html', {
                 'prompt': user_prompt if 'user_prompt' in locals() else '',
                 'story': 'Error: The API request timed out. Please try again.',
@@ -497,9 +428,7 @@ Respond with this exact JSON format:
             })
         
         except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            import traceback
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.exception("Unexpected error generating story", extra={'total_ms': elapsed_ms(started), **stages})
             return render(request, 'mainapp/result.html', {
                 'prompt': user_prompt if 'user_prompt' in locals() else 'Unknown',
                 'story': f'Unexpected Error: {str(e)}',
@@ -507,5 +436,4 @@ Respond with this exact JSON format:
                 'background_image_url': '', 'combined_image_url': '',
             })
 
-    logger.info("GET request - redirecting to home")
-    return home(request)
+    return _render_home(request)
@@ -1,11 +1,24 @@
 #!/bin/bash
 echo "Starting Django application..."
 
-# Collect static files
-python manage.py collectstatic --noinput
+# Collect static files and run database migrations, skipping either when unchanged
+python manage.py startup_tasks
 
-# Run database migrations
-python manage.py migrate --noinput
+# Refill the warm story pool during off-peak hours, beside the web server.
+# Off by default: set STORY_POOL_SCHEDULER=true on one instance (a database
+# lock stops concurrent refills anyway, but each loop would keep polling it).
+if [ "${STORY_POOL_SCHEDULER:-false}" = "true" ]; then
+    python manage.py refill_story_pool --loop &
+fi
 
-# Start Gunicorn server
-gunicorn --bind=0.0.0.0 --timeout 600 story_generator.wsgi:application
+# Apply the retention policies (RETENTION_* settings) during RETENTION_HOURS,
+# in a low-priority process beside the web server. Off by default like the
+# pool scheduler: set RETENTION_SCHEDULER=true on one instance, or run
+# `python manage.py apply_retention` from cron instead.
+if [ "${RETENTION_SCHEDULER:-false}" = "true" ]; then
+    python manage.py apply_retention --loop &
+fi
+
+# Start Gunicorn. Worker model, threads, timeouts and preloading come from
+# gunicorn.conf.py, which sizes them from settings (story_generator/server.py).
+gunicorn -c gunicorn.conf.py
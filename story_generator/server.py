@@ -0,0 +1,96 @@
+"""
+Production server sizing, read by gunicorn.conf.py.
+
+Generation is I/O-bound: a request spends seconds waiting on the LLM and
+image upstreams and well under a second of CPU on compositing. One sync
+worker per instance therefore idles the CPU while blocking every other
+client. Threaded (gthread) workers keep the CPU busy: with an I/O:CPU
+ratio r, a worker needs about 1 + r threads to saturate one core, and one
+worker per core sidesteps the GIL for the CPU-bound part.
+
+All inputs come from settings (SERVER_* and the upstream timeouts), so the
+same numbers drive any other server setup.
+"""
+import importlib.util
+import math
+import os
+from typing import Dict
+
+from django.conf import settings
+
+WORKER_CLASSES = {
+    'gthread': 'gthread',
+    'gevent': 'gevent',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+
+def cpu_count() -> int:
+    """CPUs this process may run on (honours container CPU affinity)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def request_deadline() -> float:
+    """
+    Worst-case seconds a generation can legitimately take: every routed LLM
+    provider timing out in turn during failover, both image fetches timing
+    out, plus headroom for compositing and the database write.
+    """
+    llm = sum(settings.LLM_PROVIDERS[name].get('TIMEOUT', 30) for name in settings.LLM_ROUTING)
+    image_timeouts = [source.get('TIMEOUT', 0) for source in settings.IMAGE_SOURCES.values()]
+    images = 2 * max(image_timeouts, default=0)
+    return llm + images + settings.SERVER_CPU_HEADROOM
+
+
+def worker_threads() -> int:
+    """Request threads per worker, resolved in settings (enough to keep a core busy at SERVER_IO_CPU_RATIO)"""
+    return settings.SERVER_THREADS
+
+
+def _worker_class() -> str:
+    name = settings.SERVER_WORKER_CLASS
+    if name == 'auto':
+        # The views and database driver block, so threads beat greenlets unless
+        # gevent has been opted into explicitly (it needs monkeypatched psycopg2)
+        name = 'gthread'
+    if name not in WORKER_CLASSES:
+        raise ValueError(f"SERVER_WORKER_CLASS must be one of auto, {', '.join(WORKER_CLASSES)}; got {name!r}")
+    module = {'gevent': 'gevent', 'uvicorn': 'uvicorn'}.get(name)
+    if module and importlib.util.find_spec(module) is None:
+        raise ValueError(f"SERVER_WORKER_CLASS={name} requires the {module} package")
+    return name
+
+
+def gunicorn_options() -> Dict[str, object]:
+    """Gunicorn settings for this machine; explicit SERVER_* values override the computed ones"""
+    cpus = cpu_count()
+    worker_class = _worker_class()
+    threads = worker_threads()
+    deadline = request_deadline()
+
+    options = {
+        # Uvicorn workers serve the ASGI entry point; the others serve WSGI
+        'wsgi_app': 'story_generator.asgi:application' if worker_class == 'uvicorn' else 'story_generator.wsgi:application',
+        'bind': settings.SERVER_BIND,
+        'worker_class': WORKER_CLASSES[worker_class],
+        'workers': settings.SERVER_WORKERS or cpus,
+        # A hung worker is only killed once a request could not still be legitimately running
+        'timeout': math.ceil(deadline),
+        # On reload/recycle, in-flight generations get the full deadline to finish
+        'graceful_timeout': math.ceil(deadline),
+        'keepalive': settings.SERVER_KEEPALIVE,
+        'max_requests': settings.SERVER_MAX_REQUESTS,
+        # Stagger recycling so workers don't all restart at once
+        'max_requests_jitter': max(1, settings.SERVER_MAX_REQUESTS // 10) if settings.SERVER_MAX_REQUESTS else 0,
+        'preload_app': settings.WSGI_PRELOAD,
+    }
+    if worker_class == 'gthread':
+        options['threads'] = threads
+    elif worker_class == 'gevent':
+        options['worker_connections'] = threads
+    if os.path.isdir('/dev/shm'):
+        # Heartbeat files on tmpfs: a slow container disk can't stall the arbiter's liveness check
+        options['worker_tmp_dir'] = '/dev/shm'
+    return options
@@ -11,15 +11,16 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import math
 import os
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Load environment variables from .env file (an explicit path skips the directory search)
+load_dotenv(BASE_DIR / '.env')
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -60,6 +61,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mainapp.logs.RequestIdMiddleware',
+    'mainapp.memprofile.MemoryProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files on Azure
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -121,6 +124,49 @@ else:
         }
     }
 
+# Connection reuse (see mainapp/db.py). Each worker thread keeps its connection
+# for DATABASE_CONN_MAX_AGE seconds (0 = reconnect per request), checking it is
+# alive before reuse. DATABASE_POOL uses Django's connection pool instead
+# (PostgreSQL with psycopg 3 only: pip install "psycopg[binary,pool]", which
+# requirements.txt leaves out since psycopg2 is the default driver) with the
+# given minimum and maximum size.
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", "600"))
+DATABASE_CONN_HEALTH_CHECKS = os.getenv("DATABASE_CONN_HEALTH_CHECKS", "True").lower() == "true"
+DATABASE_POOL = os.getenv("DATABASE_POOL", "False").lower() == "true"
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "2"))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+# Optional read replica for gallery and search reads, as a database URL
+# (sqlite:///replica.sqlite3 works for local testing); empty = primary only
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL", "")
+
+if DATABASE_REPLICA_URL:
+    import dj_database_url
+    DATABASES['replica'] = dj_database_url.parse(DATABASE_REPLICA_URL)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+if DATABASE_POOL and any(_db['ENGINE'] == 'django.db.backends.postgresql' for _db in DATABASES.values()):
+    import importlib.util
+    if importlib.util.find_spec('psycopg') is None or importlib.util.find_spec('psycopg_pool') is None:
+        from django.core.exceptions import ImproperlyConfigured
+        raise ImproperlyConfigured(
+            'DATABASE_POOL needs psycopg 3 with its pool; pip install "psycopg[binary,pool]" '
+            'or unset DATABASE_POOL to use persistent connections (DATABASE_CONN_MAX_AGE)'
+        )
+
+for _database in DATABASES.values():
+    if DATABASE_POOL and _database['ENGINE'] == 'django.db.backends.postgresql':
+        _database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': DATABASE_POOL_MIN_SIZE,
+            'max_size': DATABASE_POOL_MAX_SIZE,
+        }
+        # Pooled connections go back to the pool after each request
+        _database['CONN_MAX_AGE'] = 0
+    else:
+        _database['CONN_MAX_AGE'] = DATABASE_CONN_MAX_AGE
+    _database['CONN_HEALTH_CHECKS'] = DATABASE_CONN_HEALTH_CHECKS
+
+DATABASE_ROUTERS = ['mainapp.db.ReplicaRouter']
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 AUTH_PASSWORD_VALIDATORS = [
@@ -180,6 +226,235 @@ UI_MODE = os.getenv("UI_MODE", "high").lower()
 # API Configuration
 PERPLEXITY_API_KEY = os.getenv("PERPLEXITY_API_KEY")
 
+# LLM providers (see mainapp/llm.py). LLM_ROUTING lists the providers allowed to
+# serve requests; healthy ones are tried cheapest first, failing over in turn.
+# Set LLM_ROUTING=local to run the whole pipeline offline against the stub.
+LLM_PROVIDERS = {
+    'perplexity': {
+        'BACKEND': 'mainapp.llm.PerplexityProvider',
+        'API_KEY': PERPLEXITY_API_KEY,
+        'MODEL': os.getenv("PERPLEXITY_MODEL", "sonar"),
+        'TIMEOUT': float(os.getenv("PERPLEXITY_TIMEOUT", "30")),
+        'COST_PER_1K_TOKENS': 1.0,
+    },
+    'local': {
+        'BACKEND': 'mainapp.llm.LocalStubProvider',
+        'LATENCY': float(os.getenv("LLM_STUB_LATENCY", "0")),
+        'JITTER': float(os.getenv("LLM_STUB_JITTER", "0")),
+        'COST_PER_1K_TOKENS': 0.0,
+    },
+}
+LLM_ROUTING = [name.strip() for name in os.getenv("LLM_ROUTING", "perplexity").split(",") if name.strip()]
+
+# Image sources (see mainapp/image_sources.py). IMAGE_SOURCE is the default;
+# a request may pick another configured source with image_source=<name>.
+# "procedural" renders locally with no network, for offline use and benchmarks.
+IMAGE_SOURCES = {
+    'pollinations': {
+        'BACKEND': 'mainapp.image_sources.PollinationsSource',
+        'TIMEOUT': float(os.getenv("POLLINATIONS_TIMEOUT", "10")),
+    },
+    'procedural': {
+        'BACKEND': 'mainapp.image_sources.ProceduralSource',
+    },
+}
+IMAGE_SOURCE = os.getenv("IMAGE_SOURCE", "pollinations")
+# Stream the story response and start fetching images as soon as their
+# descriptions are complete, overlapping the LLM call (see mainapp/streaming.py)
+LLM_STREAM_PIPELINE = os.getenv("LLM_STREAM_PIPELINE", "True").lower() == "true"
+# A stream that breaks off is retried as a plain completion only while at least
+# this many seconds of the routed providers' combined TIMEOUT remain
+LLM_STREAM_FALLBACK_MIN_SECONDS = float(os.getenv("LLM_STREAM_FALLBACK_MIN_SECONDS", "10"))
+# Per-process thread pool for image downloads (I/O bound), shared by storyboards
+# and the streamed pipeline's prefetching
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))
+# Fetches queued or running at once; further submissions wait for a slot
+IMAGE_FETCH_MAX_PENDING = int(os.getenv("IMAGE_FETCH_MAX_PENDING", "32"))
+
+# Story length tiers: response max_tokens and the budget the user's prompt is clipped to
+STORY_LENGTH_TIERS = {
+    'short': {
+        'max_tokens': int(os.getenv("STORY_MAX_TOKENS_SHORT", "600")),
+        'max_prompt_tokens': int(os.getenv("STORY_MAX_PROMPT_TOKENS_SHORT", "150")),
+    },
+    'medium': {
+        'max_tokens': int(os.getenv("STORY_MAX_TOKENS_MEDIUM", "1500")),
+        'max_prompt_tokens': int(os.getenv("STORY_MAX_PROMPT_TOKENS_MEDIUM", "300")),
+    },
+    'long': {
+        'max_tokens': int(os.getenv("STORY_MAX_TOKENS_LONG", "2500")),
+        'max_prompt_tokens': int(os.getenv("STORY_MAX_PROMPT_TOKENS_LONG", "500")),
+    },
+}
+STORY_DEFAULT_LENGTH = os.getenv("STORY_DEFAULT_LENGTH", "medium")
+
+# Page caching
+# Rendered story permalink pages are cached until the record changes or this expires.
+# Saves and deletes only clear the cache of the process making them unless the cache
+# is shared (REDIS_URL), so keep this as short as the results cache
+STORY_PAGE_CACHE_TIMEOUT = int(os.getenv("STORY_PAGE_CACHE_TIMEOUT", str(60 * 60)))
+# Browser max-age for the home page (revalidated with ETag afterwards)
+HOME_PAGE_MAX_AGE = int(os.getenv("HOME_PAGE_MAX_AGE", "300"))
+# Per-process cache of generation results (see mainapp/results.py), bounded by bytes
+STORY_RESULT_CACHE_BYTES = int(os.getenv("STORY_RESULT_CACHE_BYTES", str(64 * 1024 * 1024)))
+# Share of that budget composed scenes may use; beyond it only their text stays cached
+STORY_RESULT_CACHE_IMAGE_BYTES = int(os.getenv("STORY_RESULT_CACHE_IMAGE_BYTES", str(32 * 1024 * 1024)))
+STORY_RESULT_CACHE_TIMEOUT = int(os.getenv("STORY_RESULT_CACHE_TIMEOUT", str(60 * 60)))
+
+# Stories per gallery page
+STORY_LIST_PAGE_SIZE = int(os.getenv("STORY_LIST_PAGE_SIZE", "24"))
+# Maximum results returned by story search
+STORY_SEARCH_LIMIT = int(os.getenv("STORY_SEARCH_LIMIT", "20"))
+# Queries with more matches than this skip full relevance ranking (see mainapp/search.py)
+STORY_SEARCH_RANK_WINDOW = int(os.getenv("STORY_SEARCH_RANK_WINDOW", "500"))
+
+# Near-duplicate prompt reuse (similarity is Jaccard over prompt shingles, 0-1)
+# At or above REUSE the stored story is served instead of calling the APIs;
+# at or above SUGGEST the earlier story is offered while a fresh one generates
+PROMPT_REUSE_THRESHOLD = float(os.getenv("PROMPT_REUSE_THRESHOLD", "0.9"))
+PROMPT_SUGGEST_THRESHOLD = float(os.getenv("PROMPT_SUGGEST_THRESHOLD", "0.5"))
+# Seconds between pulls of prompts saved by other workers
+PROMPT_INDEX_SYNC_INTERVAL = int(os.getenv("PROMPT_INDEX_SYNC_INTERVAL", "30"))
+
+# Warm story pool (see mainapp/pool.py, refilled by `manage.py refill_story_pool`)
+# Seeded theme prompts, separated by "|"
+STORY_POOL_THEMES = [theme.strip() for theme in os.getenv("STORY_POOL_THEMES", "").split("|") if theme.strip()]
+# Unserved stories kept per theme
+STORY_POOL_SIZE = int(os.getenv("STORY_POOL_SIZE", "5"))
+# A claim that leaves a theme with fewer unserved stories than this refills
+# the pool in a background thread, at any hour; 0 leaves refills to the scheduler
+STORY_POOL_LOW_WATER = int(os.getenv("STORY_POOL_LOW_WATER", "2"))
+# Also pool the TRENDING most repeated prompts (at least MIN_COUNT times among the
+# newest WINDOW on-demand stories of the last DAYS days); 0 disables
+STORY_POOL_TRENDING = int(os.getenv("STORY_POOL_TRENDING", "10"))
+STORY_POOL_TRENDING_MIN_COUNT = int(os.getenv("STORY_POOL_TRENDING_MIN_COUNT", "3"))
+STORY_POOL_TRENDING_WINDOW = int(os.getenv("STORY_POOL_TRENDING_WINDOW", "5000"))
+STORY_POOL_TRENDING_DAYS = int(os.getenv("STORY_POOL_TRENDING_DAYS", "7"))
+# Prompt-to-theme similarity (same scale as PROMPT_REUSE_THRESHOLD) needed to serve from the pool
+STORY_POOL_MATCH_THRESHOLD = float(os.getenv("STORY_POOL_MATCH_THRESHOLD", "0.7"))
+STORY_POOL_LENGTH = os.getenv("STORY_POOL_LENGTH", STORY_DEFAULT_LENGTH)
+# Local hours (TIME_ZONE) the scheduler may refill in, e.g. "1-6" or "22-6"; empty = any time
+STORY_POOL_OFF_PEAK_HOURS = os.getenv("STORY_POOL_OFF_PEAK_HOURS", "1-6")
+# Seconds between scheduler refill passes
+STORY_POOL_REFILL_INTERVAL = int(os.getenv("STORY_POOL_REFILL_INTERVAL", "600"))
+
+# Near-duplicate image reuse (see mainapp/phash.py); distances are bits out of 64
+# A new story whose character and background are both within IMAGE_DEDUPE_DISTANCE
+# of an earlier story's reuses its composed scene; a freshly composed scene within
+# IMAGE_DEDUPE_SCENE_DISTANCE of a stored one shares that file. False disables both.
+IMAGE_DEDUPE = os.getenv("IMAGE_DEDUPE", "True").lower() == "true"
+IMAGE_DEDUPE_DISTANCE = int(os.getenv("IMAGE_DEDUPE_DISTANCE", "6"))
+IMAGE_DEDUPE_SCENE_DISTANCE = int(os.getenv("IMAGE_DEDUPE_SCENE_DISTANCE", "4"))
+# Seconds between pulls of image hashes saved by other workers
+IMAGE_HASH_SYNC_INTERVAL = int(os.getenv("IMAGE_HASH_SYNC_INTERVAL", "30"))
+
+# Composed scene size in pixels (see mainapp/compositing.py). Scenes over
+# SCENE_TILE_PIXELS are composited in strips of about that many pixels, so
+# per-request memory beyond the output frame itself does not grow with the size
+SCENE_WIDTH = int(os.getenv("SCENE_WIDTH", "800"))
+SCENE_HEIGHT = int(os.getenv("SCENE_HEIGHT", "600"))
+SCENE_TILE_PIXELS = int(os.getenv("SCENE_TILE_PIXELS", str(1024 * 1024)))
+
+# Memory profiling (see mainapp/memprofile.py): trace allocations with tracemalloc,
+# keeping MEMORY_PROFILING_FRAMES frames each, and keep the last
+# MEMORY_PROFILING_SNAPSHOTS pipeline stage snapshots for /debug/memory/ (0 = none)
+MEMORY_PROFILING = os.getenv("MEMORY_PROFILING", "False").lower() == "true"
+MEMORY_PROFILING_FRAMES = int(os.getenv("MEMORY_PROFILING_FRAMES", "5"))
+MEMORY_PROFILING_SNAPSHOTS = int(os.getenv("MEMORY_PROFILING_SNAPSHOTS", "16"))
+
+# Rows fetched per database round trip by the bulk export (see mainapp/export.py)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+
+# Retention (see mainapp/retention.py), applied by `manage.py apply_retention`; 0 disables a policy.
+# Nothing runs it by default: set RETENTION_SCHEDULER=true on one instance so startup.sh
+# starts `apply_retention --loop`, or schedule a single pass from cron, e.g.
+#   0 3 * * *  cd /path/to/project && python manage.py apply_retention
+# Stories older than RETENTION_MAX_AGE_DAYS and not viewed in that time are deleted
+# unless viewed at least RETENTION_KEEP_ACCESS_COUNT times; scenes older than
+# RETENTION_COMPACT_AFTER_DAYS are re-encoded as WebP (at most RETENTION_COMPACT_MAX_WIDTH
+# wide); past RETENTION_MAX_MEDIA_MB of scenes the least viewed stories go first
+RETENTION_MAX_AGE_DAYS = int(os.getenv("RETENTION_MAX_AGE_DAYS", "0"))
+RETENTION_KEEP_ACCESS_COUNT = int(os.getenv("RETENTION_KEEP_ACCESS_COUNT", "5"))
+RETENTION_COMPACT_AFTER_DAYS = int(os.getenv("RETENTION_COMPACT_AFTER_DAYS", "0"))
+RETENTION_COMPACT_QUALITY = int(os.getenv("RETENTION_COMPACT_QUALITY", "75"))
+RETENTION_COMPACT_MAX_WIDTH = int(os.getenv("RETENTION_COMPACT_MAX_WIDTH", "1280"))
+RETENTION_MAX_MEDIA_MB = int(os.getenv("RETENTION_MAX_MEDIA_MB", "0"))
+# Rows per delete or compaction batch (each its own short transaction), and seconds
+# to pause between batches so the job never hogs the database or disk
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.5"))
+# Seconds an unreferenced scene file is kept before the orphan sweep deletes it;
+# longer than STORY_RESULT_CACHE_TIMEOUT, which may still name a replaced file
+RETENTION_ORPHAN_GRACE = int(os.getenv("RETENTION_ORPHAN_GRACE", str(2 * 60 * 60)))
+# Seconds between passes with --loop, local hours (TIME_ZONE) they may run in,
+# and how much the job lowers its CPU priority
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+RETENTION_HOURS = os.getenv("RETENTION_HOURS", "2-5")
+RETENTION_NICENESS = int(os.getenv("RETENTION_NICENESS", "10"))
+# Seconds between writes of each worker's buffered story view counts
+STORY_ACCESS_FLUSH_INTERVAL = int(os.getenv("STORY_ACCESS_FLUSH_INTERVAL", "30"))
+
+# Storyboard mode (see mainapp/storyboard.py): most panels a request may ask for,
+# size of each panel, and panels per row before the strip wraps into a grid
+STORYBOARD_MAX_PANELS = int(os.getenv("STORYBOARD_MAX_PANELS", "6"))
+STORYBOARD_PANEL_WIDTH = int(os.getenv("STORYBOARD_PANEL_WIDTH", "640"))
+STORYBOARD_PANEL_HEIGHT = int(os.getenv("STORYBOARD_PANEL_HEIGHT", "480"))
+STORYBOARD_COLUMNS = int(os.getenv("STORYBOARD_COLUMNS", "3"))
+# Per-process thread pool shared by all storyboard requests for panel
+# compositing (CPU bound, so about one per core)
+STORYBOARD_COMPOSE_WORKERS = int(os.getenv("STORYBOARD_COMPOSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Admission control for /generate/ (see mainapp/admission.py)
+# Concurrent generations per worker process, and how many more may wait for a
+# slot. 0 = derive from SERVER_THREADS (3/4 running, 1/8 queued), leaving the
+# worker's threads free so cheap pages are still served under overload. The
+# limit is per worker: an instance runs up to this times SERVER_WORKERS (one
+# worker per CPU by default) generations at once.
+GENERATE_MAX_CONCURRENCY_PER_WORKER = int(os.getenv("GENERATE_MAX_CONCURRENCY_PER_WORKER", "0"))
+GENERATE_MAX_QUEUE_PER_WORKER = int(os.getenv("GENERATE_MAX_QUEUE_PER_WORKER", "0"))
+# Seconds a queued generation waits for a slot before getting a 503
+GENERATE_QUEUE_TIMEOUT = float(os.getenv("GENERATE_QUEUE_TIMEOUT", "10"))
+# Per-client token bucket: BURST generations at once, refilled at PER_MINUTE (0 disables)
+GENERATE_RATE_LIMIT_BURST = int(os.getenv("GENERATE_RATE_LIMIT_BURST", "5"))
+GENERATE_RATE_LIMIT_PER_MINUTE = float(os.getenv("GENERATE_RATE_LIMIT_PER_MINUTE", "10"))
+# request.META key holding the client address when behind a proxy, e.g. HTTP_X_FORWARDED_FOR.
+# It is only read on connections from RATE_LIMIT_TRUSTED_PROXIES (addresses or CIDR
+# ranges, comma-separated), since anyone else can send it; App Service's front ends
+# connect from private addresses
+RATE_LIMIT_CLIENT_IP_HEADER = os.getenv(
+    "RATE_LIMIT_CLIENT_IP_HEADER", "HTTP_X_FORWARDED_FOR" if os.getenv('WEBSITE_HOSTNAME') else ""
+)
+RATE_LIMIT_TRUSTED_PROXIES = [
+    proxy.strip() for proxy in os.getenv(
+        "RATE_LIMIT_TRUSTED_PROXIES",
+        "10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,169.254.0.0/16,127.0.0.1" if os.getenv('WEBSITE_HOSTNAME') else "",
+    ).split(",") if proxy.strip()
+]
+
+# Import and warm the app when wsgi.py is loaded (see mainapp/startup.py); with
+# gunicorn --preload this happens once in the master and workers fork warm
+WSGI_PRELOAD = os.getenv("WSGI_PRELOAD", "True").lower() == "true"
+
+# Production server (gunicorn.conf.py, sized by story_generator/server.py)
+# 'auto' picks gthread; gevent and uvicorn must be installed to be selected
+SERVER_WORKER_CLASS = os.getenv("SERVER_WORKER_CLASS", "auto")
+SERVER_BIND = os.getenv("SERVER_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+# 0 = one worker per CPU
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "0"))
+SERVER_MAX_THREADS = int(os.getenv("SERVER_MAX_THREADS", "32"))
+# Wall time spent waiting on upstreams per unit of CPU time in a generation.
+# Measure it from the "Story generated" log lines as (total_ms - cpu_ms) / cpu_ms.
+SERVER_IO_CPU_RATIO = float(os.getenv("SERVER_IO_CPU_RATIO", "15"))
+# Request threads per worker; 0 = enough to keep a core busy at SERVER_IO_CPU_RATIO
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "0")) or min(SERVER_MAX_THREADS, math.ceil(1 + SERVER_IO_CPU_RATIO))
+# Seconds added to the upstream timeouts for compositing and saving
+SERVER_CPU_HEADROOM = float(os.getenv("SERVER_CPU_HEADROOM", "10"))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+# Recycle workers after this many requests (0 disables)
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "1000"))
+# ...or as soon as a worker's resident memory passes this many MiB (0 disables)
+WORKER_MAX_RSS_MB = int(os.getenv("WORKER_MAX_RSS_MB", "0"))
+
 # You can add more custom settings here as needed
 # OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # If you plan to use OpenAI
 # HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")  # If you plan to use HuggingFace
@@ -210,29 +485,39 @@ if not DEBUG:
     SECURE_HSTS_INCLUDE_SUBDOMAINS = True
     SECURE_HSTS_PRELOAD = True
 
-# Logging configuration for production debugging
+# Logging: one JSON object per line (LOG_FORMAT=text for plain dev output),
+# tagged with the request id and written off the request thread.
+# With LOG_LEVEL=DEBUG, debug payloads are kept for LOG_DEBUG_SAMPLE_RATE of requests.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
+        'json': {
+            '()': 'mainapp.logs.JsonFormatter',
         },
         'simple': {
-            'format': '{levelname} {message}',
+            'format': '{levelname} [{request_id}] {name}: {message}',
             'style': '{',
         },
     },
+    'filters': {
+        'request_id': {
+            '()': 'mainapp.logs.RequestIdFilter',
+        },
+        'debug_sample': {
+            '()': 'mainapp.logs.DebugSampleFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
-        },
-        'file': {
-            'class': 'logging.FileHandler',
-            'filename': BASE_DIR / 'django.log',
-            'formatter': 'verbose',
+            'class': 'mainapp.logs.QueueStreamHandler',
+            'formatter': 'json' if LOG_FORMAT == 'json' else 'simple',
+            'filters': ['request_id', 'debug_sample'],
         },
     },
     'root': {
@@ -245,9 +530,9 @@ LOGGING = {
             'level': 'INFO' if DEBUG else 'WARNING',
             'propagate': False,
         },
-        'mainapp': {  # Your app-specific logging
+        'mainapp': {
             'handlers': ['console'],
-            'level': 'INFO',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     },